@@ -1,13 +1,28 @@
 import re
 import os
+import json
+import time
 import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
 from dotenv import load_dotenv
-from mysql.connector import pooling
-from pool import PoolManager
-from typing import Optional,Union,List,Any
+from pool import PoolManager,PoolView
+import sqlAst
+from resultCache import normalize_statement
+from deadline import Deadline,DeadlineExceeded
+from metrics import registry as metrics
+from typing import Optional,Union,List,Any,Iterator,Tuple,Dict
 load_dotenv()
 
 MAX_ROWS = 1000
+STREAM_BATCH = int(os.getenv("CHATDB_STREAM_BATCH",500))
+# Seconds past a statement's budget before the client-side watchdog sends KILL QUERY
+KILL_GRACE = float(os.getenv("CHATDB_KILL_GRACE",1.0))
+# ER_QUERY_TIMEOUT (max_execution_time) and ER_QUERY_INTERRUPTED (KILL QUERY)
+_INTERRUPTED = {3024,1317}
+_LEADING_SELECT = re.compile(r"^\s*SELECT\b(\s*/\*\+)?",re.IGNORECASE)
 
 import re
 
@@ -20,67 +35,184 @@ class MySQLDialectGuard:
     Enforces MySQL-specific SQL syntax.
     """
 
-    # PostgreSQL-only or non-MySQL constructs
-    FORBIDDEN_PATTERNS = [
-        r"\bILIKE\b",
-        r"\bRETURNING\b",
-        r"\bFILTER\s*\(",
-        r"::\w+",
-        r"\bSERIAL\b",
-        r"\bON\s+CONFLICT\b",
-        r"\bLIMIT\s+ALL\b",
-    ]
-
-    # TEMP TABLE is illegal in MySQL (must be TEMPORARY)
-    TEMP_TABLE_PATTERN = re.compile(
-        r"\bCREATE\s+TEMP\s+TABLE\b",
-        re.IGNORECASE
-    )
-
     @classmethod
     def enforce_mysql(cls, sql: str) -> str:
         sql_clean = sql.strip()
 
-        # Hard block forbidden constructs
-        for pattern in cls.FORBIDDEN_PATTERNS:
-            if re.search(pattern, sql_clean, re.IGNORECASE):
-                raise SQLDialectError(
-                    f"Non-MySQL SQL detected: {pattern}"
-                )
-
-        # Normalize TEMP TABLE → TEMPORARY TABLE
-        if cls.TEMP_TABLE_PATTERN.search(sql_clean):
-            sql_clean = cls.TEMP_TABLE_PATTERN.sub(
-                "CREATE TEMPORARY TABLE",
-                sql_clean
-            )
+        # Non-MySQL constructs (ILIKE, ::casts, FILTER, RETURNING, LIMIT ALL) are found on the cached token stream
+        error = sqlAst.analyze(sql_clean).error
+        if error is not None and error.kind == "dialect":
+            raise SQLDialectError(str(error))
 
         return sql_clean
 
 class SQLSafetyGuard:
-    READ_ONLY_PATTERN = re.compile(
-        r"^\s*(WITH\s+[\s\S]+?\s+SELECT|SELECT)\b",
-        re.IGNORECASE
-    )
+    @classmethod
+    def enforce_read_only(cls, sql: str) -> None:
+        # Reuses the parse made by MySQLDialectGuard / ExecutionPlanValidator
+        error = sqlAst.analyze(sql).error
+        if error is not None:
+            raise RuntimeError(str(error))
 
-    FORBIDDEN_PATTERN = re.compile(
-        r"\b(INSERT|UPDATE|DELETE|DROP|ALTER|TRUNCATE|CREATE|REPLACE|GRANT|REVOKE)\b",
-        re.IGNORECASE
-    )
+
+class QueryCostError(RuntimeError):
+    """
+    Raised before execution when EXPLAIN estimates a statement over budget;
+    the message is written to be handed back to the model for re-planning.
+    """
+    def __init__(self,message:str,cost:float=0.0,rows:float=0.0) -> None:
+        super().__init__(message)
+        self.cost = cost
+        self.rows = rows
+
+
+class QueryCostGuard:
+    """
+    Optional pre-execution gate: runs EXPLAIN FORMAT=JSON on the checked-out
+    connection and rejects statements whose estimated cost or examined rows
+    exceed the budget. Estimates are cached per user key and normalised statement.
+
+    CHATDB_COST_GATE: off (default), warn (log only) or reject
+    """
+    mode = os.getenv("CHATDB_COST_GATE","off")
+    max_cost = float(os.getenv("CHATDB_MAX_QUERY_COST",1e6))
+    max_rows = float(os.getenv("CHATDB_MAX_EXAMINED_ROWS",1e7))
+    cache_size = int(os.getenv("CHATDB_EXPLAIN_CACHE",1024))
+    ttl = float(os.getenv("CHATDB_EXPLAIN_TTL",300))
+    _estimates:OrderedDict = OrderedDict()
+    _lock = threading.Lock()
+    counters = {"explains":0,"cache_hits":0,"rejected":0,"warned":0}
 
     @classmethod
-    def enforce_read_only(cls, sql: str) -> None:
-        sql_clean = sql.strip()
+    def enforce(cls,conn,key:str,sql:str,params=None,prepared:bool=False)->None:
+        if cls.mode == "off":
+            return
+        estimate = cls.estimate(conn,key,sql,params,prepared)
+        if estimate is None:
+            return
+        cost,rows,_ = estimate
+        if cost <= cls.max_cost and rows <= cls.max_rows:
+            return
+        message = (
+            f"Query rejected before execution: estimated cost {cost:,.0f} over up to {rows:,.0f} rows "
+            f"exceed the budget (cost {cls.max_cost:,.0f}, rows {cls.max_rows:,.0f}). "
+            f"Filter earlier, join on indexed keys or aggregate instead. Statement: {sql}"
+        )
+        with cls._lock:
+            cls.counters["warned" if cls.mode == "warn" else "rejected"] += 1
+        if cls.mode == "warn":
+            print(message)
+            return
+        raise QueryCostError(message,cost=cost,rows=rows)
 
-        if not cls.READ_ONLY_PATTERN.match(sql_clean):
-            raise RuntimeError(
-                "Only SELECT or WITH SELECT queries are allowed"
-            )
+    @classmethod
+    def estimate(cls,conn,key:str,sql:str,params=None,prepared:bool=False)->Optional[Tuple[float,float,float]]:
+        cache_key = (key,normalize_statement(sql),repr(params))
+        now = time.monotonic()
+        with cls._lock:
+            cached = cls._estimates.get(cache_key)
+            if cached and cached[1] > now:
+                cls._estimates.move_to_end(cache_key)
+                cls.counters["cache_hits"] += 1
+                return cached[0]
+        try:
+            # ? placeholders are only understood by a prepared statement
+            with metrics.span("sql.explain"),conn.cursor(prepared=prepared) as cursor:
+                cursor.execute(f"EXPLAIN FORMAT=JSON {sql}",params)
+                plan = json.loads(cursor.fetchone()[0])
+        except Exception as e:
+            # The statement itself will surface the real error
+            print(f"EXPLAIN failed, skipping the cost gate: {e}")
+            return None
+        estimate = cls._parse_explain(plan)
+        with cls._lock:
+            cls.counters["explains"] += 1
+            cls._estimates[cache_key] = (estimate,now + cls.ttl)
+            while len(cls._estimates) > cls.cache_size:
+                cls._estimates.popitem(last=False)
+        return estimate
 
-        if cls.FORBIDDEN_PATTERN.search(sql_clean):
-            raise RuntimeError(
-                "Query contains forbidden keywords (DDL/DML not allowed)"
-            )
+    @staticmethod
+    def _parse_explain(plan:dict)->Tuple[float,float,float]:
+        """
+        (total cost, largest row estimate, result rows) from either EXPLAIN JSON
+        format: v1 query_cost / rows_examined_per_scan / rows_produced_per_join,
+        or v2 (MySQL 8.3+) estimated_total_cost / estimated_rows.
+        """
+        cost,rows = 0.0,0.0
+        stack = [plan]
+        while stack:
+            node = stack.pop()
+            if isinstance(node,list):
+                stack.extend(node)
+                continue
+            if not isinstance(node,dict):
+                continue
+            for name,value in node.items():
+                if name in ("query_cost","estimated_total_cost"):
+                    cost = max(cost,float(value))
+                elif name in ("rows_examined_per_scan","rows_produced_per_join","estimated_rows"):
+                    rows = max(rows,float(value))
+                elif isinstance(value,(dict,list)):
+                    stack.append(value)
+        result_rows = QueryCostGuard._result_rows(plan)
+        return cost,rows,rows if result_rows is None else result_rows
+
+    @staticmethod
+    def _result_rows(plan:dict)->Optional[float]:
+        # v2: the root is the final operation
+        if "estimated_rows" in plan:
+            return float(plan["estimated_rows"])
+        block = plan.get("query_block",{})
+        # v1: look through sort/group/distinct wrappers to the final join;
+        # GROUP BY makes this an upper bound
+        wrappers = ("ordering_operation","grouping_operation","duplicates_removal","windowing")
+        while any(w in block for w in wrappers):
+            block = next(block[w] for w in wrappers if w in block)
+        if "nested_loop" in block:
+            block = block["nested_loop"][-1]
+        table = block.get("table",{})
+        if "rows_produced_per_join" in table:
+            return float(table["rows_produced_per_join"])
+        return None
+
+
+class TruncatedResult(list):
+    """
+    The first `limit` rows of a result that had more. estimated_total is the
+    optimizer's row estimate for the full result (None when EXPLAIN failed).
+    """
+    truncated = True
+
+    def __init__(self,rows:List[dict],limit:int,estimated_total:Optional[int]=None) -> None:
+        super().__init__(rows)
+        self.limit = limit
+        self.estimated_total = estimated_total
+
+    def with_rows(self,rows:List[dict])->"TruncatedResult":
+        return TruncatedResult(rows,self.limit,self.estimated_total)
+
+
+@dataclass
+class ResultBatch:
+    """
+    One chunk of a streamed result: rows are plain tuples sharing a single
+    column header instead of one dict per row.
+    """
+    columns : Tuple[str,...]
+    field_types : Tuple[int,...]
+    rows : List[tuple]
+    # Per column: binary charset (BINARY/VARBINARY/BLOB rather than CHAR/VARCHAR/TEXT)
+    binary : Tuple[bool,...] = ()
+
+    def __len__(self)->int:
+        return len(self.rows)
+
+    def as_dicts(self)->List[dict]:
+        return [dict(zip(self.columns,row)) for row in self.rows]
+
+    def columnar(self)->Dict[str,list]:
+        return {col:list(values) for col,values in zip(self.columns,zip(*self.rows))} if self.rows else {col:[] for col in self.columns}
 
 
 class Mysql:
@@ -89,7 +221,7 @@ class Mysql:
         self.username = username
         self.password = password
         self.port = port
-        self.pool:Optional[pooling.MySQLConnectionPool] = None
+        self.pool:Optional[PoolView] = None
         
     
     def make_identity(self,db_name:str):
@@ -110,6 +242,7 @@ class Mysql:
             raise RuntimeError("Connecting pool is not initialised")
         sql = MySQLDialectGuard.enforce_mysql(sql)
         SQLSafetyGuard.enforce_read_only(sql)
+        sql = sqlAst.bounded(sql,MAX_ROWS+1)
         conn = self.pool.get_connection()  
         try:  
             with conn.cursor(dictionary=True,buffered=False) as cursor:
@@ -117,7 +250,8 @@ class Mysql:
                 if cursor.with_rows:
                     rows = cursor.fetchmany(MAX_ROWS+1)
                     if len(rows) > MAX_ROWS:
-                        raise RecursionError("Result is too large.. try asking limit or aggregation result in your query")
+                        cursor.fetchall()
+                        return TruncatedResult(rows[:MAX_ROWS],MAX_ROWS)
                     return rows
                 else:
                     conn.commit()
@@ -130,23 +264,218 @@ class Mysql:
             conn.close()
 
     @classmethod
-    def execute(cls,key:str,sql:str,params:Optional[Union[List[Any],tuple]]=None)->Union[List[dict],int,None]: 
+    @contextmanager
+    def session(cls,key:str,snapshot:bool=False)->Iterator[Any]:
+        """
+        Pins one pooled connection for a whole plan so its steps share a single
+        checkout (and a single reset_session on return). With snapshot=True the
+        steps run inside one read-only, consistent-snapshot transaction and all
+        see the same data.
+        """
+        conn = PoolManager.get_pool(user_key=key).get_connection()
+        try:
+            if snapshot:
+                conn.start_transaction(consistent_snapshot=True,readonly=True)
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            finally:
+                conn.close()
+
+    @classmethod
+    def execute(cls,key:str,sql:str,params:Optional[Union[List[Any],tuple]]=None,max_rows:Optional[int]=MAX_ROWS,conn=None,deadline:Optional[Deadline]=None,prepared:bool=False)->Union[List[dict],int,None]: 
+        with metrics.span("sql",pinned=conn is not None):
+            with metrics.span("sql.validate"):
+                sql = MySQLDialectGuard.enforce_mysql(sql)
+                SQLSafetyGuard.enforce_read_only(sql)
+            if deadline is not None:
+                deadline.check("executing the statement")
+            # The server stops after max_rows+1 rows instead of producing the whole result
+            bounded = sqlAst.bounded(sql,max_rows+1) if max_rows is not None else sql
+            if conn is not None:
+                # Pinned by the caller (Mysql.session): leave transaction and checkout alone
+                QueryCostGuard.enforce(conn,key,bounded,params,prepared)
+                result = cls._run_limited(key,conn,bounded,params,max_rows,True,deadline,prepared)
+                return cls._estimate_truncated(conn,key,sql,params,result,prepared)
+            with metrics.span("pool.checkout"):
+                conn = PoolManager.get_pool(user_key=key).get_connection()  
+            try:  
+                QueryCostGuard.enforce(conn,key,bounded,params,prepared)
+                result = cls._run_limited(key,conn,bounded,params,max_rows,False,deadline,prepared)
+                return cls._estimate_truncated(conn,key,sql,params,result,prepared)
+            finally:
+                conn.close()
+
+    @staticmethod
+    def _estimate_truncated(conn,key:str,sql:str,params,result,prepared:bool=False):
+        if isinstance(result,TruncatedResult):
+            # One EXPLAIN of the unbounded statement, cached per normalised statement
+            estimate = QueryCostGuard.estimate(conn,key,sql,params,prepared)
+            if estimate is not None:
+                result.estimated_total = int(estimate[2])
+        return result
+
+    @classmethod
+    def _run_limited(cls,key:str,conn,sql:str,params,max_rows:Optional[int],pinned:bool,deadline:Optional[Deadline],prepared:bool=False)->Union[List[dict],int,None]:
+        """
+        Runs sql with the deadline's remaining budget enforced by MySQL itself:
+        a MAX_EXECUTION_TIME hint for plain SELECTs, the max_execution_time
+        session variable otherwise (WITH ... SELECT, prepared statements). A
+        watchdog and deadline.cancel() send KILL QUERY for anything the server limit misses.
+        """
+        if deadline is None:
+            return cls._run(conn,sql,params,max_rows,pinned,prepared)
+        remaining = deadline.remaining()
+        session_limit = False
+        if remaining is not None:
+            ms = max(1,int(remaining*1000))
+            # A prepared statement keeps its text stable, so it always takes the session variable
+            if not prepared and _LEADING_SELECT.match(sql):
+                sql = _LEADING_SELECT.sub(lambda m: f"SELECT /*+ MAX_EXECUTION_TIME({ms})" + ("" if m.group(1) else " */"),sql,count=1)
+            else:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET SESSION max_execution_time = %s",(ms,))
+                session_limit = True
+        connection_id = conn.connection_id
+        running = [True]
+        running_lock = threading.Lock()
+        def kill()->None:
+            # Holding the lock keeps the connection from going back to the pool
+            # (and running someone else's statement) while KILL QUERY is in flight
+            with running_lock:
+                if running[0]:
+                    cls.kill_query(key,connection_id)
+        token = deadline.on_cancel(kill)
+        watchdog = None
+        if remaining is not None:
+            watchdog = threading.Timer(remaining + KILL_GRACE,deadline.cancel)
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            return cls._run(conn,sql,params,max_rows,pinned,prepared)
+        except Exception as e:
+            if getattr(e,"errno",None) in _INTERRUPTED:
+                raise DeadlineExceeded(f"Statement stopped by the request deadline: {e}") from e
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            deadline.discard(token)
+            with running_lock:
+                running[0] = False
+            if session_limit and pinned:
+                # Later statements on the pinned connection must not inherit the limit
+                with conn.cursor() as cursor:
+                    cursor.execute("SET SESSION max_execution_time = 0")
+
+    @staticmethod
+    def kill_query(key:str,connection_id:int)->None:
+        """
+        Stops the statement running on connection_id, from a second connection;
+        the victim connection itself stays usable.
+        """
+        conn = PoolManager.get_pool(user_key=key).get_connection(timeout=KILL_GRACE)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"KILL QUERY {int(connection_id)}")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _binary_column(description:tuple)->bool:
+        # mysql-connector: (name, type, ..., null_ok, flags[, charset]); charset 63 is binary
+        if len(description) > 8 and description[8] is not None:
+            return description[8] == 63
+        return len(description) > 7 and bool((description[7] or 0) & 128)
+
+    @classmethod
+    def stream(cls,key:str,sql:str,params:Optional[Union[List[Any],tuple]]=None,batch_size:Optional[int]=None,max_rows:Optional[int]=None,conn=None)->Iterator[ResultBatch]:
+        """
+        Yields the result of sql in ResultBatch chunks of batch_size rows from an
+        unbuffered cursor, so memory stays bounded by one batch. Stops with
+        RecursionError once more than max_rows rows arrive (None = no cap).
+        """
         sql = MySQLDialectGuard.enforce_mysql(sql)
         SQLSafetyGuard.enforce_read_only(sql)
-        conn = PoolManager.get_pool(user_key=key).get_connection()  
+        batch_size = batch_size or STREAM_BATCH
+        pinned = conn is not None
+        if not pinned:
+            conn = PoolManager.get_pool(user_key=key).get_connection()
+        try:
+            QueryCostGuard.enforce(conn,key,sql,params)
+        except Exception:
+            if not pinned:
+                conn.close()
+            raise
+        finished = False
+        try:
+            cursor = conn.cursor(buffered=False)
+            try:
+                cursor.execute(sql,params)
+                columns = tuple(cursor.column_names)
+                field_types = tuple(d[1] for d in cursor.description or ())
+                binary = tuple(cls._binary_column(d) for d in cursor.description or ())
+                seen = 0
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    seen += len(rows)
+                    if max_rows is not None and seen > max_rows:
+                        raise RecursionError("Result is too large.. try asking limit or aggregation result in your query")
+                    yield ResultBatch(columns=columns,field_types=field_types,rows=rows,binary=binary)
+                finished = True
+            finally:
+                if pinned and not finished:
+                    # The caller keeps the connection: drain what the server is still sending
+                    conn.consume_results()
+                if finished or pinned:
+                    cursor.close()
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            print(f"Error in executing the query {e}")
+            raise
+        finally:
+            if finished and not pinned:
+                conn.close()
+            elif not pinned:
+                # Unread rows would leave the connection unusable; draining a large
+                # result costs more than opening a new connection
+                conn.discard()
+
+    @staticmethod
+    def _run(conn,sql:str,params,max_rows:Optional[int],pinned:bool=False,prepared:bool=False)->Union[List[dict],int,None]:
+        # A prepared cursor belongs to the connection and is reused, so it is never closed here
+        cursor = None
         try:  
-            with conn.cursor(dictionary=True) as cursor:
+            with metrics.span("sql.cursor",prepared=prepared) as span:
+                cursor = conn.statement(sql) if prepared else conn.cursor(dictionary=True)
                 cursor.execute(sql,params)
                 if cursor.with_rows:
-                    rows = cursor.fetchmany(MAX_ROWS+1)
-                    if len(rows) > MAX_ROWS:
-                        raise RecursionError("Result is too large.. try asking limit or aggregation result in your query")
+                    # max_rows=None is reserved for internal metadata queries (schema introspection)
+                    if max_rows is None:
+                        return cursor.fetchall()
+                    rows = cursor.fetchmany(max_rows+1)
+                    span.set(rows=min(len(rows),max_rows),truncated=len(rows) > max_rows)
+                    metrics.inc("chatdb_sql_rows_total",min(len(rows),max_rows))
+                    if len(rows) > max_rows:
+                        # Read what is left (a model-written LIMIT bounded() could not lower):
+                        # an unread result makes close() fail and leaves the connection unusable
+                        cursor.fetchall()
+                        return TruncatedResult(rows[:max_rows],max_rows)
                     return rows
                 else:
-                    conn.commit()
+                    if not pinned:
+                        conn.commit()
                     return cursor.rowcount
         except Exception as e:
+            if prepared:
+                conn.forget(sql)
             print(f"Error in executing the query {e}")
             raise
         finally:
-            conn.close()
+            if cursor is not None and not prepared:
+                cursor.close()
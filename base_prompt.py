@@ -3,7 +3,11 @@ from typing import Any
 
 class BasePrompt:
     def __init__(self,table_details) -> None:
-        self.__prompt = f'''You are ChatDB, an expert database query-planning assistant.
+        self.__prompt = self._render(table_details)
+
+    @staticmethod
+    def _render(table_details) -> str:
+        return f'''You are ChatDB, an expert database query-planning assistant.
 
 Your role is to translate user questions into SAFE, SCALABLE, and EXECUTABLE
 MySQL SQL execution plans. You are part of an automated system.
@@ -77,6 +81,8 @@ FORMAT RULES:
 - NO code blocks
 - NO explanations outside the step format
 - Steps must be executable in order
+- Steps are executed independently and may run concurrently; if a step
+  must run after another, end its description with (depends on Step<M>)
 
 INVALID OUTPUT EXAMPLES:
 - ```sql ... ```
@@ -120,5 +126,8 @@ Any violation of these rules will cause the response to be rejected.
 
 The following is the user query:
 '''
-    def __call__(self) -> str:
-        return self.__prompt  
+    def __call__(self,table_details=None) -> str:
+        # A per-request (pruned) schema overrides the one the prompt was built with
+        if table_details is not None:
+            return self._render(table_details)
+        return self.__prompt
@@ -0,0 +1,414 @@
+"""
+Offline regression benchmarks: the model is a FakeGemini returning canned
+plans, the database a local MySQL with sakila and a synthetic schema.
+
+    python benchSuite.py --save bench_baseline.json
+    python benchSuite.py --compare bench_baseline.json
+
+Each scenario reports throughput, p50/p99 latency, peak Python memory and
+p50/p99 per stage (the metrics spans: llm, parse, execute, sql.cursor, ...).
+--compare exits with status 1 when a scenario regressed past --tolerance.
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from dotenv import load_dotenv
+from typing import Any,Callable,Dict,List,Optional
+import mysql.connector
+import sqlAst
+from parse import Parser
+from executer import Executer
+from init_user import InitUser
+from chatDB import models
+from fakeGemini import FakeGemini
+from metrics import registry as metrics
+from benchmark import SAKILA_PLAN
+
+load_dotenv()
+
+
+_WORDS = [
+    "account","invoice","order","product","supplier","warehouse","shipment","employee","department",
+    "customer","campaign","ticket","contract","region","payment","refund","vendor","asset","ledger",
+]
+_STATUSES = ["open","closed","pending","archived","failed"]
+
+
+def synthetic_schema(n:int,seed:int=0)->List[Dict[str,Any]]:
+    """
+    n tables; each references up to two earlier ones through `<parent>_id`.
+    """
+    rng = random.Random(seed)
+    tables = []
+    for i in range(n):
+        name = f"{rng.choice(_WORDS)}_{i}"
+        parents = rng.sample([t["name"] for t in tables],min(2,len(tables)))
+        tables.append({"name":name,"parents":parents})
+    return tables
+
+
+def plan_text(steps:List[Dict[str,Any]])->str:
+    # The shape the model is prompted to answer in
+    return "\n".join(f"Step{i}: {step['description']}\n`{step['sql']}`" for i,step in enumerate(steps,start=1))
+
+
+SAKILA_QUESTIONS = {
+    "Give me an overview of the rental business.":plan_text(SAKILA_PLAN),
+    **{f"{step['description']}?":plan_text([step]) for step in SAKILA_PLAN},
+}
+
+
+def synthetic_questions(schema:List[Dict[str,Any]],count:int=20)->Dict[str,str]:
+    questions = {}
+    for table in [t for t in schema if t["parents"]][:count]:
+        child,parent = table["name"],table["parents"][0]
+        questions[f"Total {child} amount per {parent} status, and the largest open {child}?"] = plan_text([
+            {"description":f"Amount per {parent} status","sql":f"SELECT p.status, COUNT(*) AS n, SUM(c.amount) AS total FROM {child} AS c JOIN {parent} AS p ON p.id = c.{parent}_id GROUP BY p.status;"},
+            {"description":f"Largest open {child}","sql":f"SELECT c.name, c.amount FROM {child} AS c WHERE c.status = 'open' ORDER BY c.amount DESC LIMIT 10;"},
+        ])
+    return questions
+
+
+class PlanBook:
+    """
+    FakeGemini responder: answers each known question with its canned plan.
+    """
+    def __init__(self,questions:Dict[str,str]) -> None:
+        self.questions = questions
+        self.default = next(iter(questions.values()))
+
+    def __call__(self,query)->str:
+        # A re-plan appends feedback after the question
+        return self.questions.get(query["query"].split("\n",1)[0],self.default)
+
+
+class MySQLFixture:
+    """
+    Local MySQL for the benchmarks, reached through MYSQL_HOST / MYSQL_PORT so
+    InitUser sees the same server. docker=True starts a throwaway container
+    on that port (user root) and removes it on stop().
+
+    sakila is loaded from sakila_dir (sakila-schema.sql and sakila-data.sql
+    from dev.mysql.com) when the database is missing; the synthetic database
+    is rebuilt whenever its table count differs from the one asked for.
+    """
+
+    def __init__(self,docker:bool=False,image:str="mysql:8.0",sakila_dir:Optional[str]=None) -> None:
+        self.docker = docker
+        self.image = image
+        self.sakila_dir = sakila_dir
+        self.host = os.getenv("MYSQL_HOST","localhost")
+        self.port = int(os.getenv("MYSQL_PORT",3306))
+        self.user = "root" if docker else os.getenv("MYSQL_USERNAME")
+        self.password = os.getenv("MYSQL_PASSWORD") or "chatdb-bench"
+        self.container = f"chatdb-bench-{self.port}"
+        if docker:
+            # InitUser reads the credentials from the environment
+            os.environ["MYSQL_USERNAME"] = self.user
+            os.environ["MYSQL_PASSWORD"] = self.password
+
+    def __enter__(self)->"MySQLFixture":
+        self.start()
+        return self
+
+    def __exit__(self,*exc)->None:
+        self.stop()
+
+    def start(self,timeout:float=180)->None:
+        if self.docker:
+            subprocess.run(
+                ["docker","run","-d","--rm","--name",self.container,"-e",f"MYSQL_ROOT_PASSWORD={self.password}",
+                 "-p",f"{self.port}:3306",self.image],
+                check=True,capture_output=True
+            )
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._connect().close()
+                return
+            except mysql.connector.Error as e:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"MySQL at {self.host}:{self.port} did not come up: {e}")
+                time.sleep(1)
+
+    def stop(self)->None:
+        if self.docker:
+            subprocess.run(["docker","stop",self.container],capture_output=True)
+
+    def _connect(self,database:Optional[str]=None):
+        return mysql.connector.connect(host=self.host,port=self.port,user=self.user,password=self.password,database=database)
+
+    def server_version(self)->str:
+        conn = self._connect()
+        try:
+            return conn.get_server_info()
+        finally:
+            conn.close()
+
+    def table_count(self,db_name:str)->int:
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s",(db_name,))
+            return cursor.fetchone()[0]
+        finally:
+            conn.close()
+
+    def load_sakila(self)->None:
+        if self.table_count("sakila"):
+            return
+        if not self.sakila_dir:
+            raise RuntimeError("sakila is not loaded; pass --sakila-dir with sakila-schema.sql and sakila-data.sql")
+        # The dump uses DELIMITER, which only the mysql client understands
+        if self.docker:
+            client = ["docker","exec","-i",self.container,"mysql","-uroot",f"-p{self.password}"]
+        else:
+            client = ["mysql","-h",self.host,"-P",str(self.port),"-u",self.user,f"-p{self.password}"]
+        for name in ("sakila-schema.sql","sakila-data.sql"):
+            with open(os.path.join(self.sakila_dir,name),"rb") as f:
+                subprocess.run(client,stdin=f,check=True,capture_output=True)
+
+    def load_synthetic(self,db_name:str,schema:List[Dict[str,Any]],rows:int,seed:int=0)->None:
+        if self.table_count(db_name) == len(schema):
+            return
+        print(f"Building {db_name}: {len(schema)} tables x {rows} rows")
+        rng = random.Random(seed)
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"DROP DATABASE IF EXISTS `{db_name}`")
+            cursor.execute(f"CREATE DATABASE `{db_name}`")
+            cursor.execute(f"USE `{db_name}`")
+            for table in schema:
+                refs = "".join(f", `{p}_id` INT NULL, FOREIGN KEY (`{p}_id`) REFERENCES `{p}` (id)" for p in table["parents"])
+                cursor.execute(
+                    f"CREATE TABLE `{table['name']}` (id INT PRIMARY KEY, name VARCHAR(64) NOT NULL, "
+                    f"status VARCHAR(16) NOT NULL, amount DECIMAL(10,2) NOT NULL, created_at DATETIME NOT NULL{refs})"
+                )
+                columns = ["id","name","status","amount","created_at"] + [f"{p}_id" for p in table["parents"]]
+                insert = (
+                    f"INSERT INTO `{table['name']}` ({','.join(f'`{c}`' for c in columns)}) "
+                    f"VALUES ({','.join(['%s']*len(columns))})"
+                )
+                values = [
+                    (i,f"{table['name']} {i}",rng.choice(_STATUSES),round(rng.uniform(1,1000),2),
+                     f"2024-{rng.randint(1,12):02d}-{rng.randint(1,28):02d} 12:00:00",
+                     *(rng.randint(1,rows) for _ in table["parents"]))
+                    for i in range(1,rows+1)
+                ]
+                for start in range(0,len(values),1000):
+                    cursor.executemany(insert,values[start:start+1000])
+                conn.commit()
+        finally:
+            conn.close()
+
+
+def _quantile(samples:List[float],p:float)->float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * p),len(ordered) - 1)] if ordered else 0.0
+
+
+class StageCollector:
+    """
+    Metrics sink keeping every span duration of the current scenario by stage.
+    """
+    def __init__(self) -> None:
+        self.samples:Dict[str,List[float]] = defaultdict(list)
+
+    def __call__(self,span)->None:
+        pending = [span]
+        while pending:
+            node = pending.pop()
+            self.samples[node.name].append(node.duration)
+            pending.extend(node.children)
+
+    def summary(self)->Dict[str,Dict[str,float]]:
+        return {
+            stage:{"count":len(s),"p50_ms":_quantile(s,0.5)*1000,"p99_ms":_quantile(s,0.99)*1000}
+            for stage,s in sorted(self.samples.items())
+        }
+
+
+def measure(fn:Callable[[int],Any],iterations:int,concurrency:int=1,collector:Optional[StageCollector]=None)->Dict[str,Any]:
+    """
+    fn(i) is one operation. One warm-up call, a timed pass, then a single
+    call under tracemalloc for peak memory (kept apart so tracing does not
+    skew the timings).
+    """
+    fn(0)
+    if collector is not None:
+        collector.samples.clear()
+    def timed(i:int)->float:
+        start = time.perf_counter()
+        fn(i)
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed,range(iterations)))
+    else:
+        latencies = [timed(i) for i in range(iterations)]
+    elapsed = time.perf_counter() - start
+    stages = collector.summary() if collector is not None else {}
+    tracemalloc.start()
+    fn(0)
+    _,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "iterations":iterations,
+        "concurrency":concurrency,
+        "throughput":iterations / elapsed,
+        "p50_ms":_quantile(latencies,0.5)*1000,
+        "p99_ms":_quantile(latencies,0.99)*1000,
+        "peak_kib":peak / 1024,
+        "stages":stages,
+    }
+
+
+def run_suite(
+    fixture:MySQLFixture,
+    synthetic_db:str="chatdb_synthetic",
+    synthetic_tables:int=200,
+    rows:int=2000,
+    iterations:int=50,
+    concurrency:int=8,
+    llm_latency:float=0.05,
+    only:Optional[List[str]]=None
+)->Dict[str,Any]:
+    schema = synthetic_schema(synthetic_tables)
+    fixture.load_sakila()
+    fixture.load_synthetic(synthetic_db,schema,rows)
+    books = {"sakila":SAKILA_QUESTIONS,"synthetic":synthetic_questions(schema)}
+    dbs = {"sakila":"sakila","synthetic":synthetic_db}
+
+    # Every iteration must pay for its own work; restored when the suite ends
+    saved = (InitUser.response_cache,InitUser.plan_templates,Executer.result_cache)
+    InitUser.response_cache = None
+    InitUser.plan_templates = None
+    Executer.result_cache = None
+    collector = StageCollector()
+    metrics.enabled = True
+    metrics.add_sink(collector)
+
+    results:Dict[str,Any] = {}
+    def scenario(name:str,fn:Callable[[int],Any],concurrent:bool=False)->None:
+        if only and not any(name.startswith(prefix) for prefix in only):
+            return
+        # chat() and the router print every plan and model choice
+        with redirect_stdout(io.StringIO()):
+            results[name] = measure(fn,iterations,concurrency if concurrent else 1,collector)
+        report(name,results[name])
+
+    try:
+        for label,db_name in dbs.items():
+            questions = list(books[label])
+            plans = [Parser.parseResponse(books[label][q]) for q in questions]
+            user = InitUser(os.getenv("MYSQL_USERNAME"),os.getenv("MYSQL_PASSWORD"),db_name)
+            fake = FakeGemini(responder=PlanBook(books[label]),latency={m:llm_latency for m in models})
+            user.init(api_key="fake",backend=fake)
+            user._schema_cache = None
+            executer = Executer(user._key)
+
+            scenario(f"schema.{label}",lambda i: user._build_schema(db_name))
+            def parse_cold(i:int)->None:
+                sqlAst._analyze.cache_clear()
+                Parser.parseResponse(books[label][questions[i % len(questions)]])
+            scenario(f"parse.{label}.cold",parse_cold)
+            scenario(f"parse.{label}.warm",lambda i: Parser.parseResponse(books[label][questions[i % len(questions)]]))
+            scenario(f"execute.{label}",lambda i: executer.execute(plans[i % len(plans)]))
+            scenario(f"request.{label}",lambda i: user.chat(questions[i % len(questions)]),concurrent=True)
+    finally:
+        metrics.sinks.remove(collector)
+        InitUser.response_cache,InitUser.plan_templates,Executer.result_cache = saved
+    return results
+
+
+def report(name:str,result:Dict[str,Any])->None:
+    print(
+        f"{name:<28}{result['throughput']:>10.1f}/s  p50 {result['p50_ms']:>8.2f} ms  "
+        f"p99 {result['p99_ms']:>8.2f} ms  peak {result['peak_kib']:>9.1f} KiB"
+    )
+    for stage,s in result["stages"].items():
+        print(f"    {stage:<24}{s['count']:>8}  p50 {s['p50_ms']:>8.2f} ms  p99 {s['p99_ms']:>8.2f} ms")
+
+
+def compare(current:Dict[str,Any],baseline:Dict[str,Any],tolerance:float=0.2)->List[str]:
+    """
+    Scenarios whose p50, p99 or peak memory grew, or whose throughput fell,
+    by more than tolerance against the baseline.
+    """
+    regressions = []
+    print(f"{'scenario':<28}{'p50':>10}{'p99':>10}{'throughput':>12}{'memory':>10}")
+    for name,now in current["scenarios"].items():
+        then = baseline.get("scenarios",{}).get(name)
+        if then is None:
+            continue
+        ratios = {
+            "p50":now["p50_ms"] / then["p50_ms"] if then["p50_ms"] else 1.0,
+            "p99":now["p99_ms"] / then["p99_ms"] if then["p99_ms"] else 1.0,
+            "throughput":now["throughput"] / then["throughput"] if then["throughput"] else 1.0,
+            "memory":now["peak_kib"] / then["peak_kib"] if then["peak_kib"] else 1.0,
+        }
+        print(f"{name:<28}" + "".join(f"{(ratio-1)*100:>+{w}.1f}%" for ratio,w in zip(ratios.values(),(9,9,11,9))))
+        for metric,ratio in ratios.items():
+            worse = ratio < 1 - tolerance if metric == "throughput" else ratio > 1 + tolerance
+            if worse:
+                regressions.append(f"{name} {metric} {(ratio-1)*100:+.1f}%")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ChatDB offline benchmark suite (fake LLM, local MySQL)")
+    parser.add_argument("--docker",action="store_true",help="start a throwaway MySQL container on MYSQL_PORT")
+    parser.add_argument("--image",default="mysql:8.0")
+    parser.add_argument("--sakila-dir",default=os.getenv("CHATDB_SAKILA_DIR"))
+    parser.add_argument("--synthetic-db",default="chatdb_synthetic")
+    parser.add_argument("--synthetic-tables",type=int,default=200)
+    parser.add_argument("--rows",type=int,default=2000,help="rows per synthetic table")
+    parser.add_argument("--iterations",type=int,default=50)
+    parser.add_argument("--concurrency",type=int,default=8,help="threads for full requests")
+    parser.add_argument("--llm-latency",type=float,default=0.05)
+    parser.add_argument("--only",nargs="*",help="scenario prefixes, e.g. parse execute.sakila")
+    parser.add_argument("--save",help="write the results to this JSON baseline")
+    parser.add_argument("--compare",help="JSON baseline to compare against")
+    parser.add_argument("--tolerance",type=float,default=0.2)
+    args = parser.parse_args()
+
+    with MySQLFixture(docker=args.docker,image=args.image,sakila_dir=args.sakila_dir) as fixture:
+        scenarios = run_suite(
+            fixture,args.synthetic_db,args.synthetic_tables,args.rows,
+            args.iterations,args.concurrency,args.llm_latency,args.only
+        )
+        results = {
+            "meta":{
+                "created":time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python":platform.python_version(),
+                "mysql":fixture.server_version(),
+                "synthetic_tables":args.synthetic_tables,
+                "rows":args.rows,
+                "iterations":args.iterations,
+                "concurrency":args.concurrency,
+                "llm_latency":args.llm_latency,
+            },
+            "scenarios":scenarios,
+        }
+    if args.save:
+        with open(args.save,"w",encoding="utf-8") as f:
+            json.dump(results,f,indent=2)
+        print(f"Saved {args.save}")
+    if args.compare:
+        with open(args.compare,encoding="utf-8") as f:
+            regressions = compare(results,json.load(f),args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
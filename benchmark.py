@@ -0,0 +1,435 @@
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from SQL import Mysql
+from schema import DBSchema
+from schemaFormatter import DBSchemaFormatter
+from schemaSelector import SchemaSelector
+from base_prompt import BasePrompt
+from init_user import InitUser
+
+load_dotenv()
+
+
+class RoundTripCounter:
+    """
+    Counts calls to Mysql.execute while active, i.e. database round trips.
+    """
+    def __init__(self) -> None:
+        self.calls = 0
+        self._original = None
+
+    def __enter__(self):
+        self._original = Mysql.__dict__['execute']
+        original = self._original.__func__
+
+        def counted(klass,*args,**kwargs):
+            self.calls += 1
+            return original(klass,*args,**kwargs)
+
+        Mysql.execute = classmethod(counted)
+        return self
+
+    def __exit__(self,*exc):
+        Mysql.execute = self._original
+
+
+def _timed(fn,repeat:int):
+    timings = []
+    calls = 0
+    for _ in range(repeat):
+        with RoundTripCounter() as counter:
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        calls = counter.calls
+    return calls,min(timings),sum(timings)/len(timings)
+
+
+def bench_schema(key:str,db_name:str,repeat:int=5)->None:
+    def n_plus_one():
+        tables = DBSchema.get_dbSchema(user_key=key,db_name=db_name)
+        for table in tables:
+            name = table['TABLE_NAME']
+            DBSchemaFormatter.build_TableSchemaText(name,DBSchema.get_TableSchema(user_key=key,tab_name=name))
+
+    def bulk():
+        tables = DBSchema.get_dbSchema(user_key=key,db_name=db_name)
+        columns = DBSchema.get_ColumnsSchema(user_key=key,db_name=db_name)
+        for table in tables:
+            name = table['TABLE_NAME']
+            DBSchemaFormatter.build_TableSchemaText(name,columns.get(name,[]))
+
+    print(f"Schema build on {db_name} ({repeat} runs)")
+    print(f"{'path':<12}{'round trips':>12}{'best (ms)':>12}{'mean (ms)':>12}")
+    for label,fn in (("n+1",n_plus_one),("bulk",bulk)):
+        calls,best,mean = _timed(fn,repeat)
+        print(f"{label:<12}{calls:>12}{best*1000:>12.1f}{mean*1000:>12.1f}")
+
+
+_SYNTHETIC_WORDS = [
+    "account","invoice","order","product","supplier","warehouse","shipment","employee","department",
+    "customer","campaign","ticket","contract","region","payment","refund","vendor","asset","ledger",
+    "budget","project","task","license","device","session","review","coupon","subscription","plan",
+]
+
+
+def synthetic_tables(n:int,seed:int=0)->dict:
+    """
+    Deterministic fake schema with n tables, a handful of attribute columns
+    and `<other>_id` references so FK-neighbour expansion has work to do.
+    """
+    rng = random.Random(seed)
+    names = [f"{rng.choice(_SYNTHETIC_WORDS)}_{rng.choice(_SYNTHETIC_WORDS)}_{i}" for i in range(n)]
+    tables = {}
+    for i,name in enumerate(names):
+        schema = [{"COLUMN_NAME":f"{name}_id","DATA_TYPE":"int","IS_NULLABLE":"NO","COLUMN_KEY":"PRI","EXTRA":"auto_increment"}]
+        for word in rng.sample(_SYNTHETIC_WORDS,6):
+            schema.append({"COLUMN_NAME":f"{word}_{rng.choice(['name','code','amount','date','status'])}","DATA_TYPE":"varchar","IS_NULLABLE":"YES","COLUMN_KEY":"","EXTRA":""})
+        for other in rng.sample(names[:i] or [name],min(2,i) if i else 0):
+            schema.append({"COLUMN_NAME":f"{other}_id","DATA_TYPE":"int","IS_NULLABLE":"YES","COLUMN_KEY":"MUL","EXTRA":""})
+        tables[name] = InitUser._format_table(name,schema)
+    return tables
+
+
+def live_tables(key:str,db_name:str)->dict:
+    columns = DBSchema.get_ColumnsSchema(user_key=key,db_name=db_name)
+    return {
+        row['TABLE_NAME']:InitUser._format_table(row['TABLE_NAME'],columns.get(row['TABLE_NAME'],[]))
+        for row in DBSchema.get_dbSchema(user_key=key,db_name=db_name)
+    }
+
+
+def bench_prompt(label:str,db_name:str,tables:dict,questions:list,api_key:str|None=None,repeat:int=5)->None:
+    details = "\n".join(
+        [DBSchemaFormatter.build_DBSchemaText(db_name=db_name,tables=[{'TABLE_NAME':n} for n in tables])]
+        + [t["text"] for t in tables.values()]
+    )
+    full = BasePrompt(table_details=details)
+    selector = SchemaSelector(db_name=db_name,tables=tables,min_tables=0)
+    print(f"Prompt size on {label} ({len(tables)} tables)")
+    print(f"{'question':<50}{'full chars':>12}{'pruned':>10}{'tables':>8}{'select (ms)':>13}")
+    for q in questions:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            context = selector.build_context(q)
+        elapsed = (time.perf_counter() - start) / repeat
+        pruned = BasePrompt(table_details=context)()
+        print(f"{q[:48]:<50}{len(full()):>12}{len(pruned):>10}{len(selector.select(q)):>8}{elapsed*1000:>13.2f}")
+
+    if api_key:
+        from chatDB import ChatDB
+        for name,sel in (("full",None),("pruned",selector)):
+            chat = ChatDB(api_key,details,selector=sel)
+            start = time.perf_counter()
+            for q in questions:
+                chat.chat(q)
+            print(f"end-to-end {name}: {(time.perf_counter() - start) / len(questions):.2f}s per question")
+
+
+def bench_client(api_key:str,tab_details:str,requests:int=500)->None:
+    """
+    Per-request overhead of the old ChatDB.chat (new genai.Client per question,
+    prompt rendered once per fallback model) against the shared client and a
+    single render. No model calls are made.
+    """
+    from google import genai
+    from chatDB import models
+    from chatGemini import Gemini
+    prompt = BasePrompt(table_details=tab_details)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        genai.Client(api_key=api_key)
+        for _ in models:
+            BasePrompt(table_details=tab_details)()
+    old = (time.perf_counter() - start) / requests
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        Gemini(api_key=api_key)
+        prompt(tab_details)
+    new = (time.perf_counter() - start) / requests
+
+    print(f"Client + prompt overhead over {requests} requests")
+    print(f"per-request client, per-model prompt : {old*1000:.3f} ms")
+    print(f"shared client, single prompt         : {new*1000:.3f} ms")
+    print(f"saved per request                    : {(old-new)*1000:.3f} ms")
+
+
+def _percentiles(samples:list)->str:
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(int(len(ordered) * p),len(ordered) - 1)]
+    return f"p50 {pick(0.5)*1000:.0f} ms  p99 {pick(0.99)*1000:.0f} ms"
+
+
+def bench_async(db_name:str,questions:int=1000,llm_latency:float=0.5,threads:int=16)->None:
+    """
+    Load test of InitUser.achat against the local MySQL with a stubbed LLM
+    (FakeGemini, fixed latency), compared with the blocking chat() driven by
+    a thread pool. The response cache and plan templates are disabled so
+    every question pays the LLM ("question {i}" all share one template shape).
+    """
+    from fakeGemini import FakeGemini
+    from chatDB import models
+    InitUser.response_cache = None
+    InitUser.plan_templates = None
+    fake = FakeGemini(latency={m:llm_latency for m in models})
+    user = InitUser(os.getenv("MYSQL_USERNAME"),os.getenv("MYSQL_PASSWORD"),db_name)
+    user.init(api_key="fake",backend=fake)
+    asks = [f"question {i}" for i in range(questions)]
+
+    async def timed(q):
+        start = time.perf_counter()
+        await user.achat(q)
+        return time.perf_counter() - start
+
+    async def run_async():
+        return await asyncio.gather(*(timed(q) for q in asks))
+
+    start = time.perf_counter()
+    latencies = asyncio.run(run_async())
+    elapsed = time.perf_counter() - start
+    print(f"async  : {questions} questions in {elapsed:.2f}s ({questions/elapsed:.0f} q/s)  {_percentiles(latencies)}")
+
+    def timed_sync(q):
+        start = time.perf_counter()
+        user.chat(q)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(timed_sync,asks))
+    elapsed = time.perf_counter() - start
+    print(f"sync x{threads}: {questions} questions in {elapsed:.2f}s ({questions/elapsed:.0f} q/s)  {_percentiles(latencies)}")
+
+
+SAKILA_PLAN = [
+    {"step_number":1,"description":"Films per category","sql":"SELECT c.name, COUNT(*) AS films FROM category c JOIN film_category fc ON fc.category_id = c.category_id GROUP BY c.name;"},
+    {"step_number":2,"description":"Rentals per store","sql":"SELECT i.store_id, COUNT(*) AS rentals FROM rental r JOIN inventory i ON i.inventory_id = r.inventory_id GROUP BY i.store_id;"},
+    {"step_number":3,"description":"Revenue per staff","sql":"SELECT staff_id, SUM(amount) AS revenue FROM payment GROUP BY staff_id;"},
+    {"step_number":4,"description":"Top rented films","sql":"SELECT f.title, COUNT(*) AS rentals FROM rental r JOIN inventory i ON i.inventory_id = r.inventory_id JOIN film f ON f.film_id = i.film_id GROUP BY f.title ORDER BY rentals DESC LIMIT 10;"},
+    {"step_number":5,"description":"Customers per country","sql":"SELECT co.country, COUNT(*) AS customers FROM customer cu JOIN address a ON a.address_id = cu.address_id JOIN city ci ON ci.city_id = a.city_id JOIN country co ON co.country_id = ci.country_id GROUP BY co.country ORDER BY customers DESC LIMIT 10;"},
+]
+
+
+def bench_executer(key:str,plan:list=SAKILA_PLAN,repeat:int=5)->None:
+    from executer import Executer
+    print(f"Executing a {len(plan)}-step plan ({repeat} runs)")
+    print(f"{'mode':<24}{'best (ms)':>12}{'mean (ms)':>12}")
+    # Otherwise every run after the first measures result cache hits
+    cache,Executer.result_cache = Executer.result_cache,None
+    try:
+        for label,parallel in (("sequential",1),("parallel (x3)",3),("parallel (x5)",5)):
+            executer = Executer(key,max_parallel=parallel)
+            calls,best,mean = _timed(lambda: executer.execute(plan),repeat)
+            print(f"{label:<24}{best*1000:>12.1f}{mean*1000:>12.1f}")
+    finally:
+        Executer.result_cache = cache
+
+
+def bench_session(key:str,plan:list=SAKILA_PLAN,repeat:int=5)->None:
+    from pool import PoolManager
+    pool = PoolManager.get_pool(user_key=key)
+    checkout = pool.get_connection
+    checkouts = [0]
+    def counted(*args,**kwargs):
+        checkouts[0] += 1
+        return checkout(*args,**kwargs)
+    steps = [step for step in plan if step.get('sql')]
+    def per_step():
+        return [Mysql.execute(key,step['sql']) for step in steps]
+    def pinned(snapshot:bool):
+        with Mysql.session(key,snapshot=snapshot) as conn:
+            return [Mysql.execute(key,step['sql'],conn=conn) for step in steps]
+    print(f"Executing a {len(steps)}-step plan sequentially ({repeat} runs)")
+    print(f"{'mode':<24}{'checkouts/run':>14}{'best (ms)':>12}{'mean (ms)':>12}")
+    pool.get_connection = counted
+    try:
+        for label,fn in (("checkout per step",per_step),("pinned session",lambda: pinned(False)),("pinned + snapshot",lambda: pinned(True))):
+            checkouts[0] = 0
+            _,best,mean = _timed(fn,repeat)
+            print(f"{label:<24}{checkouts[0]/repeat:>14.1f}{best*1000:>12.1f}{mean*1000:>12.1f}")
+    finally:
+        del pool.get_connection
+
+
+def bench_stream(key:str,sql:str,batch_size:int=500)->None:
+    def peak(fn):
+        tracemalloc.start()
+        start = time.perf_counter()
+        rows = fn()
+        elapsed = time.perf_counter() - start
+        _,peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return rows,elapsed,peak_bytes
+    def as_dicts():
+        return len(Mysql.execute(key,sql,max_rows=None))
+    def streamed():
+        return sum(len(batch) for batch in Mysql.stream(key,sql,batch_size=batch_size))
+    print(f"Fetching: {sql}")
+    print(f"{'mode':<28}{'rows':>10}{'time (ms)':>12}{'peak (KiB)':>12}")
+    for label,fn in (("list of dicts",as_dicts),(f"tuple batches ({batch_size})",streamed)):
+        rows,elapsed,peak_bytes = peak(fn)
+        print(f"{label:<28}{rows:>10}{elapsed*1000:>12.1f}{peak_bytes/1024:>12.1f}")
+
+
+# ~1M rows: every rental repeated 64 times
+RENTAL_EXPORT = "SELECT r.* FROM rental AS r CROSS JOIN (SELECT store_id FROM store LIMIT 1) AS s CROSS JOIN (SELECT film_id FROM film LIMIT 64) AS f"
+
+
+def bench_columnar(key:str,sql:str=RENTAL_EXPORT,batch_size:int=10000,path:str="rental_export")->None:
+    import columnar
+    import pyarrow as pa
+    def measure(fn):
+        tracemalloc.start()
+        arrow_before = pa.total_allocated_bytes()
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        _,peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result,elapsed,peak_bytes + pa.total_allocated_bytes() - arrow_before
+    def dict_rows_to_table():
+        # Today's path: dict rows, then a columnar copy for the dashboard
+        rows = Mysql.execute(key,sql,max_rows=None)
+        return pa.Table.from_pylist(rows).num_rows
+    def arrow_table():
+        return columnar.to_table(Mysql.stream(key,sql,batch_size=batch_size)).num_rows
+    def ipc_file():
+        return columnar.write_ipc(Mysql.stream(key,sql,batch_size=batch_size),f"{path}.arrow")
+    def parquet_file():
+        return columnar.write_parquet(Mysql.stream(key,sql,batch_size=batch_size),f"{path}.parquet")
+    print(f"Exporting: {sql}")
+    print(f"{'mode':<28}{'rows':>10}{'time (s)':>10}{'peak (MiB)':>12}")
+    for label,fn in (("dict rows -> table",dict_rows_to_table),("arrow batches -> table",arrow_table),("arrow -> IPC file",ipc_file),("arrow -> parquet file",parquet_file)):
+        rows,elapsed,peak_bytes = measure(fn)
+        print(f"{label:<28}{rows:>10}{elapsed:>10.2f}{peak_bytes/2**20:>12.1f}")
+
+
+# Valid statements the old regexes rejected, then statements that must be rejected
+VALIDATION_ACCEPT = [
+    "SELECT film_id, last_update FROM film WHERE rating = 'PG'",
+    "SELECT REPLACE(title, ' ', '-') AS slug FROM film",
+    "SELECT customer_id FROM payment WHERE payment_date > '2005-06-01' AND amount > 5",
+    "SELECT note FROM audit WHERE note LIKE '%DELETE%'",
+    "SELECT CONCAT(first_name, '; ', last_name) AS name FROM actor",
+    "SELECT temp FROM weather ORDER BY temp DESC LIMIT 5",
+    "WITH c AS (SELECT category_id, COUNT(*) AS n FROM film_category GROUP BY category_id) SELECT * FROM c",
+    "SELECT `update` FROM changes",
+    "SELECT create_time FROM information_schema.TABLES WHERE TABLE_SCHEMA = 'sakila'",
+    "SELECT c.name, COUNT(fc.film_id) FROM category AS c JOIN film_category AS fc ON c.category_id = fc.category_id GROUP BY c.name",
+]
+VALIDATION_REJECT = [
+    "SELECT 1; DROP TABLE film",
+    "WITH x AS (SELECT 1) DELETE FROM film",
+    "SELECT * FROM film FOR UPDATE",
+    "SELECT * FROM film INTO OUTFILE '/tmp/film.csv'",
+    "SELECT title::text FROM film",
+    "SELECT * FROM actor WHERE first_name ILIKE 'a%'",
+    "UPDATE film SET rental_rate = 0",
+    "CREATE TEMP TABLE t AS SELECT 1",
+]
+
+
+def legacy_regex_validate(sql:str)->None:
+    # The stacked regex checks from before sqlAst, for comparison only
+    import re
+    for pattern in (r"\bILIKE\b",r"\bRETURNING\b",r"\bFILTER\s*\(",r"::\w+",r"\bSERIAL\b",r"\bON\s+CONFLICT\b",r"\bLIMIT\s+ALL\b"):
+        if re.search(pattern,sql,re.IGNORECASE):
+            raise RuntimeError(pattern)
+    forbidden = r"\b(INSERT|UPDATE|DELETE|DROP|ALTER|TRUNCATE|CREATE|REPLACE|GRANT|REVOKE)\b"
+    if not re.match(r"^\s*(SELECT|WITH)\b",sql,re.IGNORECASE) or re.search(r"\bTEMP\b|\bCREATE\b",sql,re.IGNORECASE):
+        raise RuntimeError("read only")
+    if len([s for s in sql.rstrip(";").split(";") if s.strip()]) != 1 or re.search(forbidden,sql,re.IGNORECASE):
+        raise RuntimeError("unsafe")
+    if not re.match(r"^\s*(WITH\s+[\s\S]+?\s+SELECT|SELECT)\b",sql,re.IGNORECASE) or re.search(forbidden,sql,re.IGNORECASE):
+        raise RuntimeError("read only")
+
+
+def bench_validation(repeat:int=200)->None:
+    import sqlAst
+    def ast_validate(sql:str)->None:
+        sqlAst.check(sql)
+    def outcomes(validate):
+        rejected = []
+        for sql in VALIDATION_ACCEPT + VALIDATION_REJECT:
+            try:
+                validate(sql)
+                rejected.append(False)
+            except Exception:
+                rejected.append(True)
+        n = len(VALIDATION_ACCEPT)
+        return sum(rejected[:n]),sum(not r for r in rejected[n:])
+    def throughput(validate,cold:bool)->float:
+        corpus = VALIDATION_ACCEPT + VALIDATION_REJECT
+        start = time.perf_counter()
+        for _ in range(repeat):
+            if cold:
+                sqlAst._analyze.cache_clear()
+            for sql in corpus:
+                try:
+                    validate(sql)
+                except Exception:
+                    pass
+        return repeat*len(corpus) / (time.perf_counter() - start)
+    print(f"{len(VALIDATION_ACCEPT)} valid and {len(VALIDATION_REJECT)} unsafe statements, {repeat} rounds")
+    print(f"{'validator':<20}{'false rejects':>15}{'missed unsafe':>15}{'stmts/s':>12}")
+    for label,validate,cold in (("regex",legacy_regex_validate,False),("ast (cold)",ast_validate,True),("ast (cached)",ast_validate,False)):
+        false_rejects,missed = outcomes(validate)
+        print(f"{label:<20}{false_rejects:>15}{missed:>15}{throughput(validate,cold):>12.0f}")
+
+
+SAMPLE_QUESTIONS = [
+    "Find the top 3 most rented films per category.",
+    "Which actors appeared in the most films?",
+    "Total payments per customer country",
+    "Average invoice amount per supplier region",
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ChatDB micro-benchmarks")
+    parser.add_argument("bench",choices=["schema","prompt","client","async","executer","session","stream","columnar","validation"])
+    parser.add_argument("--db",default="sakila")
+    parser.add_argument("--repeat",type=int,default=5)
+    parser.add_argument("--synthetic-tables",type=int,default=1000)
+    parser.add_argument("--requests",type=int,default=500)
+    parser.add_argument("--llm-latency",type=float,default=0.5)
+    parser.add_argument("--threads",type=int,default=16)
+    parser.add_argument("--sql",default="SELECT * FROM rental JOIN payment USING (rental_id)")
+    parser.add_argument("--batch-size",type=int,default=500)
+    parser.add_argument("--live",action="store_true",help="also time end-to-end Gemini calls")
+    args = parser.parse_args()
+
+    if args.bench == "validation":
+        bench_validation(args.repeat*40)
+        raise SystemExit
+
+    db = Mysql(username=os.getenv("MYSQL_USERNAME"),password=os.getenv("MYSQL_PASSWORD"))
+    user_key = db.connectDB(args.db)
+    if args.bench == "schema":
+        bench_schema(user_key,args.db,args.repeat)
+    elif args.bench == "prompt":
+        api_key = os.getenv("GEMINI_API_KEY") if args.live else None
+        bench_prompt(args.db,args.db,live_tables(user_key,args.db),SAMPLE_QUESTIONS,api_key,args.repeat)
+        bench_prompt("synthetic","synthetic",synthetic_tables(args.synthetic_tables),SAMPLE_QUESTIONS,api_key,args.repeat)
+    elif args.bench == "client":
+        tables = live_tables(user_key,args.db)
+        bench_client(os.getenv("GEMINI_API_KEY"),"\n".join(t["text"] for t in tables.values()),args.requests)
+    elif args.bench == "async":
+        bench_async(args.db,args.requests,args.llm_latency,args.threads)
+    elif args.bench == "executer":
+        bench_executer(user_key,repeat=args.repeat)
+    elif args.bench == "session":
+        bench_session(user_key,repeat=args.repeat)
+    elif args.bench == "stream":
+        bench_stream(user_key,args.sql,args.batch_size)
+    elif args.bench == "columnar":
+        bench_columnar(user_key)
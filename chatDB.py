@@ -1,40 +1,91 @@
 from dotenv import load_dotenv
 from base_prompt import BasePrompt
 from chatGemini import Gemini,ChatResponse
-from typing import Optional
+from schemaSelector import SchemaSelector
+from valueIndex import ValueIndex
+from modelRouter import ModelRouter
+from parse import Parser
+from deadline import Deadline,DeadlineExceeded
+from metrics import registry as metrics
+import asyncio
+from typing import Optional,Iterator
+import os
 load_dotenv()
 
 models = ["gemini-3-pro-preview","gemini-3-flash-preview","gemini-2.5-flash","gemini-2.5-flash-preview-09-2025","gemini-2.5-flash-lite"]
 
 class ChatDB:
-    def __init__(self,key:str,tab_details) -> None:
+    def __init__(self,key:str,tab_details,selector:Optional[SchemaSelector]=None,backend=None,hedge:Optional[bool]=None,values:Optional[ValueIndex]=None) -> None:
         self.key = key
+        self.hedge = hedge if hedge is not None else os.getenv("CHATDB_HEDGE","0") == "1"
         self.base_prompt = BasePrompt(table_details=tab_details)
+        self.selector = selector
+        self.values = values
+        # Any object honouring the Gemini.chat contract can stand in for the real client (e.g. FakeGemini)
+        if backend is not None:
+            self.gemini = backend
+            self.router = ModelRouter(backend,models)
+        else:
+            self.gemini = Gemini(api_key=key)
+            self.router = ModelRouter.for_key(key,self.gemini,models)
 
-    def chat(self,inp:str)->str|Exception:
-        gemini = Gemini(api_key=self.key)
-        query = {}
-        try:
-            for model in models:
-                print(f"Using model {model}...")
-                query['model'] = model
-                query['query'] = inp
-                query['base_prompt'] = self.base_prompt()
-
-                response = gemini.chat(query)
-
-                if response.response:
-                    return response.response.text
-                if response.error_type in {
-                    "MODEL_ACCESS_DENIED",
-                    "MODEL_NOT_FOUND",
-                    "QUOTA_EXCEEDED"
-                }:
-                    continue
-
-                raise RuntimeError(response.error)
+    def _query(self,inp:str,feedback:Optional[str]=None)->dict:
+        # Only the tables relevant to this question are sent to the model;
+        # the prompt is rendered once and reused for every model the router tries
+        tab_details = self.selector.build_context(inp) if self.selector else None
+        query = inp
+        # Values the question names go with the question, so the cached base prompt stays the same
+        with metrics.span("values"):
+            hints = self.values.hints(inp) if self.values else ""
+        if hints:
+            query = f"{inp}\n\n{hints}"
+        if feedback:
+            query = f"{query}\n\nThe previous execution plan for this question was rejected: {feedback}\nWrite a new plan that avoids this problem."
+        return {'query':query,'base_prompt':self.base_prompt(tab_details)}
 
-            raise RuntimeError("No available Gemini model succeeded")
+    def chat(self,inp:str,feedback:Optional[str]=None,deadline:Optional[Deadline]=None)->str|Exception:
+        with metrics.span("prompt"):
+            query = self._query(inp,feedback)
+        if deadline is not None:
+            deadline.check("the model call")
+        try:
+            with metrics.span("llm",hedge=self.hedge,replan=feedback is not None):
+                if self.hedge:
+                    response = self.router.route_hedged(query,validate=Parser.parseResponse)
+                else:
+                    response = self.router.route(query)
+            if response.response:
+                # The blocking call cannot be interrupted; at least do not start the SQL late
+                if deadline is not None:
+                    deadline.check("executing the plan")
+                return response.response.text
+            raise RuntimeError(response.error)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(e)
 
+    async def achat(self,inp:str,feedback:Optional[str]=None,deadline:Optional[Deadline]=None)->str:
+        with metrics.span("prompt"):
+            query = self._query(inp,feedback)
+        if deadline is not None:
+            deadline.check("the model call")
+        timeout = deadline.remaining() if deadline is not None else None
+        try:
+            with metrics.span("llm",hedge=self.hedge,replan=feedback is not None):
+                if self.hedge:
+                    # Hedging races blocking backend calls on threads; its thread outlives a timeout
+                    call = asyncio.to_thread(self.router.route_hedged,query,validate=Parser.parseResponse)
+                else:
+                    call = self.router.aroute(query)
+                response = await asyncio.wait_for(call,timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Request deadline exceeded during the model call")
+        if response.response:
+            if deadline is not None:
+                deadline.check("executing the plan")
+            return response.response.text
+        raise RuntimeError(response.error)
+
+    def chat_stream(self,inp:str)->Iterator[str]:
+        return self.router.stream(self._query(inp))
@@ -1,3 +1,4 @@
+import threading
 from google import genai
 from google.genai.types import GenerateContentResponse
 from dotenv import load_dotenv
@@ -18,32 +19,62 @@ class ChatResponse:
     error_type : Optional[str]
 
 class Gemini:
+    # One long-lived client per API key: genai.Client is thread-safe and its
+    # underlying HTTP client keeps connections alive between requests
+    _clients:Dict[Optional[str],genai.Client] = {}
+    _lock = threading.Lock()
+
     def __init__(self,api_key=None) -> None:
         self.api_key = api_key
-        self.client = genai.Client(api_key=api_key)
-    def chat(self,query:ChatQuery) -> ChatResponse:
-        try:
-            if query["model"] in ["gemini-2.5-flash","gemini-2.5-flash-preview-09-2025","gemini-2.5-flash-lite"]:
-                content = {
-                    "role":"user",
-                    "parts":[
-                        {
-                            "text":f"{query['base_prompt']} \n\n User query :\n{query['query']}"
-                        }
-                    ]
-                }
-            else:
-                content = [
-                    {
-                        "role":"system",
-                        "parts":[{"text":query["base_prompt"]}]
-                    },
+        self.client = self.get_client(api_key)
+
+    @classmethod
+    def get_client(cls,api_key=None) -> genai.Client:
+        client = cls._clients.get(api_key)
+        if client is None:
+            with cls._lock:
+                client = cls._clients.get(api_key)
+                if client is None:
+                    client = genai.Client(api_key=api_key)
+                    cls._clients[api_key] = client
+        return client
+
+    @staticmethod
+    def _contents(query:ChatQuery):
+        if query["model"] in ["gemini-2.5-flash","gemini-2.5-flash-preview-09-2025","gemini-2.5-flash-lite"]:
+            return {
+                "role":"user",
+                "parts":[
                     {
-                        "role":"user",
-                        "parts":[{"text":query['query']}]
+                        "text":f"{query['base_prompt']} \n\n User query :\n{query['query']}"
                     }
                 ]
-                
+            }
+        return [
+            {
+                "role":"system",
+                "parts":[{"text":query["base_prompt"]}]
+            },
+            {
+                "role":"user",
+                "parts":[{"text":query['query']}]
+            }
+        ]
+
+    @staticmethod
+    def classify_error(e:Exception) -> str:
+        msg = str(e).lower()
+        if "permission" in msg or "not authorized" in msg:
+            return "MODEL_ACCESS_DENIED"
+        elif "model not found" in msg:
+            return "MODEL_NOT_FOUND"
+        elif "quota" in msg or "exceeded" in msg:
+            return "QUOTA_EXCEEDED"
+        return "TRANSIENT_ERROR"
+
+    def chat(self,query:ChatQuery) -> ChatResponse:
+        try:
+            content = self._contents(query)
             if query['model'] and query["query"]:
                 response = self.client.models.generate_content(
                     model=query["model"],
@@ -54,30 +85,25 @@ class Gemini:
             else:
                 raise KeyError("model name or input contents is not found")
         except Exception as e:
-            msg = str(e).lower()
-            #print(msg,'\n\n')
-            if "permission" in msg or "not authorized" in msg:
-                etype = "MODEL_ACCESS_DENIED"
-            elif "model not found" in msg:
-                etype = "MODEL_NOT_FOUND"
-            elif "quota" in msg or "exceeded" in msg:
-                etype = "QUOTA_EXCEEDED"
-            else:
-                etype = "TRANSIENT_ERROR"
+            return ChatResponse(response=None, error=str(e), error_type=self.classify_error(e))
+
+    async def achat(self,query:ChatQuery) -> ChatResponse:
+        """
+        Non-blocking chat() on the client's asyncio transport (client.aio).
+        """
+        try:
+            if not (query['model'] and query["query"]):
+                raise KeyError("model name or input contents is not found")
+            response = await self.client.aio.models.generate_content(
+                model=query["model"],
+                contents=self._contents(query)
+            )
+            return ChatResponse(response=response,error=None,error_type=None)
+        except Exception as e:
+            return ChatResponse(response=None, error=str(e), error_type=self.classify_error(e))
 
-            return ChatResponse(response=None, error=str(e), error_type=etype)
     def chat_stream(self,query:ChatQuery) -> Iterator[GenerateContentResponse]:
-        content = [
-                {
-                    "role":"system",
-                    "parts":[{"text":query["base_prompt"]}]
-                },
-                {
-                    "role":"user",
-                    "parts":[{"text":query['query']}]
-                }
-            ]
         return self.client.models.generate_content_stream(
                 model=query["model"],
-                contents=content
+                contents=self._contents(query)
             )
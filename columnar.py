@@ -0,0 +1,149 @@
+import os
+from decimal import Decimal
+from dotenv import load_dotenv
+from typing import Dict,Iterable,Iterator,List,Optional,Tuple
+from SQL import ResultBatch
+load_dotenv()
+
+# Optional: columnar results need pyarrow (and numpy for to_numpy)
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAS_ARROW = pa is not None
+
+# mysql-connector FieldType codes -> arrow type factory. The schema comes from
+# the cursor description alone, never from values: a column that is all NULL
+# in the first batch must still get its real type
+_INTEGER = {1,2,3,8,9,13,16}
+_DECIMAL = {0,246}
+# TINYBLOB..BLOB, VARCHAR, VAR_STRING, STRING: TEXT or BLOB by the column's charset
+_TEXTUAL = {249,250,251,252,15,253,254}
+_ARROW_TYPES = {
+    4:lambda: pa.float32(),
+    5:lambda: pa.float64(),
+    6:lambda: pa.null(),
+    7:lambda: pa.timestamp("us"),
+    10:lambda: pa.date32(),
+    11:lambda: pa.duration("us"),
+    12:lambda: pa.timestamp("us"),
+    14:lambda: pa.date32(),
+    245:lambda: pa.string(),
+    247:lambda: pa.string(),
+    248:lambda: pa.string(),
+    255:lambda: pa.binary(),
+}
+# The description carries no DECIMAL scale, so every DECIMAL column gets this one
+_DECIMAL_SCALE = int(os.getenv("CHATDB_ARROW_DECIMAL_SCALE",10))
+
+
+def _require_arrow()->None:
+    if pa is None:
+        raise ImportError("Columnar results need pyarrow: pip install pyarrow")
+
+
+def arrow_type(field_type:int,binary:bool=False):
+    _require_arrow()
+    if field_type in _INTEGER:
+        return pa.int64()
+    if field_type in _DECIMAL:
+        return pa.decimal128(38,_DECIMAL_SCALE)
+    if field_type in _TEXTUAL:
+        return pa.binary() if binary else pa.string()
+    factory = _ARROW_TYPES.get(field_type)
+    return factory() if factory else pa.string()
+
+
+def schema_of(batch:ResultBatch):
+    _require_arrow()
+    binary = batch.binary or (False,)*len(batch.columns)
+    return pa.schema([pa.field(name,arrow_type(t,b)) for name,t,b in zip(batch.columns,batch.field_types,binary)])
+
+
+def _array(values,type):
+    if pa.types.is_decimal(type):
+        # Finer values than the fixed scale are rounded instead of failing the batch
+        step = Decimal(1).scaleb(-type.scale)
+        values = [v.quantize(step) if isinstance(v,Decimal) and v.as_tuple().exponent < -type.scale else v for v in values]
+    return pa.array(values,type=type)
+
+
+def to_record_batch(batch:ResultBatch,schema=None):
+    """
+    Builds one arrow RecordBatch straight from a ResultBatch, one column buffer
+    at a time. The schema defaults to schema_of(batch); pass the first
+    batch's so later ones agree with it.
+    """
+    _require_arrow()
+    schema = schema if schema is not None else schema_of(batch)
+    columns = list(zip(*batch.rows)) if batch.rows else [()]*len(batch.columns)
+    arrays = [_array(values,field.type) for values,field in zip(columns,schema)]
+    return pa.RecordBatch.from_arrays(arrays,schema=schema)
+
+
+def record_batches(batches:Iterable[ResultBatch])->Iterator:
+    schema = None
+    for batch in batches:
+        if not batch.rows and schema is not None:
+            continue
+        schema = schema if schema is not None else schema_of(batch)
+        yield to_record_batch(batch,schema)
+
+
+def to_table(batches:Iterable[ResultBatch]):
+    _require_arrow()
+    records = list(record_batches(batches))
+    if not records:
+        return pa.table({})
+    return pa.Table.from_batches(records)
+
+
+def to_numpy(batches:Iterable[ResultBatch])->Dict[str,"np.ndarray"]:
+    """
+    One numpy array per column. Numeric columns without NULLs are zero-copy
+    views of the arrow buffers; the rest fall back to object arrays.
+    """
+    if np is None:
+        raise ImportError("to_numpy needs numpy: pip install numpy")
+    table = to_table(batches)
+    return {name:table.column(name).to_numpy() for name in table.column_names}
+
+
+def write_ipc(batches:Iterable[ResultBatch],path:str)->int:
+    """
+    Streams batches into an Arrow IPC file without building the whole table.
+    Returns the number of rows written.
+    """
+    return _write(batches,lambda schema: ipc.new_file(path,schema))
+
+
+def write_parquet(batches:Iterable[ResultBatch],path:str,compression:str="snappy")->int:
+    if pq is None:
+        raise ImportError("Parquet export needs pyarrow.parquet: pip install pyarrow")
+    return _write(batches,lambda schema: pq.ParquetWriter(path,schema,compression=compression))
+
+
+def _write(batches:Iterable[ResultBatch],open_writer)->int:
+    _require_arrow()
+    writer = None
+    rows = 0
+    try:
+        for record in record_batches(batches):
+            if writer is None:
+                writer = open_writer(record.schema)
+            writer.write_batch(record)
+            rows += record.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
@@ -0,0 +1,88 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from typing import Callable,Dict,Optional
+load_dotenv()
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    """
+    Time budget for one request, shared by the model call and every plan step.
+    Each step gets what is left, so a slow database sheds later steps instead
+    of queueing them. cancel() runs the registered callbacks (e.g. KILL QUERY
+    for the statement in flight).
+
+    seconds=None reads CHATDB_REQUEST_TIMEOUT (default 60); 0 means no limit,
+    which still gives callers a cancellation handle.
+    """
+
+    def __init__(self,seconds:Optional[float]=None,clock:Callable[[],float]=time.monotonic) -> None:
+        seconds = seconds if seconds is not None else float(os.getenv("CHATDB_REQUEST_TIMEOUT",60))
+        self._clock = clock
+        self.expires_at = clock() + seconds if seconds > 0 else None
+        self.cancelled = False
+        self._callbacks:Dict[int,Callable[[],None]] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._parent:Optional[tuple] = None
+
+    def remaining(self)->Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(0.0,self.expires_at - self._clock())
+
+    def expired(self)->bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self,what:str="request")->None:
+        if self.cancelled:
+            raise DeadlineExceeded(f"Request cancelled before {what}")
+        if self.expired():
+            raise DeadlineExceeded(f"Request deadline exceeded before {what}")
+
+    def on_cancel(self,callback:Callable[[],None])->int:
+        with self._lock:
+            self._next += 1
+            self._callbacks[self._next] = callback
+            return self._next
+
+    def discard(self,token:int)->None:
+        with self._lock:
+            self._callbacks.pop(token,None)
+
+    def child(self)->"Deadline":
+        """
+        Same expiry, cancelled along with this deadline; cancelling the child
+        leaves this one alone. detach() it when done.
+        """
+        child = Deadline(0,clock=self._clock)
+        child.expires_at = self.expires_at
+        child._parent = (self,self.on_cancel(child.cancel))
+        if self.cancelled:
+            child.cancel()
+        return child
+
+    def detach(self)->None:
+        if self._parent is not None:
+            parent,token = self._parent
+            parent.discard(token)
+            self._parent = None
+
+    def cancel(self)->None:
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancellation callback failed: {e}")
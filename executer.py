@@ -1,16 +1,190 @@
-from typing import List,Dict,Any
-from SQL import Mysql
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+from typing import List,Dict,Any,Optional,Iterator
+from SQL import Mysql,ResultBatch
+from deadline import Deadline
+from metrics import registry as metrics
+import columnar
+from resultCache import ResultCache
 
 class Executer:
-    def __init__(self,key:str) -> None:
+    # mysql-connector is blocking: async callers offload each statement to this
+    # pool, sized to the connection pool so queued work waits here instead of
+    # exhausting the pool
+    _db_executor:Optional[ThreadPoolExecutor] = None
+    # Async callers wait for a pooled connection here (bounded by the pool's max_waiters)
+    _checkout_executor:Optional[ThreadPoolExecutor] = None
+    # Runs independent plan steps concurrently (sync path)
+    _step_executor:Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+    # Shared by every user: entries are keyed by user key and checked against table data versions
+    result_cache = ResultCache() if os.getenv("CHATDB_RESULT_CACHE","1") != "0" else None
+
+    def __init__(self,key:str,max_parallel:Optional[int]=None,snapshot:Optional[bool]=None) -> None:
         self.key = key
-    def execute(self,sql_cmds:List[Dict[str,str]])->List[Any]:
+        self.max_parallel = max_parallel or int(os.getenv("CHATDB_MAX_PARALLEL_STEPS",3))
+        self.snapshot = snapshot if snapshot is not None else os.getenv("CHATDB_SNAPSHOT","0") == "1"
+
+    def execute(self,sql_cmds:List[Dict[str,str]],deadline:Optional[Deadline]=None)->List[Any]:
+        """
+        Runs the plan's steps. With a deadline, every step gets only the budget
+        left by the steps before it, and no step starts once it is spent.
+        """
+        steps = [sql for sql in sql_cmds if sql.get('sql',None)]
+        # A consistent snapshot needs every step on one connection
+        if self.max_parallel > 1 and not self.snapshot and self._has_independent_steps(steps):
+            with metrics.span("execute",steps=len(steps),mode="parallel"):
+                return self._execute_parallel(steps,deadline)
+        with metrics.span("execute",steps=len(steps),mode="pinned"):
+            return self._execute_pinned(steps,deadline)
+
+    def _execute_pinned(self,steps:List[Dict[str,str]],deadline:Optional[Deadline]=None)->List[Any]:
         results = []
-        for sql in sql_cmds:
-            stmt = sql.get('sql',None)
-            if not stmt:
-                continue
-            res = Mysql.execute(self.key,stmt)
-            results.append(res)
+        with Mysql.session(self.key,snapshot=self.snapshot) as conn:
+            for sql in steps:
+                results.append(self.execute_step(sql,conn,deadline))
         
-        return results
\ No newline at end of file
+        return results
+
+    def session(self):
+        return Mysql.session(self.key,snapshot=self.snapshot)
+
+    def execute_columnar(self,sql_cmds:List[Dict[str,str]],batch_size:Optional[int]=None,max_rows:Optional[int]=None)->List[Any]:
+        """
+        Like execute(), but each step result is a pyarrow.Table built batch by
+        batch from the cursor, never as dict rows. Needs pyarrow.
+        """
+        steps = [sql for sql in sql_cmds if sql.get('sql',None)]
+        results = []
+        with self.session() as conn:
+            for sql in steps:
+                results.append(columnar.to_table(Mysql.stream(self.key,sql['sql'],batch_size=batch_size,max_rows=max_rows,conn=conn)))
+        return results
+
+    @staticmethod
+    def _dependencies(steps:List[Dict[str,str]])->List[set]:
+        position = {step.get('step_number',i+1):i for i,step in enumerate(steps)}
+        return [{position[d] for d in step.get('depends_on',[]) if d in position} for step in steps]
+
+    @classmethod
+    def _has_independent_steps(cls,steps:List[Dict[str,str]])->bool:
+        # Worth fanning out only if two steps share a dependency level
+        levels:List[int] = []
+        for deps in cls._dependencies(steps):
+            levels.append(1 + max((levels[d] for d in deps),default=0))
+        return len(set(levels)) < len(levels)
+
+    def _execute_parallel(self,steps:List[Dict[str,str]],deadline:Optional[Deadline]=None)->List[Any]:
+        """
+        Steps cannot read each other's results (no temp tables), so they only
+        wait for the steps named in their `depends_on`. Up to max_parallel run at
+        once; results keep plan order and the first error cancels whatever has
+        not started yet.
+        """
+        # Cancelling siblings must not cancel the request: it may re-plan (QueryCostError)
+        scope = deadline.child() if deadline is not None else None
+        deps = self._dependencies(steps)
+        results:List[Any] = [None] * len(steps)
+        done:set = set()
+        running:Dict[Any,int] = {}
+        pool = self._pool("_step_executor","CHATDB_STEP_THREADS",8,"chatdb-step")
+        try:
+            while len(done) < len(steps):
+                for i,step in enumerate(steps):
+                    if len(running) >= self.max_parallel:
+                        break
+                    if i not in done and i not in running.values() and deps[i] <= done:
+                        running[pool.submit(metrics.bind(self.execute_step),step,None,scope)] = i
+                finished,_ = wait(list(running),return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    results[i] = future.result()
+                    done.add(i)
+        except BaseException:
+            # The request has failed: stop sibling statements still running on the server
+            if scope is not None and running:
+                scope.cancel()
+            raise
+        finally:
+            for future in running:
+                future.cancel()
+            if scope is not None:
+                scope.detach()
+        return results
+
+    def execute_step(self,step:Dict[str,str],conn=None,deadline:Optional[Deadline]=None)->Any:
+        with metrics.span("step",step=step.get('step_number')):
+            return self._run_sql(step['sql'],conn,deadline,step.get('params'))
+
+    def _run_sql(self,sql:str,conn=None,deadline:Optional[Deadline]=None,params=None)->Any:
+        # Template steps (planTemplate) carry ? placeholders and run as prepared statements
+        prepared = params is not None
+        run = lambda: Mysql.execute(self.key,sql,params=params,conn=conn,deadline=deadline,prepared=prepared)
+        # A snapshot must not be mixed with results read at other points in time
+        if self.result_cache is None or self.snapshot:
+            return run()
+        return self.result_cache.fetch(self.key,sql,run,params=params,conn=conn)
+
+    def stream_step(self,step:Dict[str,str],batch_size:Optional[int]=None,max_rows:Optional[int]=None)->Iterator[ResultBatch]:
+        """
+        Streams one step's rows in batches, for exports too large for execute().
+        """
+        return Mysql.stream(self.key,step['sql'],batch_size=batch_size,max_rows=max_rows)
+
+    @classmethod
+    def _pool(cls,attr:str,env:str,default:int,prefix:str)->ThreadPoolExecutor:
+        with cls._executor_lock:
+            if getattr(cls,attr) is None:
+                setattr(cls,attr,ThreadPoolExecutor(max_workers=int(os.getenv(env,default)),thread_name_prefix=prefix))
+        return getattr(cls,attr)
+
+    @classmethod
+    def _offload_pool(cls)->ThreadPoolExecutor:
+        return cls._pool("_db_executor","CHATDB_DB_THREADS",5,"chatdb-db")
+
+    @classmethod
+    def _checkout_pool(cls)->ThreadPoolExecutor:
+        return cls._pool("_checkout_executor","CHATDB_CHECKOUT_THREADS",20,"chatdb-checkout")
+
+    async def aexecute(self,sql_cmds:List[Dict[str,str]],deadline:Optional[Deadline]=None)->List[Any]:
+        """
+        Steps run one offloaded statement at a time on one pinned connection,
+        so a worker is held only while a statement runs, not for the whole plan.
+        """
+        steps = [sql for sql in sql_cmds if sql.get('sql',None)]
+        # Even without a time limit the deadline is the handle that kills the running statement
+        deadline = deadline or Deadline(0)
+        loop = asyncio.get_running_loop()
+        pool = self._offload_pool()
+        session = self.session()
+        release = lambda *_: pool.submit(session.__exit__,None,None,None)
+        with metrics.span("execute",steps=len(steps),mode="pinned"):
+            # Waiting for a connection must not take a statement worker from the requests that hold one
+            checkout = loop.run_in_executor(self._checkout_pool(),metrics.bind(session.__enter__))
+            try:
+                conn = await asyncio.shield(checkout)
+            except asyncio.CancelledError:
+                # The checkout still completes in its thread: hand that connection straight back
+                checkout.add_done_callback(lambda f: f.cancelled() or f.exception() is not None or release())
+                raise
+            running = None
+            try:
+                results = []
+                for step in steps:
+                    # Shielded, so `running` tracks the worker and not just this await
+                    running = loop.run_in_executor(pool,metrics.bind(self.execute_step),step,conn,deadline)
+                    results.append(await asyncio.shield(running))
+                return results
+            except asyncio.CancelledError:
+                # The worker thread cannot be interrupted, but its statement can;
+                # KILL QUERY needs a round trip, so keep it off the event loop
+                threading.Thread(target=deadline.cancel,daemon=True).start()
+                raise
+            finally:
+                if running is not None and not running.done():
+                    # Never return the connection under a statement still running on it
+                    running.add_done_callback(release)
+                else:
+                    await asyncio.shield(loop.run_in_executor(pool,session.__exit__,None,None,None))
@@ -0,0 +1,108 @@
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass
+from chatGemini import ChatQuery,ChatResponse
+from typing import Dict,List,Optional,Callable,Union,Iterator
+
+# Messages Gemini.classify_error maps back to the scripted error type
+_ERROR_MESSAGES = {
+    "QUOTA_EXCEEDED":"quota exceeded",
+    "MODEL_NOT_FOUND":"model not found",
+    "MODEL_ACCESS_DENIED":"permission denied",
+    "TRANSIENT_ERROR":"service unavailable",
+}
+
+
+@dataclass
+class FakeContent:
+    """
+    Stands in for GenerateContentResponse; callers only read `.text`.
+    """
+    text : str
+
+
+DEFAULT_PLAN = """Step1: Count films in each category.
+`SELECT c.name, COUNT(fc.film_id) AS film_count FROM category AS c JOIN film_category AS fc ON c.category_id = fc.category_id GROUP BY c.name;`"""
+
+
+class FakeGemini:
+    """
+    Deterministic local backend implementing the Gemini.chat contract, for
+    exercising ModelRouter / ChatDB without network access.
+
+    - responder: fixed plan text, or a callable (query) -> text
+    - latency: seconds per model (default 0); jitter adds up to that many seconds, seeded
+    - errors: model -> error_type to return instead of a response; a list is consumed
+      one item per call (None entries succeed), which scripts outages that recover
+    - chunk_size / chunk_delay: how chat_stream splits the text and paces the chunks
+    """
+
+    def __init__(
+        self,
+        responder:Union[str,Callable[[ChatQuery],str]]=DEFAULT_PLAN,
+        latency:Optional[Dict[str,float]]=None,
+        errors:Optional[Dict[str,Union[str,List[Optional[str]]]]]=None,
+        jitter:float=0.0,
+        seed:int=0,
+        chunk_size:int=40,
+        chunk_delay:float=0.0
+    ) -> None:
+        self.responder = responder
+        self.latency = latency or {}
+        self.errors = {k:(list(v) if isinstance(v,list) else v) for k,v in (errors or {}).items()}
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls:List[str] = []
+
+    def _next_error(self,model:str)->Optional[str]:
+        scripted = self.errors.get(model)
+        if isinstance(scripted,list):
+            return scripted.pop(0) if scripted else None
+        return scripted
+
+    def _script(self,query:ChatQuery):
+        model = query["model"]
+        with self._lock:
+            self.calls.append(model)
+            error = self._next_error(model)
+            delay = self.latency.get(model,0.0) + (self._rng.random() * self.jitter if self.jitter else 0.0)
+        return error,delay
+
+    def _begin(self,query:ChatQuery):
+        error,delay = self._script(query)
+        if delay:
+            time.sleep(delay)
+        return error
+
+    def _text(self,query:ChatQuery)->str:
+        return self.responder(query) if callable(self.responder) else self.responder
+
+    def chat(self,query:ChatQuery)->ChatResponse:
+        error = self._begin(query)
+        if error:
+            return ChatResponse(response=None,error=f"fake {_ERROR_MESSAGES.get(error,error)} for {query['model']}",error_type=error)
+        return ChatResponse(response=FakeContent(text=self._text(query)),error=None,error_type=None)
+
+    async def achat(self,query:ChatQuery)->ChatResponse:
+        error,delay = self._script(query)
+        if delay:
+            await asyncio.sleep(delay)
+        if error:
+            return ChatResponse(response=None,error=f"fake {_ERROR_MESSAGES.get(error,error)} for {query['model']}",error_type=error)
+        return ChatResponse(response=FakeContent(text=self._text(query)),error=None,error_type=None)
+
+    def chat_stream(self,query:ChatQuery)->Iterator[FakeContent]:
+        # `latency` is the time to first chunk; chunk_delay paces the rest
+        error = self._begin(query)
+        if error:
+            raise RuntimeError(f"fake {_ERROR_MESSAGES.get(error,error)} for {query['model']}")
+        text = self._text(query)
+        for i in range(0,len(text),self.chunk_size):
+            if i and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield FakeContent(text=text[i:i+self.chunk_size])
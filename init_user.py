@@ -1,14 +1,42 @@
-from SQL import Mysql
+from SQL import Mysql,QueryCostError
 from schema import DBSchema
 from schemaFormatter import DBSchemaFormatter
 from chatDB import ChatDB
-from parse import Parser
+from parse import Parser,IncrementalParser
 from executer import Executer
-from typing import List,Any
+from planOptimizer import PlanOptimizer,FusedPlan
+from deadline import Deadline
+from metrics import registry as metrics
+from schemaCache import SchemaCache
+from schemaSelector import SchemaSelector
+from schemaGraph import SchemaGraph
+from responseCache import ResponseCache
+from planTemplate import PlanTemplates
+from valueIndex import ValueIndex
+from typing import List,Any,Dict,Tuple,Iterator,Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
 from dotenv import load_dotenv
+import os
+import hashlib
+
+
+@dataclass(frozen=True)
+class PlanRestarted:
+    """
+    Yielded by InitUser.chat_stream when the cost gate rejects the plan being
+    streamed: the `discarded` results before it came from the rejected plan.
+    """
+    reason : str
+    discarded : int
 
 
 class InitUser:
+    # Shared by every user in the process: plans only depend on the schema fingerprint
+    response_cache = ResponseCache() if os.getenv("CHATDB_RESPONSE_CACHE","1") != "0" else None
+    plan_templates = PlanTemplates() if os.getenv("CHATDB_PLAN_TEMPLATES","1") != "0" else None
+
     def __init__(self,user:str,password:str,db_name:str) -> None:
         self._user = user
         self._password = password
@@ -18,32 +46,254 @@ class InitUser:
         self.db_details = None
         self._chat = None
         self._executer = None
+        self._tables:Dict[str,Dict[str,Any]] = {}
+        self._graph:SchemaGraph = None
+        self._schema_fingerprint = None
+        self._schema_cache = SchemaCache() if os.getenv("CHATDB_SCHEMA_CACHE","1") != "0" else None
+
+    @staticmethod
+    def _format_table(tab_name:str,schema:List[dict])->Dict[str,Any]:
+        return {
+            "text":DBSchemaFormatter.build_TableSchemaText(table_name=tab_name,table_schema=schema),
+            "columns":[col.get('COLUMN_NAME') for col in schema],
+            # What ValueIndex needs to pick its columns, so it does not introspect again
+            "schema":[{k:col.get(k) for k in ("COLUMN_NAME","DATA_TYPE","COLUMN_TYPE","COLUMN_KEY")} for col in schema]
+        }
 
     def _build_schema(self,db_name:str):
-        dbSchema = DBSchema.get_dbSchema(user_key=self._key,db_name=self._db_name)
-        db_details = [DBSchemaFormatter.build_DBSchemaText(db_name=self._db_name,tables=dbSchema)]
-        for table in dbSchema:
-            tab_name = table.get('TABLE_NAME',None)
-            schema = DBSchema.get_TableSchema(user_key=self._key,tab_name=tab_name)
-            sch_txt = DBSchemaFormatter.build_TableSchemaText(table_name=tab_name,table_schema=schema)
-            db_details.append(sch_txt)
-        self.db_details = "\n".join(db_details)
-
-    def init(self,api_key:str,useGemini:bool=True):
+        if not self._schema_cache:
+            dbSchema = DBSchema.get_dbSchema(user_key=self._key,db_name=db_name)
+            columns = DBSchema.get_ColumnsSchema(user_key=self._key,db_name=db_name)
+            tables = {}
+            for table in dbSchema:
+                tab_name = table.get('TABLE_NAME',None)
+                schema = columns.get(tab_name,[])
+                tables[tab_name] = self._format_table(tab_name,schema)
+            foreign_keys = DBSchema.get_ForeignKeys(user_key=self._key,db_name=db_name)
+        else:
+            tables,foreign_keys = self._load_cached_schema(db_name)
+        self._tables = tables
+        self._graph = SchemaGraph(foreign_keys)
+        self._graph.precompute()
+        db_details = [DBSchemaFormatter.build_DBSchemaText(db_name=db_name,tables=[{'TABLE_NAME':name} for name in tables])]
+        db_details.extend(table["text"] for table in tables.values())
+        db_details.append(DBSchemaFormatter.build_RelationshipText(self._graph.foreign_keys))
+        db_details.append(DBSchemaFormatter.build_JoinPathText(self._graph.multi_hop_paths()))
+        self.db_details = "\n".join(txt for txt in db_details if txt)
+        self._schema_fingerprint = hashlib.sha256(self.db_details.encode()).hexdigest()
+
+    def _load_cached_schema(self,db_name:str)->Tuple[Dict[str,Dict[str,Any]],List[dict]]:
+        fingerprints = DBSchema.get_TableFingerprints(user_key=self._key,db_name=db_name)
+        payload = self._schema_cache.load(self._key)
+        cached = payload.get("tables",{})
+        stale = [name for name,fp in fingerprints.items() if cached.get(name,{}).get("fingerprint") != fp]
+        if stale:
+            # Only re-introspect tables whose fingerprint changed since the last run
+            subset = stale if len(stale) < len(fingerprints) else None
+            columns = DBSchema.get_ColumnsSchema(user_key=self._key,db_name=db_name,tables=subset)
+            for name in stale:
+                cached[name] = self._format_table(name,columns.get(name,[]))
+                cached[name]["fingerprint"] = fingerprints[name]
+        tables = {name:cached[name] for name in fingerprints}
+        foreign_keys = payload.get("foreign_keys")
+        if stale or foreign_keys is None or len(cached) != len(tables):
+            foreign_keys = DBSchema.get_ForeignKeys(user_key=self._key,db_name=db_name)
+            self._schema_cache.save(self._key,db_name,tables,foreign_keys)
+        return tables,foreign_keys
+
+    def init(self,api_key:str,useGemini:bool=True,backend=None):
         self._db = Mysql(username=self._user,password=self._password)
         self._key = self._db.connectDB(self._db_name)
         self._build_schema(self._db_name)
-        self._chat = ChatDB(api_key,self.db_details)
+        selector = SchemaSelector(db_name=self._db_name,tables=self._tables,graph=self._graph)
+        values = None
+        if os.getenv("CHATDB_VALUE_INDEX","0") == "1":
+            try:
+                columns = {name:table.get("schema",[]) for name,table in self._tables.items()}
+                values = ValueIndex(self._key,self._db_name).build(columns)
+            except Exception as e:
+                # Grounding is an aid: the model can still plan a lookup step without it
+                print(f"Value index could not be built, continuing without it: {e}")
+        self._chat = ChatDB(api_key,self.db_details,selector=selector,backend=backend,values=values)
         self._executer = Executer(self._key)
     
-    def chat(self,q:str)->List[Any]:
+    def chat(self,q:str,timeout:Optional[float]=None)->List[Any]:
+        """
+        timeout: seconds for the whole request (model call and every step);
+        None reads CHATDB_REQUEST_TIMEOUT, 0 disables it.
+        """
+        deadline = Deadline(timeout)
         try:
             if not self._chat:
                 raise Exception("User is not initialised.. try running init() first..")
-            res = self._chat.chat(q)
-            print(res)
-            parsed_res = Parser.parseResponse(res)
-            result = self._executer.execute(sql_cmds=parsed_res)
-            return result
+            with metrics.span("chat") as span:
+                parsed_res,source = self._lookup(q)
+                if parsed_res is None:
+                    res = self._chat.chat(q,deadline=deadline)
+                    print(res)
+                    parsed_res = self._parse(res)
+                try:
+                    result = self._execute(parsed_res,deadline)
+                except QueryCostError as e:
+                    parsed_res,source = self._replan(q,e,deadline),"model"
+                    result = self._execute(parsed_res,deadline)
+                span.set(plan_source=source)
+                self._remember(q,parsed_res,source)
+                return result
         except Exception as e:
-            raise e 
+            raise e
+
+    def _lookup(self,q:str)->Tuple[Optional[List[Dict[str,Any]]],str]:
+        """
+        A plan that needs no model call, and where it came from: the response
+        cache, then a template with the question's literals filled in.
+        """
+        cache = self.response_cache
+        with metrics.span("response_cache"):
+            plan = cache.get(q,self._schema_fingerprint) if cache else None
+        if plan is not None:
+            return plan,"cache"
+        if self.plan_templates:
+            with metrics.span("template"):
+                plan = self.plan_templates.match(q,self._schema_fingerprint)
+            if plan is not None:
+                return plan,"template"
+        return None,"model"
+
+    def _remember(self,q:str,plan:List[Dict[str,Any]],source:str)->None:
+        # Only plans that executed cleanly are worth reusing
+        if self.response_cache:
+            self.response_cache.put(q,self._schema_fingerprint,plan)
+        if self.plan_templates and source == "model":
+            self.plan_templates.learn(q,self._schema_fingerprint,plan)
+
+    @staticmethod
+    def _optimize(steps:List[Dict[str,Any]])->FusedPlan:
+        if not PlanOptimizer.enabled:
+            return FusedPlan.identity(steps)
+        with metrics.span("optimize") as span:
+            plan = PlanOptimizer.optimize(steps)
+            span.set(steps=len(plan.steps),fused=len(plan.fused))
+            return plan
+
+    def _execute(self,steps:List[Dict[str,Any]],deadline:Deadline)->List[Any]:
+        plan = self._optimize(steps)
+        return plan.expand(self._executer.execute(sql_cmds=plan.steps,deadline=deadline))
+
+    async def _aexecute(self,steps:List[Dict[str,Any]],deadline:Deadline)->List[Any]:
+        plan = self._optimize(steps)
+        return plan.expand(await self._executer.aexecute(sql_cmds=plan.steps,deadline=deadline))
+
+    @staticmethod
+    def _rejected(error:QueryCostError)->str:
+        # One re-plan with the cost gate's reason; a second rejection is final
+        metrics.inc("chatdb_replans_total")
+        metrics.current().set(replanned=True,rejected=str(error))
+        return str(error)
+
+    def _replan(self,q:str,error:QueryCostError,deadline:Deadline)->List[Dict[str,Any]]:
+        """
+        A new plan for a question whose plan the cost gate rejected, written
+        with the gate's reason as feedback.
+        """
+        return self._parse(self._chat.chat(q,feedback=self._rejected(error),deadline=deadline))
+
+    async def _areplan(self,q:str,error:QueryCostError,deadline:Deadline)->List[Dict[str,Any]]:
+        return self._parse(await self._chat.achat(q,feedback=self._rejected(error),deadline=deadline))
+
+    @staticmethod
+    def _parse(res:str)->List[Dict[str,Any]]:
+        with metrics.span("parse") as span:
+            parsed = Parser.parseResponse(res)
+            span.set(steps=len(parsed))
+            return parsed
+
+    async def achat(self,q:str,timeout:Optional[float]=None)->List[Any]:
+        """
+        asyncio variant of chat(): the model call uses the async genai client and
+        SQL runs on Executer's offload pool, so one process can keep thousands of
+        questions in flight.
+        """
+        if not self._chat:
+            raise Exception("User is not initialised.. try running init() first..")
+        deadline = Deadline(timeout)
+        with metrics.span("chat") as span:
+            parsed_res,source = self._lookup(q)
+            if parsed_res is None:
+                res = await self._chat.achat(q,deadline=deadline)
+                parsed_res = self._parse(res)
+            try:
+                result = await self._aexecute(parsed_res,deadline)
+            except QueryCostError as e:
+                parsed_res,source = await self._areplan(q,e,deadline),"model"
+                result = await self._aexecute(parsed_res,deadline)
+            span.set(plan_source=source)
+            self._remember(q,parsed_res,source)
+            return result
+
+    def chat_stream(self,q:str,timeout:Optional[float]=None)->Iterator[Any]:
+        """
+        Streaming variant of chat(): each step is validated and sent to the
+        database as soon as the model has finished writing it, while later steps
+        are still being generated. Yields step results in plan order.
+
+        A plan rejected by the cost gate is re-planned once, as in chat(): a
+        PlanRestarted marker is yielded, the results before it belong to the
+        rejected plan, and the new plan's results follow from its first step.
+        """
+        if not self._chat:
+            raise Exception("User is not initialised.. try running init() first..")
+        deadline = Deadline(timeout)
+        yielded = 0
+        rejected:Optional[QueryCostError] = None
+        steps,source = self._lookup(q)
+        if steps is not None:
+            try:
+                results = self._execute(steps,deadline)
+            except QueryCostError as e:
+                rejected = e
+            else:
+                self._remember(q,steps,source)
+                yield from results
+                return
+        else:
+            parser = IncrementalParser()
+            pending = []
+            # The connection is pinned once the first step is ready, not for the
+            # whole generation, and released after the worker has stopped
+            with ExitStack() as stack:
+                conn = None
+                # A single worker keeps the steps in order while the stream is still being read
+                # The worker is the only user of the pinned connection
+                with ThreadPoolExecutor(max_workers=1,thread_name_prefix="chatdb-step") as pool:
+                    try:
+                        for chunk in self._chat.chat_stream(q):
+                            deadline.check("the plan was fully generated")
+                            for step in parser.feed(chunk):
+                                if conn is None:
+                                    conn = stack.enter_context(self._executer.session())
+                                pending.append(pool.submit(self._executer.execute_step,step,conn,deadline))
+                            while pending and pending[0].done():
+                                yield pending.pop(0).result()
+                                yielded += 1
+                        steps = parser.close()
+                        while pending:
+                            yield pending.pop(0).result()
+                            yielded += 1
+                    except QueryCostError as e:
+                        # The deadline stays usable for the re-plan
+                        for future in pending:
+                            future.cancel()
+                        rejected = e
+                    except BaseException:
+                        for future in pending:
+                            future.cancel()
+                        # Includes the caller closing the generator early
+                        deadline.cancel()
+                        raise
+        if rejected is not None:
+            yield PlanRestarted(str(rejected),yielded)
+            steps = self._replan(q,rejected,deadline)
+            yield from self._execute(steps,deadline)
+        self._remember(q,steps,"model")
+
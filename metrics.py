@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+import contextvars
+from collections import deque
+from dotenv import load_dotenv
+from typing import Any,Callable,Deque,Dict,List,Optional,Tuple
+load_dotenv()
+
+# Upper bounds (seconds) of every latency histogram
+LATENCY_BUCKETS = (0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,float("inf"))
+
+
+class Histogram:
+    def __init__(self,buckets:Tuple[float,...]=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self,value:float)->None:
+        self.counts[bisect.bisect_left(self.buckets,value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    """
+    One timed stage of a request. Children are the stages that ran inside it;
+    attrs hold what was learned on the way (model, tokens, rows, ...).
+    """
+    __slots__ = ("name","attrs","start","end","children","parent","registry","_token")
+
+    def __init__(self,name:str,attrs:Dict[str,Any],parent:Optional["Span"],registry:"MetricsRegistry") -> None:
+        self.name = name
+        self.registry = registry
+        self.attrs = attrs
+        self.parent = parent
+        self.children:List[Span] = []
+        self.start = time.perf_counter()
+        self.end:Optional[float] = None
+        self._token = None
+
+    @property
+    def duration(self)->float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self,**attrs)->None:
+        self.attrs.update(attrs)
+
+    def __enter__(self)->"Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self,exc_type,exc,tb)->None:
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _current.reset(self._token)
+        self.registry._finish(self)
+
+    def to_dict(self)->Dict[str,Any]:
+        return {
+            "name":self.name,
+            "duration_ms":round(self.duration*1000,3),
+            "attrs":self.attrs,
+            "children":[child.to_dict() for child in self.children],
+        }
+
+
+class _NoopSpan:
+    # Shared stand-in when metrics are off: entering, setting and leaving cost a method call
+    __slots__ = ()
+
+    def set(self,**attrs)->None:
+        pass
+
+    def __enter__(self)->"_NoopSpan":
+        return self
+
+    def __exit__(self,exc_type,exc,tb)->None:
+        pass
+
+
+_NOOP = _NoopSpan()
+_current:contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("chatdb_span",default=None)
+
+
+class MetricsRegistry:
+    """
+    In-process counters, latency histograms and a ring buffer of recent traces.
+    Every finished span is also observed in chatdb_stage_seconds{stage=<name>}.
+    Sinks are called with each finished root span (e.g. to forward traces).
+
+    CHATDB_METRICS=1 turns it on; when off, span() returns a shared no-op.
+    """
+
+    def __init__(self,enabled:Optional[bool]=None,trace_buffer:Optional[int]=None) -> None:
+        self.enabled = enabled if enabled is not None else os.getenv("CHATDB_METRICS","0") == "1"
+        self.counters:Dict[Tuple[str,Tuple],float] = {}
+        self.histograms:Dict[Tuple[str,Tuple],Histogram] = {}
+        self.traces:Deque[Span] = deque(maxlen=trace_buffer or int(os.getenv("CHATDB_TRACE_BUFFER",100)))
+        self.sinks:List[Callable[[Span],None]] = []
+        self._lock = threading.Lock()
+
+    def span(self,name:str,**attrs):
+        if not self.enabled:
+            return _NOOP
+        parent = _current.get()
+        span = Span(name,attrs,parent,self)
+        if parent is not None:
+            parent.children.append(span)
+        return span
+
+    def current(self):
+        if not self.enabled:
+            return _NOOP
+        return _current.get() or _NOOP
+
+    def inc(self,name:str,value:float=1,**labels)->None:
+        if not self.enabled:
+            return
+        key = (name,tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key,0) + value
+
+    def observe(self,name:str,value:float,**labels)->None:
+        if not self.enabled:
+            return
+        key = (name,tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def bind(self,fn:Callable)->Callable:
+        """
+        Wraps fn so that, run on another thread, its spans nest under the current one.
+        """
+        if not self.enabled:
+            return fn
+        return functools.partial(contextvars.copy_context().run,fn)
+
+    def add_sink(self,sink:Callable[[Span],None])->None:
+        self.sinks.append(sink)
+
+    def _finish(self,span:Span)->None:
+        self.observe("chatdb_stage_seconds",span.duration,stage=span.name)
+        if span.parent is None:
+            with self._lock:
+                self.traces.append(span)
+            for sink in self.sinks:
+                try:
+                    sink(span)
+                except Exception as e:
+                    print(f"Metrics sink failed: {e}")
+
+    @staticmethod
+    def _labels(labels:Tuple,extra:str="")->str:
+        parts = [f'{k}="{str(v)}"'.replace("\n"," ") for k,v in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def prometheus(self)->str:
+        """
+        Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(),key=lambda item: item[0])
+            for name in sorted({key[0] for key,_ in counters}):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{self._labels(labels)} {value}" for (n,labels),value in counters if n == name)
+            for name in sorted({key[0] for key,_ in histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n,labels),histogram in histograms:
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound,count in zip(histogram.buckets,histogram.counts):
+                        cumulative += count
+                        le = 'le="' + ("+Inf" if bound == float("inf") else repr(bound)) + '"'
+                        lines.append(f"{name}_bucket{self._labels(labels,le)} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def traces_json(self,limit:Optional[int]=None)->str:
+        with self._lock:
+            traces = list(self.traces)
+        if limit is not None:
+            traces = traces[-limit:]
+        return json.dumps([trace.to_dict() for trace in traces],default=str)
+
+    def snapshot(self)->Dict[str,Any]:
+        with self._lock:
+            return {
+                "counters":{f"{name}{self._labels(labels)}":value for (name,labels),value in self.counters.items()},
+                "histograms":{
+                    f"{name}{self._labels(labels)}":{"count":h.count,"sum":h.sum}
+                    for (name,labels),h in self.histograms.items()
+                },
+            }
+
+    def reset(self)->None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.traces.clear()
+
+
+registry = MetricsRegistry()
+span = registry.span
+bind = registry.bind
@@ -0,0 +1,424 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+from dataclasses import dataclass,field
+from dotenv import load_dotenv
+from chatGemini import Gemini,ChatQuery,ChatResponse
+from metrics import registry as metrics
+from typing import Dict,List,Optional,Callable,Deque,Iterator
+load_dotenv()
+
+# Errors after which another model may still answer the same request
+FALLBACK_ERRORS = {"MODEL_ACCESS_DENIED","MODEL_NOT_FOUND","QUOTA_EXCEEDED"}
+
+
+@dataclass
+class ModelHealth:
+    name : str
+    rank : int
+    state : str = "closed"
+    consecutive_failures : int = 0
+    cooldown : float = 0.0
+    cooldown_until : float = 0.0
+    # half_open: claimed by the request probing the model until then
+    probe_until : float = 0.0
+    latency_ewma : Optional[float] = None
+    outcomes : Deque[bool] = field(default_factory=lambda: deque(maxlen=50))
+    latencies : Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+
+    def success_rate(self)->float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 1.0
+
+
+class ModelRouter:
+    """
+    Routes each request to the fastest healthy model instead of walking a
+    fixed list. Every model has a circuit breaker:
+
+    - closed: usable
+    - open: skipped until its cooldown expires
+    - half_open: the cooldown has expired; one request probes the model
+      again (the others skip it until the probe succeeds, fails or times
+      out after `probe_timeout`), and a success closes the breaker
+
+    Quota errors and missing/denied models open the breaker right away.
+    Other errors open it after `failure_threshold` consecutive failures.
+    Cooldowns double on each repeated failure, up to `max_cooldown`.
+
+    route_hedged() can also send the same query to the next candidate when
+    the first has not answered by a latency-percentile deadline. Hedges are
+    bounded twice: by the number in flight and by a budget relative to the
+    number of requests.
+
+    The backend only needs the Gemini.chat contract: take a ChatQuery and
+    return a ChatResponse.
+    """
+
+    _routers:Dict[str,"ModelRouter"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(
+        self,
+        backend,
+        models:List[str],
+        policy:Optional[str]=None,
+        failure_threshold:int=3,
+        quota_cooldown:float=60.0,
+        unavailable_cooldown:float=3600.0,
+        breaker_cooldown:float=30.0,
+        max_cooldown:float=3600.0,
+        probe_timeout:float=60.0,
+        ewma_alpha:float=0.3,
+        clock:Callable[[],float]=time.monotonic,
+        hedge_percentile:Optional[float]=None,
+        hedge_after:Optional[float]=None,
+        hedge_budget:Optional[float]=None,
+        max_inflight_hedges:Optional[int]=None,
+        max_workers:Optional[int]=None
+    ) -> None:
+        self.backend = backend
+        self.health = {name:ModelHealth(name=name,rank=i) for i,name in enumerate(models)}
+        self.policy = policy or os.getenv("CHATDB_ROUTING","fastest")
+        self.failure_threshold = failure_threshold
+        self.quota_cooldown = quota_cooldown
+        self.unavailable_cooldown = unavailable_cooldown
+        self.breaker_cooldown = breaker_cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.ewma_alpha = ewma_alpha
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.hedge_percentile = hedge_percentile or float(os.getenv("CHATDB_HEDGE_PERCENTILE",0.9))
+        self.hedge_after = hedge_after or float(os.getenv("CHATDB_HEDGE_AFTER",8.0))
+        self.hedge_budget = hedge_budget if hedge_budget is not None else float(os.getenv("CHATDB_HEDGE_BUDGET",0.1))
+        self._hedge_slots = threading.BoundedSemaphore(max_inflight_hedges or int(os.getenv("CHATDB_HEDGE_MAX_INFLIGHT",4)))
+        self._max_workers = max_workers or int(os.getenv("CHATDB_HEDGE_WORKERS",32))
+        self._executor:Optional[ThreadPoolExecutor] = None
+        self.costs = {"requests":0,"calls":0,"hedges":0,"hedge_wins":0,"hedges_skipped":0,"wasted_calls":0}
+
+    @classmethod
+    def for_key(cls,key:str,backend,models:List[str])->"ModelRouter":
+        """
+        Health is tracked per API key (quotas are per key) and shared by every
+        ChatDB using that key.
+        """
+        with cls._registry_lock:
+            if key not in cls._routers:
+                cls._routers[key] = cls(backend,models)
+            return cls._routers[key]
+
+    def candidates(self)->List[str]:
+        now = self.clock()
+        with self._lock:
+            usable = []
+            for h in self.health.values():
+                if h.state == "open" and h.cooldown_until <= now:
+                    h.state = "half_open"
+                # Another request is probing it; the claim is taken by _claim() on the attempt itself
+                if h.state == "half_open" and h.probe_until > now:
+                    continue
+                if h.state != "open":
+                    usable.append(h)
+            if not usable:
+                # Everything is cooling down: try the models that recover first
+                return [h.name for h in sorted(self.health.values(),key=lambda h:h.cooldown_until)]
+            if self.policy == "preference":
+                return [h.name for h in sorted(usable,key=lambda h:h.rank)]
+            # Unmeasured models are tried first (in preference order) so every model gets a latency sample
+            return [h.name for h in sorted(usable,key=self._score)]
+
+    def _claim(self,model:str)->bool:
+        """
+        Called right before a model is tried: a half-open model is claimed by
+        the first request that actually tries it, and skipped by the others.
+        """
+        now = self.clock()
+        with self._lock:
+            h = self.health[model]
+            if h.state != "half_open":
+                return True
+            if h.probe_until > now:
+                return False
+            h.probe_until = now + self.probe_timeout
+            return True
+
+    def _release(self,model:str)->None:
+        # The probe never produced an outcome (cancelled or raised): let another request try
+        with self._lock:
+            h = self.health[model]
+            if h.state == "half_open":
+                h.probe_until = 0.0
+
+    @staticmethod
+    def _score(h:ModelHealth):
+        if h.latency_ewma is None:
+            return (0,h.rank)
+        return (1,h.latency_ewma / max(h.success_rate(),0.05),h.rank)
+
+    def record_success(self,model:str,latency:float)->None:
+        with self._lock:
+            h = self.health[model]
+            h.state = "closed"
+            h.probe_until = 0.0
+            h.consecutive_failures = 0
+            h.cooldown = 0.0
+            h.outcomes.append(True)
+            h.latencies.append(latency)
+            h.latency_ewma = latency if h.latency_ewma is None else (
+                self.ewma_alpha * latency + (1 - self.ewma_alpha) * h.latency_ewma
+            )
+
+    def record_failure(self,model:str,error_type:Optional[str])->None:
+        with self._lock:
+            h = self.health[model]
+            h.consecutive_failures += 1
+            h.probe_until = 0.0
+            h.outcomes.append(False)
+            if error_type == "QUOTA_EXCEEDED":
+                base = self.quota_cooldown
+            elif error_type in {"MODEL_NOT_FOUND","MODEL_ACCESS_DENIED"}:
+                base = self.unavailable_cooldown
+            elif h.consecutive_failures >= self.failure_threshold or h.state == "half_open":
+                base = self.breaker_cooldown
+            else:
+                return
+            h.cooldown = min(max(base,h.cooldown * 2),self.max_cooldown)
+            h.cooldown_until = self.clock() + h.cooldown
+            h.state = "open"
+
+    def call(self,model:str,query:ChatQuery)->ChatResponse:
+        """
+        Sends one request to one model and records the outcome.
+        """
+        request:ChatQuery = {**query,'model':model}
+        with self._lock:
+            self.costs["calls"] += 1
+        with metrics.span("llm.call",model=model) as span:
+            start = self.clock()
+            try:
+                response = self.backend.chat(request)
+            except BaseException:
+                self._release(model)
+                raise
+            self._observe(span,model,response)
+        if response.response:
+            self.record_success(model,self.clock() - start)
+        else:
+            self.record_failure(model,response.error_type)
+        return response
+
+    @staticmethod
+    def _observe(span,model:str,response:ChatResponse)->None:
+        outcome = response.error_type or "ok"
+        span.set(outcome=outcome)
+        metrics.inc("chatdb_llm_calls_total",model=model,outcome=outcome)
+        usage = getattr(response.response,"usage_metadata",None)
+        if usage is not None:
+            prompt,completion = usage.prompt_token_count or 0,usage.candidates_token_count or 0
+            span.set(prompt_tokens=prompt,completion_tokens=completion)
+            metrics.inc("chatdb_llm_tokens_total",prompt,model=model,kind="prompt")
+            metrics.inc("chatdb_llm_tokens_total",completion,model=model,kind="completion")
+
+    async def acall(self,model:str,query:ChatQuery)->ChatResponse:
+        request:ChatQuery = {**query,'model':model}
+        with self._lock:
+            self.costs["calls"] += 1
+        with metrics.span("llm.call",model=model) as span:
+            start = self.clock()
+            try:
+                response = await self.backend.achat(request)
+            except BaseException:
+                self._release(model)
+                raise
+            self._observe(span,model,response)
+        if response.response:
+            self.record_success(model,self.clock() - start)
+        else:
+            self.record_failure(model,response.error_type)
+        return response
+
+    async def aroute(self,query:ChatQuery)->ChatResponse:
+        """
+        asyncio counterpart of route(); the backend must provide achat().
+        """
+        with self._lock:
+            self.costs["requests"] += 1
+        attempt = 0
+        for model in self.candidates():
+            if not self._claim(model):
+                continue
+            attempt += 1
+            response = await self.acall(model,query)
+            if response.response or response.error_type not in FALLBACK_ERRORS:
+                metrics.current().set(model=model,attempts=attempt)
+                return response
+            metrics.inc("chatdb_llm_fallbacks_total",model=model,error=response.error_type)
+        return ChatResponse(response=None,error="No available Gemini model succeeded",error_type="NO_MODEL_AVAILABLE")
+
+    def route(self,query:ChatQuery)->ChatResponse:
+        with self._lock:
+            self.costs["requests"] += 1
+        attempt = 0
+        for model in self.candidates():
+            if not self._claim(model):
+                continue
+            attempt += 1
+            print(f"Using model {model}...")
+            response = self.call(model,query)
+            if response.response or response.error_type not in FALLBACK_ERRORS:
+                metrics.current().set(model=model,attempts=attempt)
+                return response
+            metrics.inc("chatdb_llm_fallbacks_total",model=model,error=response.error_type)
+        return ChatResponse(response=None,error="No available Gemini model succeeded",error_type="NO_MODEL_AVAILABLE")
+
+    def stream(self,query:ChatQuery)->Iterator[str]:
+        """
+        Streams the answer as text chunks from the best candidate. A model can
+        only be swapped for the next one before its first chunk arrives; a
+        failure after that is raised to the caller.
+        """
+        with self._lock:
+            self.costs["requests"] += 1
+        last_error = None
+        for model in self.candidates():
+            if not self._claim(model):
+                continue
+            print(f"Using model {model} (stream)...")
+            with self._lock:
+                self.costs["calls"] += 1
+            start = self.clock()
+            started = False
+            try:
+                for chunk in self.backend.chat_stream({**query,'model':model}):
+                    started = True
+                    yield chunk.text or ""
+            except GeneratorExit:
+                # The caller stopped reading: no outcome to record
+                self._release(model)
+                raise
+            except Exception as e:
+                error_type = Gemini.classify_error(e)
+                self.record_failure(model,error_type)
+                if started or error_type not in FALLBACK_ERRORS:
+                    raise
+                last_error = e
+                continue
+            self.record_success(model,self.clock() - start)
+            return
+        raise RuntimeError(f"No available Gemini model succeeded: {last_error}")
+
+    def hedge_deadline(self,model:str)->float:
+        """
+        Seconds to wait on `model` before hedging: its latency percentile once
+        enough samples exist, the static hedge_after otherwise.
+        """
+        with self._lock:
+            samples = sorted(self.health[model].latencies)
+        if len(samples) < 10:
+            return self.hedge_after
+        return samples[min(int(len(samples) * self.hedge_percentile),len(samples) - 1)]
+
+    def _try_hedge(self)->bool:
+        with self._lock:
+            if self.costs["hedges"] >= self.hedge_budget * self.costs["requests"]:
+                self.costs["hedges_skipped"] += 1
+                return False
+        if not self._hedge_slots.acquire(blocking=False):
+            with self._lock:
+                self.costs["hedges_skipped"] += 1
+            return False
+        with self._lock:
+            self.costs["hedges"] += 1
+        return True
+
+    def _pool(self)->ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_workers,thread_name_prefix="chatdb-hedge")
+        return self._executor
+
+    def route_hedged(self,query:ChatQuery,validate:Optional[Callable[[str],object]]=None,hedge_after:Optional[float]=None)->ChatResponse:
+        """
+        Like route(), but the first response that passes `validate` (e.g.
+        Parser.parseResponse) wins, wherever it comes from. The losing request is
+        cancelled if it has not started yet. A blocking HTTP call that already
+        started cannot be interrupted: its result is dropped and counted as a
+        wasted call.
+        """
+        with self._lock:
+            self.costs["requests"] += 1
+        candidates = iter(self.candidates())
+        futures = {}
+        hedges = set()
+
+        def launch(hedge:bool=False)->bool:
+            model = next((m for m in candidates if self._claim(m)),None)
+            if model is None:
+                if hedge:
+                    self._hedge_slots.release()
+                    with self._lock:
+                        self.costs["hedges"] -= 1
+                return False
+            print(f"Using model {model}{' (hedge)' if hedge else ''}...")
+            future = self._pool().submit(metrics.bind(self.call),model,query)
+            futures[future] = model
+            if hedge:
+                hedges.add(future)
+                future.add_done_callback(lambda _: self._hedge_slots.release())
+            return True
+
+        if not launch():
+            return ChatResponse(response=None,error="No available Gemini model succeeded",error_type="NO_MODEL_AVAILABLE")
+        deadline = hedge_after if hedge_after is not None else self.hedge_deadline(futures[next(iter(futures))])
+        hedge_pending = True
+        last = None
+        while futures:
+            done,_ = wait(list(futures),timeout=deadline if hedge_pending else None,return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_pending = False
+                if self._try_hedge():
+                    launch(hedge=True)
+                continue
+            for future in done:
+                futures.pop(future)
+                response = future.result()
+                if response.response and self._valid(response,validate):
+                    for loser,model in futures.items():
+                        if loser.cancel():
+                            self._release(model)
+                    with self._lock:
+                        self.costs["wasted_calls"] += len(futures)
+                        if future in hedges:
+                            self.costs["hedge_wins"] += 1
+                    return response
+                last = response
+                # Sequential fallback, as in route(), once nothing else is in flight
+                if response.response is None and response.error_type in FALLBACK_ERRORS and not futures:
+                    launch()
+        return last
+
+    @staticmethod
+    def _valid(response:ChatResponse,validate:Optional[Callable[[str],object]])->bool:
+        if validate is None:
+            return True
+        try:
+            validate(response.response.text)
+            return True
+        except Exception:
+            return False
+
+    def snapshot(self)->Dict[str,Dict[str,object]]:
+        with self._lock:
+            return {
+                h.name:{
+                    "state":h.state,
+                    "latency_ewma":h.latency_ewma,
+                    "success_rate":h.success_rate(),
+                    "consecutive_failures":h.consecutive_failures,
+                    "cooldown_remaining":max(0.0,h.cooldown_until - self.clock())
+                }
+                for h in self.health.values()
+            }
@@ -1,25 +1,24 @@
 import re
-from typing import List, Dict
+import sqlAst
+from typing import List, Dict, Any
 
 class ExecutionPlanError(Exception):
     pass
 
-class ExecutionPlanValidator:
-    _FORBIDDEN_SQL = re.compile(
-        r"\b(INSERT|UPDATE|DELETE|DROP|ALTER|TRUNCATE|CREATE|REPLACE|GRANT|REVOKE)\b",
-        re.IGNORECASE
-    )
+_DEPENDS_ON = re.compile(
+    r"depends\s+on\s+(steps?\s*\d+(?:\s*(?:,|and|&)\s*(?:steps?\s*)?\d+)*)",
+    re.IGNORECASE
+)
+
 
-    _READ_ONLY = re.compile(
-        r"^\s*(SELECT|WITH)\b",
-        re.IGNORECASE
-    )
+def _depends_on(description: str) -> List[int]:
+    match = _DEPENDS_ON.search(description)
+    if not match:
+        return []
+    return sorted({int(n) for n in re.findall(r"\d+", match.group(1))})
 
-    _FORBIDDEN_TEMP = re.compile(
-        r"\bTEMP\b|\bCREATE\b",
-        re.IGNORECASE
-    )
 
+class ExecutionPlanValidator:
     @classmethod
     def _normalize_sql(cls, sql: str) -> str:
         sql = sql.strip()
@@ -38,66 +37,90 @@ class ExecutionPlanValidator:
         if not steps:
             raise ExecutionPlanError("No execution steps found")
 
-        expected_step = 1
-
-        for step in steps:
-            if step.get("step_number") != expected_step:
-                raise ExecutionPlanError(
-                    f"Step numbering invalid: expected Step{expected_step}"
-                )
-
-            raw_sql = step.get("sql", "")
-            if not raw_sql or not isinstance(raw_sql, str):
-                raise ExecutionPlanError(
-                    f"Empty or missing SQL in Step{expected_step}"
-                )
-
-            sql = cls._normalize_sql(raw_sql)
+        for expected_step, step in enumerate(steps, start=1):
+            cls.validate_step(step, expected_step)
 
-            # Enforce read-only
-            if not cls._READ_ONLY.match(sql):
+    @classmethod
+    def validate_step(cls, step: dict, expected_step: int) -> None:
+        if step.get("step_number") != expected_step:
+            raise ExecutionPlanError(
+                f"Step numbering invalid: expected Step{expected_step}"
+            )
+
+        raw_sql = step.get("sql", "")
+        if not raw_sql or not isinstance(raw_sql, str):
+            raise ExecutionPlanError(
+                f"Empty or missing SQL in Step{expected_step}"
+            )
+
+        sql = cls._normalize_sql(raw_sql)
+
+        # One cached parse covers read-only, dialect and single-statement checks
+        error = sqlAst.analyze(sql).error
+        if error is not None:
+            if error.kind == "forbidden":
+                raise ExecutionPlanError(f"Unsafe SQL operation detected in Step{expected_step}: {error}")
+            raise ExecutionPlanError(f"{error} (Step{expected_step})")
+
+        # Dependencies may only point backwards
+        for dep in step.get("depends_on", []):
+            if not 1 <= dep < expected_step:
                 raise ExecutionPlanError(
-                    f"Only SELECT or WITH SELECT queries are allowed (Step{expected_step})"
+                    f"Step{expected_step} depends on unknown or later Step{dep}"
                 )
 
-            # Block temp / create
-            if cls._FORBIDDEN_TEMP.search(sql):
-                raise ExecutionPlanError(
-                    f"TEMP TABLE usage is forbidden (Step{expected_step})"
-                )
+STEP_PATTERN = re.compile(
+    r"Step\s*(\d+)\s*:\s*(.*?)\s*`([\s\S]*?)`",
+    re.IGNORECASE
+)
 
-            # Enforce single statement
-            sql = sql.rstrip(";")
-            statements = [s for s in sql.split(";") if s.strip()]
-            if len(statements) != 1:
-                raise ExecutionPlanError(
-                    f"Expected exactly one SQL statement in Step{expected_step}, "
-                    f"found {len(statements)}"
-                )
 
-            # Block unsafe ops
-            if cls._FORBIDDEN_SQL.search(sql):
-                raise ExecutionPlanError(
-                    f"Unsafe SQL operation detected in Step{expected_step}"
-                )
+def _to_step(match: re.Match) -> Dict[str, Any]:
+    description = match.group(2).strip()
+    return {
+        "step_number": int(match.group(1)),
+        "description": description,
+        "sql": match.group(3).strip(),
+        "depends_on": _depends_on(description)
+    }
 
-            expected_step += 1
 
 class Parser:
     @classmethod
     def parseResponse(cls, response: str) -> List[Dict[str, str]]:
-        pattern = re.compile(
-            r"Step\s*(\d+)\s*:\s*(.*?)\s*`([\s\S]*?)`",
-            re.IGNORECASE
-        )
-
-        result = []
-        for match in pattern.finditer(response):
-            result.append({
-                "step_number": int(match.group(1)),
-                "description": match.group(2).strip(),
-                "sql": match.group(3).strip()
-            })
+        result = [_to_step(match) for match in STEP_PATTERN.finditer(response)]
 
         ExecutionPlanValidator.validate(result)
         return result
+
+
+class IncrementalParser:
+    """
+    Streaming counterpart of Parser.parseResponse. feed() takes model output
+    chunk by chunk and returns each step as soon as its closing backtick has
+    arrived, already validated. close() checks that the plan was not empty.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._pos = 0
+        self.steps: List[Dict[str, str]] = []
+
+    def feed(self, chunk: str) -> List[Dict[str, str]]:
+        self._buffer += chunk or ""
+        ready = []
+        while True:
+            match = STEP_PATTERN.search(self._buffer, self._pos)
+            if not match:
+                break
+            step = _to_step(match)
+            ExecutionPlanValidator.validate_step(step, len(self.steps) + 1)
+            self._pos = match.end()
+            self.steps.append(step)
+            ready.append(step)
+        return ready
+
+    def close(self) -> List[Dict[str, str]]:
+        if not self.steps:
+            raise ExecutionPlanError("No execution steps found")
+        return self.steps
@@ -0,0 +1,156 @@
+import os
+import sqlAst
+from dataclasses import dataclass,field
+from dotenv import load_dotenv
+from sqlglot import exp
+from parse import ExecutionPlanValidator,ExecutionPlanError
+from metrics import registry as metrics
+from typing import Any,Dict,List,Optional
+load_dotenv()
+
+
+@dataclass
+class FusedPlan:
+    """
+    steps run in place of the original plan. sources[i] is the position in
+    steps whose result answers original step i, or None when the step was
+    folded into a later one and has no result of its own.
+    """
+    steps : List[Dict[str,Any]]
+    sources : List[Optional[int]]
+    fused : List[int] = field(default_factory=list)
+
+    def expand(self,results:List[Any])->List[Any]:
+        return [results[source] for source in self.sources if source is not None]
+
+    @classmethod
+    def identity(cls,steps:List[Dict[str,Any]])->"FusedPlan":
+        return cls(steps=steps,sources=list(range(len(steps))))
+
+
+class PlanOptimizer:
+    """
+    Rewrites a validated plan before execution:
+
+    - a step repeated verbatim (same parse tree) runs once and its result is reused
+    - a step that a later step repeats as a filter or scalar subquery (the
+      usual "look up the id first" step) is folded into that step as a CTE,
+      `WITH _step1 AS (...)`, and drops out of the results; every copy of it
+      then reads the CTE. A step reused as a derived table (FROM (...) AS t)
+      is a result in its own right and is kept
+
+    Steps cannot read each other's results, so a later step can only use an
+    earlier one by repeating its SQL; any other step is left alone. The
+    rewritten plan is validated again and the original is kept if that fails.
+    CHATDB_PLAN_FUSION=1 turns it on in InitUser.
+    """
+    enabled = os.getenv("CHATDB_PLAN_FUSION","0") == "1"
+
+    @classmethod
+    def optimize(cls,steps:List[Dict[str,Any]])->FusedPlan:
+        infos = [sqlAst.analyze(ExecutionPlanValidator._normalize_sql(step.get('sql') or "")) for step in steps]
+        # Inlining would reorder the ? placeholders of template steps
+        if len(steps) < 2 or any(info.error is not None for info in infos) or any(step.get('params') for step in steps):
+            return FusedPlan.identity(steps)
+        trees = [cls._unwrap(info.tree) for info in infos]
+
+        # Repeated steps point at their first occurrence
+        alias = list(range(len(steps)))
+        for i in range(len(steps)):
+            alias[i] = next(j for j in range(i+1) if trees[j] == trees[i])
+
+        rewritten:Dict[int,exp.Expression] = {}
+        needs:Dict[int,List[int]] = {}
+        consumed = set()
+        for k in range(len(steps)):
+            if alias[k] != k:
+                continue
+            tree,embedded = cls._inline(trees[k],trees,alias,range(k))
+            consumed.update(embedded)
+            needs[k] = sorted({d for i in embedded for d in needs[i]} | set(embedded))
+            rewritten[k] = tree
+
+        if not consumed and all(alias[i] == i for i in range(len(steps))):
+            return FusedPlan.identity(steps)
+
+        kept = [k for k in range(len(steps)) if alias[k] == k and k not in consumed]
+        position = {k:n for n,k in enumerate(kept)}
+        numbers = {steps[k].get('step_number',k+1):k for k in range(len(steps))}
+        fused_steps = []
+        for n,k in enumerate(kept,start=1):
+            step = dict(steps[k])
+            step['step_number'] = n
+            if needs[k]:
+                step['sql'] = cls._with_ctes(rewritten[k],[(cls._cte_name(i),rewritten[i]) for i in needs[k]]).sql(dialect="mysql") + ";"
+            step['depends_on'] = cls._depends_on(k,steps,numbers,alias,consumed,position,needs)
+            fused_steps.append(step)
+        plan = FusedPlan(
+            steps=fused_steps,
+            sources=[None if alias[i] in consumed else position[alias[i]] for i in range(len(steps))],
+            fused=sorted(consumed | {i for i in range(len(steps)) if alias[i] != i}),
+        )
+        try:
+            ExecutionPlanValidator.validate(plan.steps)
+        except ExecutionPlanError as e:
+            print(f"Fused plan failed validation, running the original plan: {e}")
+            return FusedPlan.identity(steps)
+        metrics.inc("chatdb_plan_steps_fused_total",len(plan.fused))
+        return plan
+
+    @staticmethod
+    def _unwrap(tree:exp.Expression)->exp.Expression:
+        # "(SELECT ...)" as a whole step is the same query as "SELECT ..."
+        while isinstance(tree,exp.Subquery) and not tree.alias:
+            tree = tree.this
+        return tree
+
+    @staticmethod
+    def _cte_name(i:int)->str:
+        return f"_step{i+1}"
+
+    @classmethod
+    def _inline(cls,tree:exp.Expression,trees:List[exp.Expression],alias:List[int],earlier)->tuple:
+        """
+        Copy of tree with every value subquery equal to an earlier step
+        replaced by a read of that step's CTE. Later (usually larger) steps are
+        matched first, so a step nested inside another is only inlined once.
+        """
+        tree = tree.copy()
+        embedded = []
+        for i in sorted(earlier,reverse=True):
+            if alias[i] != i:
+                continue
+            for sub in list(tree.find_all(exp.Subquery)):
+                if sub.alias or cls._unwrap(sub.this) != trees[i]:
+                    continue
+                sub.set("this",exp.select("*").from_(cls._cte_name(i)))
+                if i not in embedded:
+                    embedded.append(i)
+        return tree,embedded
+
+    @staticmethod
+    def _with_ctes(tree:exp.Expression,ctes:List[tuple])->exp.Expression:
+        # Folded steps go first: the step's own CTEs may read them too
+        key = "with_" if "with_" in tree.arg_types else "with"
+        own = tree.args.get(key)
+        expressions = [exp.CTE(this=body.copy(),alias=exp.TableAlias(this=exp.to_identifier(name))) for name,body in ctes]
+        if own is not None:
+            expressions.extend(own.expressions)
+        tree.set(key,exp.With(expressions=expressions,recursive=own.args.get("recursive") if own is not None else None))
+        return tree
+
+    @staticmethod
+    def _depends_on(k:int,steps,numbers,alias,consumed,position,needs)->List[int]:
+        # Dependencies of the folded steps carry over to the step that absorbed them
+        pending = [d for i in [k,*needs[k]] for d in steps[i].get('depends_on',[])]
+        deps = set()
+        while pending:
+            i = numbers.get(pending.pop())
+            if i is None:
+                continue
+            i = alias[i]
+            if i in consumed:
+                pending.extend(steps[i].get('depends_on',[]))
+            elif i != k:
+                deps.add(position[i] + 1)
+        return sorted(d for d in deps if d < position[k] + 1)
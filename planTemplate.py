@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from sqlglot import exp
+import sqlAst
+from parse import ExecutionPlanValidator
+from responseCache import ResponseCache,_LITERALS
+from typing import Any,Dict,List,Optional,Tuple
+load_dotenv()
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_MARKER = re.compile(r":chatdb_slot(\d+)\b")
+
+
+@dataclass
+class PlanTemplate:
+    """
+    A validated plan with the question's literals lifted out of its SQL.
+
+    shape: the question with every literal replaced by {n} or {s}
+    slots: for each literal of the question, whether it is a slot; fixed
+           literals must match exactly, so "in May" never answers "in June"
+    fixed: the lower-cased value of each non-slot literal (None for slots)
+    steps: plan steps whose sql uses ? placeholders; step['slots'] maps
+           each placeholder, in order, to a literal of the question
+    """
+    shape : str
+    slots : Tuple[bool,...]
+    fixed : Tuple[Optional[str],...]
+    steps : List[Dict[str,Any]]
+
+
+class PlanTemplates:
+    """
+    Turns plans that executed cleanly into parameterised templates, so a new
+    question that differs only in its literals ("top 5 films in category
+    Comedy" after "top 3 films in category Action") is answered by filling
+    the slots, without a model call. Templates run as server-side prepared
+    statements (Mysql.execute(prepared=True)), reused per pooled connection.
+
+    A literal of the question becomes a slot only when the plan's SQL holds it
+    verbatim as a literal and nowhere else in the question repeats it. Keys
+    include the schema fingerprint. LRU-bounded by CHATDB_TEMPLATE_CACHE_SIZE.
+    """
+
+    def __init__(self,max_entries:Optional[int]=None) -> None:
+        self.max_entries = max_entries or int(os.getenv("CHATDB_TEMPLATE_CACHE_SIZE",512))
+        self._templates:OrderedDict[Tuple[str,str],List[PlanTemplate]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"learned":0,"skipped":0,"hits":0,"misses":0,"evictions":0}
+
+    @staticmethod
+    def _split(question:str)->Tuple[str,List[Tuple[str,str]]]:
+        """
+        (shape, [(kind, value)]) where kind is n (number) or s (string).
+        """
+        question = question.strip()
+        literals:List[Tuple[str,str]] = []
+        parts = []
+        last = 0
+        for match in _LITERALS.finditer(question):
+            value = match.group(0)
+            kind = "n" if _NUMBER.fullmatch(value) else "s"
+            if value[0] in "'\"":
+                value = value[1:-1]
+            literals.append((kind,value))
+            parts.append(question[last:match.start()])
+            parts.append("{" + kind + "}")
+            last = match.end()
+        parts.append(question[last:])
+        return ResponseCache.normalize("".join(parts)),literals
+
+    @staticmethod
+    def _matches(node:exp.Literal,kind:str,value:str)->bool:
+        if kind == "n":
+            return not node.is_string and _NUMBER.fullmatch(node.this or "") is not None and float(node.this) == float(value)
+        return node.is_string and node.this.lower() == value.lower()
+
+    def learn(self,question:str,schema_fingerprint:str,plan:List[Dict[str,Any]])->Optional[PlanTemplate]:
+        shape,literals = self._split(question)
+        values = [value.lower() for _,value in literals]
+        infos = [sqlAst.analyze(ExecutionPlanValidator._normalize_sql(step.get('sql') or "")) for step in plan]
+        if any(info.error is not None for info in infos) or any(step.get('params') for step in plan):
+            return self._skip()
+        # A question literal that matches several SQL literals ("store 1" against
+        # store_id = 1 AND active = 1) cannot tell which of them it fills
+        nodes = [node for info in infos for node in info.tree.find_all(exp.Literal)]
+        for kind,value in literals:
+            if sum(self._matches(node,kind,value) for node in nodes) > 1:
+                return self._skip()
+        steps = []
+        used = set()
+        left:List[str] = []
+        for step,info in zip(plan,infos):
+            tree = info.tree.copy()
+            order = []
+            for node in list(tree.find_all(exp.Literal)):
+                slot = next((i for i,(kind,value) in enumerate(literals) if self._matches(node,kind,value)),None)
+                # A value the question mentions twice cannot be told apart
+                if slot is None or values.count(values[slot]) > 1:
+                    continue
+                order.append(slot)
+                node.replace(exp.Placeholder(this=f"chatdb_slot{len(order)-1}"))
+            left.extend(str(node.this).lower() for node in tree.find_all(exp.Literal,exp.Identifier))
+            sql = tree.sql(dialect="mysql")
+            # Placeholders bind in text order, which need not be the tree's walk order
+            slots = [order[int(m.group(1))] for m in _MARKER.finditer(sql)]
+            sql = _MARKER.sub("?",sql)
+            if len(slots) != len(order) or sqlAst.analyze(sql).error is not None:
+                return self._skip()
+            used.update(slots)
+            steps.append({**step,'sql':sql,'slots':slots})
+        if not used:
+            # Nothing to fill in: the response cache already covers exact repeats
+            return self._skip()
+        # A slot value still in the plan in any other role (inside another literal such
+        # as '%Action%' or '2005-05-01', or as an identifier) would not follow the slot
+        if any(values[i] in text for i in used for text in left):
+            return self._skip()
+        template = PlanTemplate(
+            shape=shape,
+            slots=tuple(i in used for i in range(len(literals))),
+            fixed=tuple(None if i in used else values[i] for i in range(len(literals))),
+            steps=steps,
+        )
+        key = (schema_fingerprint,shape)
+        with self._lock:
+            # Another plan with the same slots replaces the old one
+            templates = [t for t in self._templates.pop(key,[]) if t.slots != template.slots or t.fixed != template.fixed]
+            # Bounded per shape too: "in May" and "in June" share one shape
+            self._templates[key] = (templates + [template])[-8:]
+            self.counters["learned"] += 1
+            while len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+                self.counters["evictions"] += 1
+        return template
+
+    def _skip(self)->None:
+        with self._lock:
+            self.counters["skipped"] += 1
+        return None
+
+    def match(self,question:str,schema_fingerprint:str)->Optional[List[Dict[str,Any]]]:
+        """
+        Plan steps for question with params filled in, or None.
+        """
+        shape,literals = self._split(question)
+        values = [value.lower() for _,value in literals]
+        key = (schema_fingerprint,shape)
+        with self._lock:
+            templates = self._templates.get(key,[])
+            template = next((t for t in templates if all(f is None or f == v for f,v in zip(t.fixed,values))),None)
+            if template is None:
+                self.counters["misses"] += 1
+                return None
+            self._templates.move_to_end(key)
+            self.counters["hits"] += 1
+        params = [(float(value) if "." in value else int(value)) if kind == "n" else value for kind,value in literals]
+        return [
+            {**{k:v for k,v in step.items() if k != 'slots'},'params':[params[slot] for slot in step['slots']]}
+            for step in template.steps
+        ]
+
+    def invalidate(self,schema_fingerprint:Optional[str]=None)->None:
+        with self._lock:
+            for key in [k for k in self._templates if schema_fingerprint is None or k[0] == schema_fingerprint]:
+                del self._templates[key]
+
+    def stats(self)->Dict[str,float]:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {**self.counters,"templates":sum(len(t) for t in self._templates.values()),"hit_rate":self.counters["hits"] / lookups if lookups else 0.0}
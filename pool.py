@@ -1,35 +1,378 @@
 import os
+import time
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict,deque
 from dotenv import load_dotenv
-from mysql.connector import pooling
+import mysql.connector
+from mysql.connector.errors import PoolError
+from metrics import registry as metrics
+from typing import Dict,List,Optional,Any,Tuple
 load_dotenv()
 
+# Upper bounds (seconds) of the checkout wait-time histogram buckets
+WAIT_BUCKETS = (0.001,0.005,0.01,0.05,0.1,0.5,1.0,5.0,float("inf"))
+
+
+class PooledConnection:
+    """
+    Proxy around a raw mysql-connector connection. close() hands it back to its
+    pool instead of closing the socket; discard() drops it for good.
+    """
+
+    def __init__(self,pool:"ElasticPool",raw,database:str) -> None:
+        self._pool = pool
+        self._raw = raw
+        self._database = database
+
+    def __getattr__(self,name:str):
+        if self._raw is None:
+            raise PoolError("Connection was already returned to the pool")
+        return getattr(self._raw,name)
+
+    def close(self)->None:
+        raw,self._raw = self._raw,None
+        if raw is not None:
+            self._pool._release(raw,self._database)
+
+    def discard(self)->None:
+        raw,self._raw = self._raw,None
+        if raw is not None:
+            self._pool._discard(raw)
+
+    def statement(self,sql:str):
+        """
+        Server-side prepared cursor for sql, kept with this connection across
+        checkouts. Do not close it; the pool does when it is evicted.
+        """
+        if self._raw is None:
+            raise PoolError("Connection was already returned to the pool")
+        return self._pool._statement(self._raw,self._database,sql)
+
+    def forget(self,sql:str)->None:
+        # After an error the prepared cursor's state is unknown; prepare afresh next time
+        if self._raw is not None:
+            self._pool._forget(self._raw,self._database,sql)
+
+
+class ElasticPool:
+    """
+    Thread-safe pool that grows from min_size up to max_size on demand and
+    queues callers for up to `timeout` seconds when every connection is busy,
+    instead of failing at once like pooling.MySQLConnectionPool. At most
+    max_waiters callers queue; beyond that a checkout fails at once.
+
+    - Connections idle longer than idle_timeout are closed (never below min_size)
+    - Connections idle longer than ping_after are pinged before being handed out
+    - One pool serves every database on the same server and credentials; the
+      default database is switched on checkout when it differs
+    """
+
+    def __init__(
+        self,
+        name:str,
+        min_size:Optional[int]=None,
+        max_size:Optional[int]=None,
+        timeout:Optional[float]=None,
+        idle_timeout:Optional[float]=None,
+        ping_after:Optional[float]=None,
+        max_waiters:Optional[int]=None,
+        **config
+    ) -> None:
+        self.name = name
+        self.max_size = max_size or int(os.getenv("CHATDB_POOL_MAX",10))
+        self.min_size = min(min_size if min_size is not None else int(os.getenv("CHATDB_POOL_MIN",1)),self.max_size)
+        self.timeout = timeout if timeout is not None else float(os.getenv("CHATDB_POOL_TIMEOUT",10))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("CHATDB_POOL_IDLE",300))
+        self.ping_after = ping_after if ping_after is not None else float(os.getenv("CHATDB_POOL_PING_AFTER",30))
+        self.max_waiters = max_waiters if max_waiters is not None else int(os.getenv("CHATDB_POOL_MAX_WAITERS",self.max_size * 4))
+        self.config = config
+        # Idle connections as (raw, database, last_used); reused LIFO so cold ones age out from the left
+        self._idle:deque = deque()
+        self._size = 0
+        self._waiting = 0
+        self._last_reap = time.monotonic()
+        self._cond = threading.Condition()
+        self.counters = {"checkouts":0,"created":0,"closed":0,"reaped":0,"health_failures":0,"exhausted":0,"timeouts":0,"rejected":0,"prepared":0,"prepared_hits":0}
+        # Prepared cursors per raw connection, keyed by (database, sql): a statement
+        # resolves its tables against the default database it was prepared in
+        self.max_statements = int(os.getenv("CHATDB_PREPARED_CACHE",64))
+        self._statements:Dict[int,OrderedDict] = {}
+        self._wait_histogram = [0]*len(WAIT_BUCKETS)
+        self._wait_total = 0.0
+        for _ in range(self.min_size):
+            self._idle.append((self._connect(),config.get("database"),time.monotonic()))
+            self._size += 1
+
+    def _connect(self,database:Optional[str]=None):
+        config = dict(self.config)
+        if database:
+            config["database"] = database
+        raw = mysql.connector.connect(**config)
+        with self._cond:
+            self.counters["created"] += 1
+        return raw
+
+    def get_connection(self,database:Optional[str]=None,timeout:Optional[float]=None)->PooledConnection:
+        database = database or self.config.get("database")
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            entry = self._acquire(deadline,start)
+            if entry is None:
+                try:
+                    raw = self._connect(database)
+                except Exception:
+                    self._discard(None)
+                    raise
+                return PooledConnection(self,raw,database)
+            raw,current,last_used = entry
+            if not self._usable(raw,last_used):
+                self._discard(raw)
+                continue
+            try:
+                if current != database:
+                    raw.cmd_init_db(database)
+            except Exception:
+                self._discard(raw)
+                raise
+            return PooledConnection(self,raw,database)
+
+    def _acquire(self,deadline:float,start:float)->Optional[Tuple[Any,str,float]]:
+        """
+        Waits for an idle connection or a free slot. Returns the idle
+        (raw, database, last_used) entry, or None when a new slot was reserved.
+        """
+        to_close = []
+        try:
+            with self._cond:
+                to_close = self._reap()
+                exhausted = False
+                while not self._idle and self._size >= self.max_size:
+                    if not exhausted:
+                        self.counters["exhausted"] += 1
+                        metrics.inc("chatdb_pool_exhausted_total",pool=self.name)
+                        exhausted = True
+                    if self._waiting >= self.max_waiters:
+                        # Overloaded: queueing more callers only makes every one of them time out
+                        self.counters["rejected"] += 1
+                        metrics.inc("chatdb_pool_rejected_total",pool=self.name)
+                        raise PoolError(
+                            f"Pool {self.name} exhausted: {self._size} connections busy and {self._waiting} requests already waiting"
+                        )
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters["timeouts"] += 1
+                        raise PoolError(
+                            f"Pool {self.name} exhausted: {self._size} connections busy, waited {time.monotonic()-start:.2f}s"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                self._record_wait(time.monotonic() - start)
+                self.counters["checkouts"] += 1
+                if self._idle:
+                    return self._idle.pop()
+                self._size += 1
+                return None
+        finally:
+            for raw in to_close:
+                self._close(raw)
+
+    def _usable(self,raw,last_used:float)->bool:
+        if time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception as e:
+            print(f"Dropping dead connection from pool {self.name}: {e}")
+            with self._cond:
+                self.counters["health_failures"] += 1
+            return False
+
+    def _release(self,raw,database:str)->None:
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+            if self._statements.get(id(raw)) and not self._has_user_variables(raw):
+                # reset_session would deallocate the prepared statements. Validated
+                # statements cannot SET, USE or change the character set; what they
+                # can leave behind is user variables (SELECT @a := 1), checked above,
+                # and the deadline's max_execution_time
+                with raw.cursor() as cursor:
+                    cursor.execute("SET SESSION max_execution_time = 0")
+            else:
+                # The pool is shared by every user of these credentials: start clean,
+                # statements are prepared again on their next use
+                self._drop_statements(raw)
+                raw.reset_session()
+        except Exception as e:
+            print(f"Dropping connection that failed to reset in pool {self.name}: {e}")
+            self._discard(raw)
+            return
+        with self._cond:
+            self._idle.append((raw,database,time.monotonic()))
+            self._cond.notify()
+
+    def _has_user_variables(self,raw)->bool:
+        try:
+            with raw.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM performance_schema.user_variables_by_thread WHERE THREAD_ID = "
+                    "(SELECT THREAD_ID FROM performance_schema.threads WHERE PROCESSLIST_ID = CONNECTION_ID()) LIMIT 1"
+                )
+                return bool(cursor.fetchall())
+        except Exception:
+            # Cannot tell (performance_schema off): assume the worst
+            return True
+
+    def _drop_statements(self,raw)->None:
+        with self._cond:
+            statements = self._statements.pop(id(raw),None) or {}
+        for cursor in statements.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def _discard(self,raw)->None:
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        if raw is not None:
+            self._close(raw)
+
+    def _close(self,raw)->None:
+        with self._cond:
+            self._statements.pop(id(raw),None)
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self.counters["closed"] += 1
+
+    def _statement(self,raw,database:str,sql:str):
+        # Only the thread holding raw uses its statements
+        with self._cond:
+            statements = self._statements.setdefault(id(raw),OrderedDict())
+        key = (database,sql)
+        cursor = statements.get(key)
+        if cursor is not None:
+            statements.move_to_end(key)
+            with self._cond:
+                self.counters["prepared_hits"] += 1
+            return cursor
+        cursor = raw.cursor(prepared=True,dictionary=True)
+        statements[key] = cursor
+        with self._cond:
+            self.counters["prepared"] += 1
+        while len(statements) > self.max_statements:
+            _,evicted = statements.popitem(last=False)
+            try:
+                evicted.close()
+            except Exception as e:
+                print(f"Could not deallocate prepared statement in pool {self.name}: {e}")
+        return cursor
+
+    def _forget(self,raw,database:str,sql:str)->None:
+        cursor = self._statements.get(id(raw),{}).pop((database,sql),None)
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def _reap(self)->List[Any]:
+        # Called with the lock held; the caller closes the returned connections outside it
+        now = time.monotonic()
+        if now - self._last_reap < min(self.idle_timeout,60):
+            return []
+        self._last_reap = now
+        expired = []
+        while self._idle and self._size > self.min_size and now - self._idle[0][2] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+            self.counters["reaped"] += 1
+        return expired
+
+    def _record_wait(self,waited:float)->None:
+        self._wait_histogram[bisect.bisect_left(WAIT_BUCKETS,waited)] += 1
+        self._wait_total += waited
+        metrics.observe("chatdb_pool_wait_seconds",waited,pool=self.name)
+
+    def metrics(self)->Dict[str,Any]:
+        with self._cond:
+            return {
+                **self.counters,
+                "size":self._size,
+                "idle":len(self._idle),
+                "in_use":self._size - len(self._idle),
+                "waiting":self._waiting,
+                "max_size":self.max_size,
+                "max_waiters":self.max_waiters,
+                "wait_seconds_total":self._wait_total,
+                "wait_histogram":{("+Inf" if b == float("inf") else str(b)):n for b,n in zip(WAIT_BUCKETS,self._wait_histogram)},
+            }
+
+
+class PoolView:
+    """
+    A user key's handle on a shared ElasticPool: checkouts land on its database.
+    """
+
+    def __init__(self,pool:ElasticPool,database:str) -> None:
+        self.pool = pool
+        self.database = database
+
+    def get_connection(self,timeout:Optional[float]=None)->PooledConnection:
+        return self.pool.get_connection(self.database,timeout)
+
+    def metrics(self)->Dict[str,Any]:
+        return self.pool.metrics()
+
+
 class PoolManager:
     pool = {}
     db = {}
+    # Shared ElasticPools keyed by server + credentials
+    servers:Dict[str,ElasticPool] = {}
+    _lock = threading.Lock()
+
     @classmethod
     def create_pool(cls,user_key:str,user:str,password:str,host:str,port,db_name = "chatdb_test"):
         key = user_key
-        if key not in cls.db:
-            cls.db[key] = db_name
-        if key not in cls.pool:
-            cls.pool[key] = pooling.MySQLConnectionPool(
-                pool_name=f"pool_{user}",
-                pool_size=5,
-                host=host,
-                user=user,
-                port=port,
-                password=password,
-                database=db_name
-            )
+        with cls._lock:
+            if key not in cls.db:
+                cls.db[key] = db_name
+            if key not in cls.pool:
+                # Connections are only shared between keys with identical credentials,
+                # so one user's session never runs with another user's privileges
+                server = hashlib.sha256(f"{user}|{password}|{host}|{port}".encode()).hexdigest()
+                if server not in cls.servers:
+                    cls.servers[server] = ElasticPool(
+                        name=f"pool_{user}@{host}:{port}",
+                        host=host,
+                        user=user,
+                        port=port,
+                        password=password,
+                        database=db_name
+                    )
+                cls.pool[key] = PoolView(cls.servers[server],db_name)
         return cls.pool[key]
-    
+
     @classmethod
-    def get_pool(cls,user_key:str)->pooling.MySQLConnectionPool:
+    def get_pool(cls,user_key:str)->PoolView:
         if user_key not in cls.pool:
             raise KeyError("The key of this particular user is not created... Try calling create_pool first...")
         else:
             return cls.pool[user_key]
-    
+
     @classmethod
     def get_user_db(cls,user_key:str)->str:
         try:
@@ -38,4 +381,8 @@ class PoolManager:
             else:
                 return cls.db[user_key]
         except Exception as e:
-            print(f"Exception Occured...{e}")
\ No newline at end of file
+            print(f"Exception Occured...{e}")
+
+    @classmethod
+    def metrics(cls)->Dict[str,Dict[str,Any]]:
+        return {pool.name:pool.metrics() for pool in cls.servers.values()}
@@ -0,0 +1,171 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from schemaSelector import stem
+from typing import Dict,List,Optional,Tuple,FrozenSet
+load_dotenv()
+
+_SPACES = re.compile(r"\s+")
+_WORD = re.compile(r"[a-z0-9]+")
+# Filler words that never change what a question asks for
+_FILLER = {
+    "a","an","the","of","in","on","for","to","by","per","each","every","all","me","us","please",
+    "find","show","list","give","get","return","display","tell","what","which","are","is",
+}
+_TRAILING = re.compile(r"[\s\?\.\!;]+$")
+# Values that change the answer: numbers, quoted strings and mid-sentence capitalised words
+_LITERALS = re.compile(r"\d+(?:\.\d+)?|'[^']*'|\"[^\"]*\"|(?<=\s)[A-Z][\w-]*")
+# Words that flip or reverse what is asked: one of them more or less must never count as
+# a near duplicate, however long the rest of the question is
+_POLARITY = {
+    "not","no","never","none","nor","neither","without","except","excluding","exclude","excludes",
+    "least","most","fewest","lowest","highest","smallest","largest","minimum","maximum","min","max",
+    "below","above","under","over","less","more","fewer","greater","lower","higher",
+    "before","after","earliest","latest","oldest","newest","first","last",
+    "asc","ascending","desc","descending","bottom","top","worst","best","cheapest",
+}
+_NEGATED = re.compile(r"n't\b")
+
+
+@dataclass
+class CacheEntry:
+    key : Tuple[str,str]
+    plan : List[Dict[str,str]]
+    expires_at : float
+    terms : FrozenSet[str]
+    literals : Tuple[str,...]
+    polarity : Tuple[str,...]
+
+
+class ResponseCache:
+    """
+    Two-tier cache of validated execution plans in front of ChatDB.chat.
+
+    Tier 1 is an exact match on the normalised question text. Tier 2 is an
+    inverted index over the question's content words (filler removed, stemmed)
+    that finds near-duplicate questions by Jaccard similarity. It only reuses a
+    plan when both questions contain the same literals, so "top 3" never
+    answers "top 5", and the same negation and polarity words, so "have not
+    rented" never answers "have rented". Every key includes the schema fingerprint, so a
+    schema change invalidates old plans.
+    """
+
+    def __init__(self,max_entries:Optional[int]=None,ttl:Optional[float]=None,similarity:Optional[float]=None) -> None:
+        self.max_entries = max_entries or int(os.getenv("CHATDB_RESPONSE_CACHE_SIZE",1024))
+        self.ttl = ttl if ttl is not None else float(os.getenv("CHATDB_RESPONSE_CACHE_TTL",3600))
+        self.similarity = similarity if similarity is not None else float(os.getenv("CHATDB_RESPONSE_CACHE_SIMILARITY",0.85))
+        self._entries:OrderedDict[Tuple[str,str],CacheEntry] = OrderedDict()
+        self._index:Dict[str,set] = {}
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits":0,"similar_hits":0,"misses":0,"evictions":0,"expired":0}
+
+    @staticmethod
+    def normalize(question:str)->str:
+        return _TRAILING.sub("",_SPACES.sub(" ",question.strip())).lower()
+
+    @staticmethod
+    def _terms(text:str)->FrozenSet[str]:
+        return frozenset(stem(w) for w in _WORD.findall(text) if w not in _FILLER)
+
+    @staticmethod
+    def _literals(question:str)->Tuple[str,...]:
+        return tuple(sorted(m.lower() for m in _LITERALS.findall(question.strip())))
+
+    @staticmethod
+    def _polarity(question:str)->Tuple[str,...]:
+        words = _WORD.findall(_NEGATED.sub(" not",question.lower()))
+        return tuple(sorted(w for w in words if w in _POLARITY))
+
+    def get(self,question:str,schema_fingerprint:str)->Optional[List[Dict[str,str]]]:
+        normalized = self.normalize(question)
+        key = (schema_fingerprint,normalized)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._alive(entry,now):
+                self._entries.move_to_end(key)
+                self.counters["exact_hits"] += 1
+                return [dict(step) for step in entry.plan]
+
+            entry = self._most_similar(schema_fingerprint,normalized,self._literals(question),self._polarity(question),now)
+            if entry:
+                self._entries.move_to_end(entry.key)
+                self.counters["similar_hits"] += 1
+                return [dict(step) for step in entry.plan]
+
+            self.counters["misses"] += 1
+            return None
+
+    def _most_similar(self,schema_fingerprint:str,normalized:str,literals:Tuple[str,...],polarity:Tuple[str,...],now:float)->Optional[CacheEntry]:
+        terms = self._terms(normalized)
+        if not terms:
+            return None
+        overlap:Dict[Tuple[str,str],int] = {}
+        for term in terms:
+            for key in self._index.get(term,()):
+                if key[0] == schema_fingerprint:
+                    overlap[key] = overlap.get(key,0) + 1
+        best,best_score = None,self.similarity
+        for key,shared in overlap.items():
+            entry = self._entries[key]
+            score = shared / (len(terms) + len(entry.terms) - shared)
+            if score >= best_score and entry.literals == literals and entry.polarity == polarity and self._alive(entry,now):
+                best,best_score = entry,score
+        return best
+
+    def _alive(self,entry:CacheEntry,now:float)->bool:
+        if entry.expires_at >= now:
+            return True
+        self._remove(entry.key)
+        self.counters["expired"] += 1
+        return False
+
+    def put(self,question:str,schema_fingerprint:str,plan:List[Dict[str,str]])->None:
+        normalized = self.normalize(question)
+        key = (schema_fingerprint,normalized)
+        entry = CacheEntry(
+            key=key,
+            plan=[dict(step) for step in plan],
+            expires_at=time.monotonic() + self.ttl,
+            terms=self._terms(normalized),
+            literals=self._literals(question),
+            polarity=self._polarity(question)
+        )
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            for term in entry.terms:
+                self._index.setdefault(term,set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.counters["evictions"] += 1
+
+    def _remove(self,key:Tuple[str,str])->None:
+        entry = self._entries.pop(key,None)
+        if not entry:
+            return
+        for term in entry.terms:
+            keys = self._index.get(term)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._index[term]
+
+    def invalidate(self,schema_fingerprint:Optional[str]=None)->None:
+        """
+        Drops every plan built against schema_fingerprint, or everything when None.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if schema_fingerprint is None or k[0] == schema_fingerprint]:
+                self._remove(key)
+
+    def stats(self)->Dict[str,float]:
+        with self._lock:
+            lookups = self.counters["exact_hits"] + self.counters["similar_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            return {**self.counters,"entries":len(self._entries),"hit_rate":hits / lookups if lookups else 0.0}
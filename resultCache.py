@@ -0,0 +1,328 @@
+import os
+import re
+import sys
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from metrics import registry as metrics
+from parse import ExecutionPlanValidator
+from pool import PoolManager
+from sqlAst import referenced_tables,volatile
+from typing import Any,Callable,Dict,List,Optional,Tuple
+load_dotenv()
+
+_SPACES = re.compile(r"\s+")
+# String literals are kept verbatim while whitespace elsewhere is collapsed
+_STRINGS = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+
+# Sentinel: a table whose data version cannot be known (views, other schemas, temporary tables)
+UNKNOWN = object()
+
+
+def normalize_statement(sql:str)->str:
+    sql = ExecutionPlanValidator._normalize_sql(sql).rstrip(";").strip()
+    parts = _STRINGS.split(sql)
+    return "".join(part if i % 2 else _SPACES.sub(" ",part) for i,part in enumerate(parts)).strip()
+
+
+class DataVersionProbe:
+    """
+    Reads a per-table data version used to tell whether a cached result is stale.
+
+    - update_time: information_schema.TABLES.UPDATE_TIME, read with
+      information_schema_stats_expiry=0 so MySQL 8 does not serve cached stats
+    - row_count: exact COUNT(*) per table (catches inserts/deletes only)
+    - checksum: CHECKSUM TABLE (exact, but reads the whole table)
+
+    Versions are reused for ttl seconds, so a result can be up to ttl seconds stale.
+    """
+    MODES = ("update_time","row_count","checksum")
+
+    def __init__(self,mode:Optional[str]=None,ttl:Optional[float]=None) -> None:
+        self.mode = mode or os.getenv("CHATDB_RESULT_CACHE_PROBE","update_time")
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown data version probe {self.mode}, expected one of {self.MODES}")
+        self.ttl = ttl if ttl is not None else float(os.getenv("CHATDB_RESULT_CACHE_PROBE_TTL",1))
+        self._versions:Dict[Tuple[str,str],Tuple[Any,float]] = {}
+        self._lock = threading.Lock()
+        self.probes = 0
+
+    def versions(self,key:str,tables:List[str],conn=None)->Tuple[Any,...]:
+        now = time.monotonic()
+        found:Dict[str,Any] = {}
+        with self._lock:
+            for table in tables:
+                cached = self._versions.get((key,table))
+                if cached and cached[1] > now:
+                    found[table] = cached[0]
+        missing = [t for t in tables if t not in found]
+        if missing:
+            fresh = self._probe(key,missing,conn)
+            with self._lock:
+                self.probes += 1
+                for table in missing:
+                    found[table] = fresh.get(table,UNKNOWN)
+                    self._versions[(key,table)] = (found[table],now + self.ttl)
+        return tuple(found[t] for t in tables)
+
+    def _probe(self,key:str,tables:List[str],conn=None)->Dict[str,Any]:
+        db_name = PoolManager.get_user_db(key)
+        local = [t for t in tables if "." not in t or t.split(".",1)[0] == db_name]
+        if not local:
+            return {}
+        own = conn is None
+        if own:
+            conn = PoolManager.get_pool(user_key=key).get_connection()
+        try:
+            with conn.cursor() as cursor:
+                if self.mode == "update_time":
+                    return self._update_times(cursor,db_name,local)
+                if self.mode == "row_count":
+                    return self._row_counts(cursor,db_name,local)
+                return self._checksums(cursor,db_name,local)
+        except Exception as e:
+            print(f"Data version probe failed, not caching: {e}")
+            return {}
+        finally:
+            if own:
+                conn.close()
+
+    @staticmethod
+    def _update_times(cursor,db_name:str,tables:List[str])->Dict[str,Any]:
+        names = [t.split(".")[-1] for t in tables]
+        # The connection may be a caller's pinned one: put the session setting back
+        cursor.execute("SELECT @@SESSION.information_schema_stats_expiry")
+        expiry = cursor.fetchone()[0]
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        try:
+            cursor.execute(
+                f"""
+                SELECT TABLE_NAME,TABLE_TYPE,UPDATE_TIME,CREATE_TIME
+                FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = %s AND TABLE_NAME IN ({",".join(["%s"]*len(names))})
+                """,
+                [db_name,*names]
+            )
+            rows = {name:(kind,updated,created) for name,kind,updated,created in cursor.fetchall()}
+        finally:
+            cursor.execute("SET SESSION information_schema_stats_expiry = %s",[expiry])
+        versions = {}
+        for table,name in zip(tables,names):
+            row = rows.get(name)
+            # A view's data lives in tables we did not probe
+            if row and row[0] == "BASE TABLE":
+                versions[table] = (row[1],row[2])
+        return versions
+
+    @staticmethod
+    def _row_counts(cursor,db_name:str,tables:List[str])->Dict[str,Any]:
+        versions = {}
+        for table in tables:
+            cursor.execute(f"SELECT COUNT(*) FROM `{db_name}`.`{table.split('.')[-1]}`")
+            versions[table] = cursor.fetchone()[0]
+        return versions
+
+    @staticmethod
+    def _checksums(cursor,db_name:str,tables:List[str])->Dict[str,Any]:
+        refs = ",".join(f"`{db_name}`.`{t.split('.')[-1]}`" for t in tables)
+        cursor.execute(f"CHECKSUM TABLE {refs}")
+        sums = {name.split(".")[-1]:checksum for name,checksum in cursor.fetchall()}
+        return {t:sums[t.split(".")[-1]] for t in tables if sums.get(t.split(".")[-1]) is not None}
+
+
+@dataclass
+class ResultEntry:
+    versions : Tuple[Any,...]
+    result : Any
+    size : int
+
+
+class ResultCache:
+    """
+    LRU cache of step results keyed by user key, normalised SQL and params.
+    Each entry remembers the data versions of the tables it read and is only
+    served while a probe returns the same versions. The memory tier is bounded
+    in bytes; evicted entries spill to disk when a spill directory is set.
+    """
+
+    def __init__(
+        self,
+        max_bytes:Optional[int]=None,
+        spill_dir:Optional[str]=None,
+        max_spill_bytes:Optional[int]=None,
+        probe:Optional[DataVersionProbe]=None
+    ) -> None:
+        self.max_bytes = max_bytes or int(os.getenv("CHATDB_RESULT_CACHE_BYTES",64*2**20))
+        self.spill_dir = spill_dir if spill_dir is not None else os.getenv("CHATDB_RESULT_CACHE_DIR","")
+        self.max_spill_bytes = max_spill_bytes or int(os.getenv("CHATDB_RESULT_CACHE_DISK_BYTES",512*2**20))
+        self.probe = probe or DataVersionProbe()
+        self._entries:OrderedDict[str,ResultEntry] = OrderedDict()
+        self._spilled:OrderedDict[str,int] = OrderedDict()
+        self._bytes = 0
+        self._spill_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits":0,"disk_hits":0,"misses":0,"stale":0,"uncacheable":0,"evictions":0,"spills":0}
+
+    @staticmethod
+    def make_key(key:str,sql:str,params=None)->str:
+        raw = f"{key}\x00{normalize_statement(sql)}\x00{params!r}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def fetch(self,key:str,sql:str,run:Callable[[],Any],params=None,conn=None)->Any:
+        """
+        Returns the cached result of sql when its tables are unchanged,
+        otherwise calls run() and caches what it returns.
+        """
+        tables = referenced_tables(sql)
+        # NOW(), RAND() and the like change without the tables changing
+        if volatile(sql):
+            tables = []
+        versions = self.probe.versions(key,tables,conn) if tables else ()
+        if not tables or any(v is UNKNOWN for v in versions):
+            with self._lock:
+                self.counters["uncacheable"] += 1
+            metrics.current().set(cache="uncacheable")
+            return run()
+
+        cache_key = self.make_key(key,sql,params)
+        hit = self._get(cache_key,versions)
+        if hit is not None:
+            metrics.current().set(cache="hit")
+            metrics.inc("chatdb_result_cache_total",outcome="hit")
+            return self._copy(hit)
+        metrics.current().set(cache="miss")
+        metrics.inc("chatdb_result_cache_total",outcome="miss")
+        # Versions were read before running, so a concurrent write makes the next probe miss
+        result = run()
+        self._put(cache_key,versions,result)
+        return self._copy(result)
+
+    @staticmethod
+    def _copy(result:Any)->Any:
+        if isinstance(result,list):
+            rows = [dict(row) if isinstance(row,dict) else row for row in result]
+            # Keeps subclasses such as SQL.TruncatedResult and their metadata
+            return result.with_rows(rows) if hasattr(result,"with_rows") else rows
+        return result
+
+    def _get(self,cache_key:str,versions:Tuple[Any,...])->Any:
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            from_disk = False
+            if entry is None and cache_key in self._spilled:
+                entry = self._load_spilled(cache_key)
+                from_disk = entry is not None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            if entry.versions != versions:
+                self.counters["stale"] += 1
+                if not from_disk:
+                    del self._entries[cache_key]
+                    self._bytes -= entry.size
+                return None
+            if from_disk:
+                self.counters["disk_hits"] += 1
+                self._store(cache_key,entry)
+            else:
+                self._entries.move_to_end(cache_key)
+                self.counters["hits"] += 1
+            return entry.result
+
+    def _put(self,cache_key:str,versions:Tuple[Any,...],result:Any)->None:
+        size = self._sizeof(result)
+        # A single result may not take more than a quarter of the budget
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._entries.pop(cache_key,None)
+            if old:
+                self._bytes -= old.size
+            self._store(cache_key,ResultEntry(versions=versions,result=result,size=size))
+
+    def _store(self,cache_key:str,entry:ResultEntry)->None:
+        # Called with the lock held
+        self._entries[cache_key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._entries:
+            oldest,evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.counters["evictions"] += 1
+            self._spill(oldest,evicted)
+
+    @staticmethod
+    def _sizeof(result:Any)->int:
+        if not isinstance(result,list):
+            return sys.getsizeof(result)
+        size = sys.getsizeof(result)
+        for row in result:
+            size += sys.getsizeof(row)
+            if isinstance(row,dict):
+                # Column-name keys are shared between rows; only values count
+                size += sum(sys.getsizeof(v) for v in row.values())
+        return size
+
+    def _spill_path(self,cache_key:str)->str:
+        return os.path.join(self.spill_dir,f"result_{cache_key}.pkl")
+
+    def _spill(self,cache_key:str,entry:ResultEntry)->None:
+        if not self.spill_dir:
+            return
+        path = self._spill_path(cache_key)
+        try:
+            os.makedirs(self.spill_dir,exist_ok=True)
+            with open(path,"wb") as f:
+                pickle.dump((entry.versions,entry.result),f,protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"Could not spill result cache entry: {e}")
+            return
+        self._spill_bytes += size - self._spilled.pop(cache_key,0)
+        self._spilled[cache_key] = size
+        self.counters["spills"] += 1
+        while self._spill_bytes > self.max_spill_bytes and self._spilled:
+            self._drop_spilled(next(iter(self._spilled)))
+
+    def _load_spilled(self,cache_key:str)->Optional[ResultEntry]:
+        path = self._spill_path(cache_key)
+        try:
+            with open(path,"rb") as f:
+                versions,result = pickle.load(f)
+        except (OSError,pickle.PickleError,EOFError) as e:
+            print(f"Ignoring unreadable result cache entry {path}: {e}")
+            self._drop_spilled(cache_key)
+            return None
+        self._drop_spilled(cache_key)
+        return ResultEntry(versions=versions,result=result,size=self._sizeof(result))
+
+    def _drop_spilled(self,cache_key:str)->None:
+        self._spill_bytes -= self._spilled.pop(cache_key,0)
+        try:
+            os.remove(self._spill_path(cache_key))
+        except OSError:
+            pass
+
+    def invalidate(self)->None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            for cache_key in list(self._spilled):
+                self._drop_spilled(cache_key)
+
+    def stats(self)->Dict[str,float]:
+        with self._lock:
+            hits = self.counters["hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"] + self.counters["stale"]
+            return {
+                **self.counters,
+                "entries":len(self._entries),
+                "bytes":self._bytes,
+                "spilled_entries":len(self._spilled),
+                "spilled_bytes":self._spill_bytes,
+                "probes":self.probe.probes,
+                "hit_rate":hits / lookups if lookups else 0.0
+            }
@@ -1,6 +1,9 @@
 from pool import PoolManager
 from SQL import Mysql
-from typing import Union,List,Dict
+from typing import Union,List,Dict,Optional
+
+# Columns read from information_schema.columns, in the shape DBSchemaFormatter expects
+COLUMN_FIELDS = "COLUMN_NAME, DATA_TYPE, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, COLUMN_DEFAULT, EXTRA"
 
 class DBSchema:
     @classmethod
@@ -9,24 +12,87 @@ class DBSchema:
             query = """SELECT table_name
 FROM information_schema.tables
 WHERE table_schema = %s;"""
-            result = Mysql.execute(key=user_key,sql=query,params=(db_name,))
+            result = Mysql.execute(key=user_key,sql=query,params=(db_name,),max_rows=None)
             return result
         except Exception as e:
             print("Error has occured in getting the db_schema...")
             raise e
-    
+
     @classmethod
     def get_TableSchema(cls,user_key:str,tab_name:str)->Union[List[dict],int,None]:
         try:
             db_name = PoolManager.get_user_db(user_key=user_key)
-            query = """SELECT column_name, data_type, is_nullable, column_key
+            query = f"""SELECT {COLUMN_FIELDS}
 FROM information_schema.columns
 WHERE table_schema = %s
-AND table_name = %s;
+AND table_name = %s
+ORDER BY ordinal_position;
 """
-            result = Mysql.execute(key=user_key,sql=query,params=(db_name,tab_name))
+            result = Mysql.execute(key=user_key,sql=query,params=(db_name,tab_name),max_rows=None)
             return result
         except Exception as e:
             print(f"Error has occured in getting the db_schema...{e}")
 
-    
\ No newline at end of file
+    @classmethod
+    def get_ColumnsSchema(cls,user_key:str,db_name:str,tables:Optional[List[str]]=None)->Dict[str,List[dict]]:
+        """
+        Bulk variant of get_TableSchema: fetches the columns of every table in
+        db_name (or only of `tables`) in one round trip, grouped by table name.
+        """
+        try:
+            query = f"""SELECT TABLE_NAME, {COLUMN_FIELDS}
+FROM information_schema.columns
+WHERE table_schema = %s"""
+            params = [db_name]
+            if tables:
+                query += f"\nAND table_name IN ({', '.join(['%s'] * len(tables))})"
+                params.extend(tables)
+            query += "\nORDER BY table_name, ordinal_position;"
+            rows = Mysql.execute(key=user_key,sql=query,params=tuple(params),max_rows=None)
+            grouped:Dict[str,List[dict]] = {}
+            for row in rows or []:
+                grouped.setdefault(row.pop('TABLE_NAME'),[]).append(row)
+            return grouped
+        except Exception as e:
+            print(f"Error has occured in getting the columns schema...{e}")
+            raise
+
+    @classmethod
+    def get_TableFingerprints(cls,user_key:str,db_name:str)->Dict[str,str]:
+        """
+        Cheap per-table change detector: creation time plus a count and CRC of the
+        column definitions. Used to validate the on-disk schema cache.
+        """
+        try:
+            query = """SELECT t.TABLE_NAME, t.CREATE_TIME, COUNT(c.COLUMN_NAME) AS COLUMN_COUNT,
+SUM(CRC32(CONCAT_WS('|', c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, c.COLUMN_KEY, IFNULL(c.COLUMN_DEFAULT, ''), c.EXTRA))) AS COLUMN_CRC
+FROM information_schema.tables t
+LEFT JOIN information_schema.columns c
+ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+WHERE t.TABLE_SCHEMA = %s
+GROUP BY t.TABLE_NAME, t.CREATE_TIME
+ORDER BY t.TABLE_NAME;"""
+            rows = Mysql.execute(key=user_key,sql=query,params=(db_name,),max_rows=None)
+            return {
+                row['TABLE_NAME']:f"{row['CREATE_TIME']}|{row['COLUMN_COUNT']}|{row['COLUMN_CRC']}"
+                for row in rows or []
+            }
+        except Exception as e:
+            print(f"Error has occured in getting the table fingerprints...{e}")
+            raise
+
+    @classmethod
+    def get_ForeignKeys(cls,user_key:str,db_name:str)->List[dict]:
+        try:
+            query = """SELECT k.CONSTRAINT_NAME, k.TABLE_NAME, k.COLUMN_NAME, k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME
+FROM information_schema.KEY_COLUMN_USAGE k
+JOIN information_schema.REFERENTIAL_CONSTRAINTS r
+ON r.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA AND r.CONSTRAINT_NAME = k.CONSTRAINT_NAME AND r.TABLE_NAME = k.TABLE_NAME
+WHERE k.TABLE_SCHEMA = %s
+AND k.REFERENCED_TABLE_SCHEMA = k.TABLE_SCHEMA
+ORDER BY k.TABLE_NAME, k.CONSTRAINT_NAME, k.ORDINAL_POSITION;"""
+            result = Mysql.execute(key=user_key,sql=query,params=(db_name,),max_rows=None)
+            return list(result or [])
+        except Exception as e:
+            print(f"Error has occured in getting the foreign keys...{e}")
+            raise
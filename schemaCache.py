@@ -0,0 +1,54 @@
+import os
+import json
+import tempfile
+from dotenv import load_dotenv
+from typing import Dict,Optional,Any,List
+load_dotenv()
+
+# Bump whenever the cached payload or DBSchemaFormatter output changes shape
+SCHEMA_CACHE_VERSION = 3
+
+
+class SchemaCache:
+    """
+    On-disk cache of the formatted schema text, one JSON file per connection
+    identity (Mysql.make_identity). Each table entry carries the fingerprint it
+    was built from so only changed tables need to be re-introspected.
+    """
+
+    def __init__(self,cache_dir:Optional[str]=None) -> None:
+        self.cache_dir = cache_dir or os.getenv("CHATDB_SCHEMA_CACHE_DIR",".chatdb_cache")
+
+    def _path(self,identity:str)->str:
+        return os.path.join(self.cache_dir,f"schema_{identity}.json")
+
+    def load(self,identity:str)->Dict[str,Any]:
+        path = self._path(identity)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path,"r",encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError,ValueError) as e:
+            print(f"Ignoring unreadable schema cache {path}: {e}")
+            return {}
+        if payload.get("version") != SCHEMA_CACHE_VERSION:
+            return {}
+        return payload
+
+    def save(self,identity:str,db_name:str,tables:Dict[str,Dict[str,Any]],foreign_keys:List[dict])->None:
+        payload = {"version":SCHEMA_CACHE_VERSION,"db_name":db_name,"tables":tables,"foreign_keys":foreign_keys}
+        try:
+            os.makedirs(self.cache_dir,exist_ok=True)
+            # Write to a temp file and rename so concurrent workers never read a partial file
+            fd,tmp = tempfile.mkstemp(dir=self.cache_dir,suffix=".tmp")
+            with os.fdopen(fd,"w",encoding="utf-8") as f:
+                json.dump(payload,f)
+            os.replace(tmp,self._path(identity))
+        except OSError as e:
+            print(f"Could not write schema cache: {e}")
+
+    def clear(self,identity:str)->None:
+        path = self._path(identity)
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,4 +1,4 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 
 class DBSchemaFormatter:
@@ -35,6 +35,26 @@ class DBSchemaFormatter:
         return "\n".join(txt)
 
 
+    @classmethod
+    def build_RelationshipText(cls,foreign_keys:List) -> str:
+        if not foreign_keys:
+            return ""
+        lines = ["Relationships:"]
+        for fk in foreign_keys:
+            cols = ", ".join(fk.columns)
+            refs = ", ".join(fk.ref_columns)
+            lines.append(f"- {fk.table}({cols}) -> {fk.ref_table}({refs})")
+        return "\n".join(lines)
+
+    @classmethod
+    def build_JoinPathText(cls,paths:Dict[Tuple[str,str],List]) -> str:
+        if not paths:
+            return ""
+        lines = ["Join paths:"]
+        for (src,dst),path in paths.items():
+            lines.append(f"- {src} ~ {dst}: " + " ; ".join(fk.condition() for fk in path))
+        return "\n".join(lines)
+
     @classmethod
     def _normalize_type(cls, col: Dict[str, str]) -> str:
         dtype = col.get("DATA_TYPE", "").upper()
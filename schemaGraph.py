@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import OrderedDict,deque
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from typing import Dict,List,Optional,Set,Tuple
+load_dotenv()
+
+
+@dataclass(frozen=True)
+class ForeignKey:
+    table : str
+    columns : Tuple[str,...]
+    ref_table : str
+    ref_columns : Tuple[str,...]
+
+    def condition(self)->str:
+        return " AND ".join(
+            f"{self.table}.{col} = {self.ref_table}.{ref}"
+            for col,ref in zip(self.columns,self.ref_columns)
+        )
+
+
+class SchemaGraph:
+    """
+    Undirected adjacency graph of the foreign keys in one database, with a
+    bounded LRU cache of shortest join paths between table pairs.
+    """
+
+    def __init__(self,foreign_keys:List[dict],cache_size:Optional[int]=None) -> None:
+        self.foreign_keys = self._group(foreign_keys)
+        self.adjacency:Dict[str,List[Tuple[str,ForeignKey]]] = {}
+        for fk in self.foreign_keys:
+            self.adjacency.setdefault(fk.table,[]).append((fk.ref_table,fk))
+            self.adjacency.setdefault(fk.ref_table,[]).append((fk.table,fk))
+        self.cache_size = cache_size or int(os.getenv("CHATDB_JOIN_PATH_CACHE",4096))
+        self._paths:OrderedDict = OrderedDict()
+        # Shared by every request thread of the user
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _group(rows:List[dict])->List[ForeignKey]:
+        # Composite keys arrive as one row per column, ordered by ORDINAL_POSITION
+        grouped:Dict[Tuple[str,str],List[dict]] = {}
+        for row in rows:
+            grouped.setdefault((row['TABLE_NAME'],row['CONSTRAINT_NAME']),[]).append(row)
+        return [
+            ForeignKey(
+                table=cols[0]['TABLE_NAME'],
+                columns=tuple(c['COLUMN_NAME'] for c in cols),
+                ref_table=cols[0]['REFERENCED_TABLE_NAME'],
+                ref_columns=tuple(c['REFERENCED_COLUMN_NAME'] for c in cols)
+            )
+            for cols in grouped.values()
+        ]
+
+    def links(self)->Dict[str,Set[str]]:
+        return {table:{other for other,_ in edges} for table,edges in self.adjacency.items()}
+
+    def edges_between(self,tables:List[str])->List[ForeignKey]:
+        wanted = set(tables)
+        return [fk for fk in self.foreign_keys if fk.table in wanted and fk.ref_table in wanted]
+
+    def join_path(self,src:str,dst:str,max_hops:int=4)->Optional[List[ForeignKey]]:
+        """
+        Shortest chain of foreign keys joining src to dst (BFS), or None when
+        they are not connected within max_hops.
+        """
+        key = (src,dst) if src <= dst else (dst,src)
+        with self._lock:
+            if key in self._paths:
+                self._paths.move_to_end(key)
+                return self._paths[key]
+        path = self._bfs(key[0],key[1],max_hops)
+        with self._lock:
+            self._paths[key] = path
+            if len(self._paths) > self.cache_size:
+                self._paths.popitem(last=False)
+        return path
+
+    def _bfs(self,src:str,dst:str,max_hops:int)->Optional[List[ForeignKey]]:
+        if src == dst or src not in self.adjacency or dst not in self.adjacency:
+            return None
+        parents:Dict[str,Tuple[str,ForeignKey]] = {src:None}
+        frontier = deque([(src,0)])
+        while frontier:
+            table,depth = frontier.popleft()
+            if depth == max_hops:
+                continue
+            for other,fk in self.adjacency[table]:
+                if other in parents:
+                    continue
+                parents[other] = (table,fk)
+                if other == dst:
+                    path = []
+                    while parents[other]:
+                        other,fk = parents[other]
+                        path.append(fk)
+                    return path[::-1]
+                frontier.append((other,depth+1))
+        return None
+
+    def precompute(self)->None:
+        """
+        Warms the path cache for many-to-many pairs, i.e. two tables that are
+        both referenced by the same bridge table (film <-> category via film_category).
+        """
+        for table,edges in self.adjacency.items():
+            outgoing = sorted({fk.ref_table for _,fk in edges if fk.table == table})
+            for i,a in enumerate(outgoing):
+                for b in outgoing[i+1:]:
+                    self.join_path(a,b)
+
+    def multi_hop_paths(self,tables:Optional[List[str]]=None)->Dict[Tuple[str,str],List[ForeignKey]]:
+        """
+        Cached paths of two or more hops, restricted to pairs inside `tables`
+        when given (pairs joined by a single FK are already listed as relationships).
+        """
+        if tables is None:
+            with self._lock:
+                return {pair:path for pair,path in self._paths.items() if path and len(path) > 1}
+        paths = {}
+        ordered = sorted(set(tables))
+        for i,a in enumerate(ordered):
+            for b in ordered[i+1:]:
+                path = self.join_path(a,b)
+                if path and len(path) > 1:
+                    paths[(a,b)] = path
+        return paths
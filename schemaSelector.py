@@ -0,0 +1,159 @@
+import os
+import re
+import math
+from collections import Counter
+from dotenv import load_dotenv
+from schemaFormatter import DBSchemaFormatter
+from schemaGraph import SchemaGraph
+from typing import Dict,List,Any,Set,Optional
+load_dotenv()
+
+# Shared with valueIndex
+STOPWORDS = {
+    "a","an","the","of","in","on","for","to","by","per","and","or","with","from","at","as",
+    "is","are","was","were","be","me","my","our","all","each","every","what","which","who",
+    "how","many","much","show","list","find","get","give","top","most","least","number",
+    "count","total","please","that","than","their","there","do","does","did","have","has",
+}
+
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_CAMEL = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def stem(token:str)->str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if token.endswith("sses"):
+        return token[:-2]
+    for suffix in ("ing","ed"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    if token.endswith("al") and len(token) - 2 >= 4:
+        return token[:-2]
+    if token.endswith("s") and not token.endswith("ss") and len(token) > 3:
+        return token[:-1]
+    return token
+
+
+def identifier_tokens(name:str)->List[str]:
+    parts = _WORD.findall(_CAMEL.sub(" ",name).replace("_"," "))
+    return [stem(p.lower()) for p in parts]
+
+
+def question_tokens(text:str)->List[str]:
+    return [stem(w) for w in (w.lower() for w in _WORD.findall(text)) if w not in STOPWORDS]
+
+
+class SchemaSelector:
+    """
+    Picks the tables relevant to a question with a BM25 index over table and
+    column names, then adds the tables needed to join them. Only the selected
+    tables (and the foreign keys / join paths between them) are rendered into the prompt.
+    """
+
+    K1 = 1.5
+    B = 0.75
+    NAME_WEIGHT = 3
+    MAX_JOIN_PATHS = 12
+
+    def __init__(
+        self,
+        db_name:str,
+        tables:Dict[str,Dict[str,Any]],
+        top_k:Optional[int]=None,
+        min_tables:Optional[int]=None,
+        graph:Optional[SchemaGraph]=None
+    ) -> None:
+        self.db_name = db_name
+        self.tables = tables
+        self.top_k = top_k if top_k is not None else int(os.getenv("CHATDB_SCHEMA_TOP_K",8))
+        self.min_tables = min_tables if min_tables is not None else int(os.getenv("CHATDB_SCHEMA_PRUNE_MIN",20))
+        self.graph = graph
+        # Real foreign keys when they were introspected, naming heuristics otherwise
+        if graph and graph.foreign_keys:
+            self.links = {name:set() for name in tables}
+            for name,neighbours in graph.links().items():
+                self.links.setdefault(name,set()).update(neighbours)
+        else:
+            self.links = self._infer_links(tables)
+        self._build_index()
+
+    def _build_index(self)->None:
+        # Inverted index: term -> [(table, term frequency)]
+        self._postings:Dict[str,List[tuple]] = {}
+        self._lengths:Dict[str,int] = {}
+        for name,table in self.tables.items():
+            tokens = identifier_tokens(name) * self.NAME_WEIGHT
+            for col in table.get("columns",[]):
+                tokens.extend(identifier_tokens(col))
+            self._lengths[name] = len(tokens)
+            for term,freq in Counter(tokens).items():
+                self._postings.setdefault(term,[]).append((name,freq))
+        n = max(len(self.tables),1)
+        self._idf = {
+            term:math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term,posting in self._postings.items()
+        }
+        self._avg_len = (sum(self._lengths.values()) / n) or 1.0
+
+    @staticmethod
+    def _infer_links(tables:Dict[str,Dict[str,Any]])->Dict[str,Set[str]]:
+        """
+        Approximates foreign keys from naming: a column `<table>_id` or
+        `<prefix>_<table>_id` links to `<table>`.
+        """
+        links:Dict[str,Set[str]] = {name:set() for name in tables}
+        for name,table in tables.items():
+            for col in table.get("columns",[]):
+                col = col.lower()
+                if not col.endswith("_id"):
+                    continue
+                for other in tables:
+                    if other != name and (col == f"{other.lower()}_id" or col.endswith(f"_{other.lower()}_id")):
+                        links[name].add(other)
+                        links[other].add(name)
+        return links
+
+    def score(self,question:str)->Dict[str,float]:
+        scores:Dict[str,float] = {}
+        for term in set(question_tokens(question)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for name,freq in self._postings[term]:
+                norm = freq + self.K1 * (1 - self.B + self.B * self._lengths[name] / self._avg_len)
+                scores[name] = scores.get(name,0.0) + idf * freq * (self.K1 + 1) / norm
+        return scores
+
+    def select(self,question:str)->List[str]:
+        if len(self.tables) <= self.min_tables:
+            return list(self.tables)
+        scores = self.score(question)
+        if not scores:
+            return list(self.tables)
+        seeds = sorted(scores,key=scores.get,reverse=True)[:self.top_k]
+        selected = set(seeds)
+        # Bridge tables (e.g. film_category) that join two selected tables not linked directly
+        for name,neighbours in self.links.items():
+            if name in selected:
+                continue
+            adjacent = [seed for seed in seeds if seed in neighbours]
+            if any(b not in self.links.get(a,()) for i,a in enumerate(adjacent) for b in adjacent[i+1:]):
+                selected.add(name)
+        return [name for name in self.tables if name in selected]
+
+    def build_context(self,question:str)->str:
+        names = self.select(question)
+        shortest = {}
+        if self.graph:
+            paths = self.graph.multi_hop_paths(names)
+            shortest = dict(sorted(paths.items(),key=lambda item:len(item[1]))[:self.MAX_JOIN_PATHS])
+            # A join path may go through tables that were pruned: send their columns too
+            on_paths = {t for path in shortest.values() for fk in path for t in (fk.table,fk.ref_table)}
+            names = [name for name in self.tables if name in on_paths or name in names]
+        txt = [DBSchemaFormatter.build_DBSchemaText(db_name=self.db_name,tables=[{'TABLE_NAME':name} for name in names])]
+        txt.extend(self.tables[name]["text"] for name in names)
+        if self.graph:
+            txt.append(DBSchemaFormatter.build_RelationshipText(self.graph.edges_between(names)))
+            txt.append(DBSchemaFormatter.build_JoinPathText(shortest))
+        return "\n".join(t for t in txt if t)
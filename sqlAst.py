@@ -0,0 +1,178 @@
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from dotenv import load_dotenv
+from sqlglot import exp
+from sqlglot.dialects.dialect import Dialect
+from sqlglot.errors import SqlglotError
+from sqlglot.tokens import TokenType
+from typing import List,Optional,Tuple
+load_dotenv()
+
+_MYSQL = Dialect.get_or_raise("mysql")
+
+# Non-MySQL constructs, checked on tokens so string literals and identifiers never match
+_FORBIDDEN_TOKENS = {
+    TokenType.ILIKE:"ILIKE",
+    TokenType.DCOLON:"::type cast",
+    TokenType.RETURNING:"RETURNING",
+}
+# (token, next token) pairs
+_FORBIDDEN_PAIRS = {
+    (TokenType.FILTER,TokenType.L_PAREN):"FILTER (...)",
+    (TokenType.LIMIT,TokenType.ALL):"LIMIT ALL",
+}
+
+# Driver placeholders (%s, %(name)s) outside quoted text; sqlglot reads them as modulo
+_DRIVER_PARAMS = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)|%\(\w+\)s|%s""")
+
+# Functions whose result changes between runs of the same statement on the same data
+_VOLATILE = {
+    "NOW","SYSDATE","CURDATE","CURTIME","CURRENT_DATE","CURRENT_TIME","CURRENT_TIMESTAMP",
+    "CURRENT_DATETIME","LOCALTIME","LOCALTIMESTAMP","UTC_DATE","UTC_TIME","UTC_TIMESTAMP",
+    "UNIX_TIMESTAMP","RAND","RANDOM","UUID","UUID_SHORT","USER","CURRENT_USER","SESSION_USER",
+    "SYSTEM_USER","CONNECTION_ID","LAST_INSERT_ID","FOUND_ROWS","ROW_COUNT","SLEEP",
+}
+
+_READ_ROOTS = (exp.Select,exp.SetOperation,exp.Subquery)
+# Anything that writes, changes the schema or takes locks
+_FORBIDDEN_NODES = tuple(
+    getattr(exp,name) for name in (
+        "Insert","Update","Delete","Merge","Drop","Alter","Create","TruncateTable",
+        "Command","Set","Grant","Revoke","Into","Lock",
+    ) if hasattr(exp,name)
+)
+
+
+class SQLAnalysisError(ValueError):
+    """
+    kind is one of: syntax, multiple, dialect, read_only, forbidden
+    """
+    def __init__(self,kind:str,message:str) -> None:
+        super().__init__(message)
+        self.kind = kind
+
+
+@dataclass(frozen=True)
+class StatementInfo:
+    sql : str
+    tree : Optional[exp.Expression]
+    tables : Tuple[str,...]
+    error : Optional[SQLAnalysisError]
+
+    def check(self)->"StatementInfo":
+        if self.error:
+            raise self.error
+        return self
+
+
+def _clean(sql:str)->str:
+    return sql.strip().rstrip(";").strip()
+
+
+def _neutral(sql:str)->str:
+    # Parsed as ? placeholders, so parameterised queries analyse like prepared ones
+    return _DRIVER_PARAMS.sub(lambda m:m.group(1) or "?",sql)
+
+
+@lru_cache(maxsize=int(os.getenv("CHATDB_SQL_AST_CACHE",4096)))
+def _analyze(sql:str)->StatementInfo:
+    try:
+        tokens = _MYSQL.tokenize(sql)
+    except SqlglotError as e:
+        return StatementInfo(sql,None,(),SQLAnalysisError("syntax",f"Could not tokenize SQL: {e}"))
+
+    for i,token in enumerate(tokens):
+        name = _FORBIDDEN_TOKENS.get(token.token_type)
+        if name is None and i+1 < len(tokens):
+            name = _FORBIDDEN_PAIRS.get((token.token_type,tokens[i+1].token_type))
+        if name:
+            return StatementInfo(sql,None,(),SQLAnalysisError("dialect",f"Non-MySQL SQL detected: {name}"))
+
+    try:
+        trees = [tree for tree in _MYSQL.parser().parse(tokens,sql) if tree is not None]
+    except SqlglotError as e:
+        return StatementInfo(sql,None,(),SQLAnalysisError("syntax",f"Invalid SQL: {e}"))
+    if len(trees) != 1:
+        return StatementInfo(sql,None,(),SQLAnalysisError("multiple",f"Expected exactly one SQL statement, found {len(trees)}"))
+
+    tree = trees[0]
+    if not isinstance(tree,_READ_ROOTS):
+        return StatementInfo(sql,tree,(),SQLAnalysisError("read_only","Only SELECT or WITH SELECT queries are allowed"))
+    forbidden = tree.find(*_FORBIDDEN_NODES)
+    if forbidden is not None:
+        return StatementInfo(sql,tree,(),SQLAnalysisError("forbidden",f"Query contains a forbidden {forbidden.key.upper()} clause (DDL/DML not allowed)"))
+    return StatementInfo(sql,tree,_tables(tree),None)
+
+
+def _tables(tree:exp.Expression)->Tuple[str,...]:
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    tables:List[str] = []
+    for table in tree.find_all(exp.Table):
+        if not table.name or (not table.db and table.name.lower() in ctes):
+            continue
+        name = f"{table.db}.{table.name}" if table.db else table.name
+        if name not in tables:
+            tables.append(name)
+    return tuple(tables)
+
+
+def analyze(sql:str)->StatementInfo:
+    """
+    Tokenizes and parses one statement (MySQL dialect) once and caches the
+    outcome, so the plan validator, the execution guards and the result cache
+    all share a single parse. Never raises; see StatementInfo.error.
+    """
+    return _analyze(_neutral(_clean(sql)))
+
+
+def check(sql:str)->StatementInfo:
+    return analyze(sql).check()
+
+
+def referenced_tables(sql:str)->List[str]:
+    info = analyze(sql)
+    return list(info.tables)
+
+
+def volatile(sql:str)->bool:
+    """
+    True when the statement calls NOW(), RAND(), UUID(), USER() or another
+    function whose value is not fixed by the data it reads.
+    """
+    info = analyze(sql)
+    if info.tree is None:
+        return False
+    for node in info.tree.find_all(exp.Func):
+        name = node.name if isinstance(node,exp.Anonymous) else node.sql_name()
+        if name.upper() in _VOLATILE:
+            return True
+    return False
+
+
+def bounded(sql:str,limit:int)->str:
+    """
+    Appends LIMIT to a valid read-only statement whose outermost query has
+    none, so the server stops after `limit` rows. The original text is kept
+    as written (on its own line in case it ends with a -- comment). A larger
+    literal outer LIMIT is lowered to `limit`; that rewrites the statement
+    from its tree, so it is skipped for %s-style parameterised text.
+    """
+    info = analyze(sql)
+    if info.error is not None:
+        return sql
+    text = _clean(sql)
+    current = info.tree.args.get("limit")
+    if current is None:
+        return f"{text}\nLIMIT {int(limit)}"
+    value = current.args.get("expression") if isinstance(current,exp.Limit) else None
+    if info.sql != text or not isinstance(value,exp.Literal) or value.is_string or not value.this.isdigit() or int(value.this) <= limit:
+        return sql
+    tree = info.tree.copy()
+    tree.args["limit"].set("expression",exp.Literal.number(int(limit)))
+    return tree.sql(dialect="mysql")
+
+
+def cache_info():
+    return _analyze.cache_info()
@@ -0,0 +1,49 @@
+import contextlib
+import pytest
+from SQL import QueryCostError
+from init_user import InitUser,PlanRestarted
+
+
+def plan(sql:str)->str:
+    return f"Step1: first `{sql}`\nStep2: second `{sql} LIMIT 1`\n"
+
+
+class Chat:
+    def __init__(self) -> None:
+        self.feedback = []
+
+    def chat(self,q:str,feedback=None,deadline=None)->str:
+        self.feedback.append(feedback)
+        return plan("SELECT 2")
+
+    def chat_stream(self,q:str):
+        yield plan("SELECT 1")
+
+
+class Executer:
+    def session(self):
+        return contextlib.nullcontext("conn")
+
+    def execute_step(self,step:dict,conn=None,deadline=None):
+        # The rejected plan's first step has already been streamed when its second is refused
+        if step['sql'] == "SELECT 1 LIMIT 1":
+            raise QueryCostError("step 2 reads too many rows")
+        return step['sql']
+
+    def execute(self,sql_cmds,deadline=None):
+        return [self.execute_step(step) for step in sql_cmds]
+
+
+@pytest.fixture
+def user(monkeypatch):
+    monkeypatch.setattr(InitUser,"response_cache",None)
+    monkeypatch.setattr(InitUser,"plan_templates",None)
+    user = InitUser("u","p","db")
+    user._chat,user._executer = Chat(),Executer()
+    return user
+
+
+def test_a_rejected_stream_restarts_with_the_whole_new_plan(user):
+    results = list(user.chat_stream("q"))
+    assert results == ["SELECT 1",PlanRestarted("step 2 reads too many rows",1),"SELECT 2","SELECT 2 LIMIT 1"]
+    assert user._chat.feedback == ["step 2 reads too many rows"]
@@ -0,0 +1,120 @@
+import pytest
+from fakeGemini import FakeGemini
+from modelRouter import ModelRouter
+
+QUERY = {'model':None,'query':'how many films are there','base_prompt':'schema'}
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self)->float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def router(backend,clock,**kwargs)->ModelRouter:
+    kwargs.setdefault("policy","preference")
+    return ModelRouter(backend,["a","b"],clock=clock,**kwargs)
+
+
+def test_quota_error_opens_the_breaker_and_falls_back(clock):
+    backend = FakeGemini(errors={"a":"QUOTA_EXCEEDED"})
+    r = router(backend,clock,quota_cooldown=60)
+    assert r.route(QUERY).response is not None
+    assert backend.calls == ["a","b"]
+    assert r.health["a"].state == "open"
+    assert r.candidates() == ["b"]
+
+
+def test_transient_errors_open_the_breaker_after_the_threshold(clock):
+    r = router(FakeGemini(),clock,failure_threshold=3)
+    for _ in range(2):
+        r.record_failure("a","TRANSIENT_ERROR")
+    assert r.health["a"].state == "closed"
+    r.record_failure("a","TRANSIENT_ERROR")
+    assert r.health["a"].state == "open"
+
+
+def test_cooldown_expiry_makes_the_model_half_open(clock):
+    r = router(FakeGemini(),clock,quota_cooldown=60)
+    r.record_failure("a","QUOTA_EXCEEDED")
+    clock.now = 61
+    assert r.candidates() == ["a","b"]
+    assert r.health["a"].state == "half_open"
+
+
+def test_only_one_request_probes_a_half_open_model(clock):
+    r = router(FakeGemini(),clock,quota_cooldown=60)
+    r.record_failure("a","QUOTA_EXCEEDED")
+    clock.now = 61
+    r.candidates()
+    assert r._claim("a")
+    assert not r._claim("a")
+    assert r.candidates() == ["b"]
+    r.record_success("a",0.1)
+    assert r.health["a"].state == "closed"
+    assert r.candidates() == ["a","b"]
+
+
+def test_untried_half_open_model_is_not_claimed(clock):
+    backend = FakeGemini()
+    r = router(backend,clock,quota_cooldown=60)
+    r.record_failure("b","QUOTA_EXCEEDED")
+    clock.now = 61
+    # "a" answers first, so "b" is never tried and stays free to probe
+    assert r.route(QUERY).response is not None
+    assert backend.calls == ["a"]
+    assert r.health["b"].probe_until == 0.0
+    assert r._claim("b")
+
+
+def test_failed_probe_reopens_with_a_longer_cooldown(clock):
+    backend = FakeGemini(errors={"a":["QUOTA_EXCEEDED","TRANSIENT_ERROR"]})
+    r = router(backend,clock,quota_cooldown=60,breaker_cooldown=30)
+    r.route(QUERY)
+    clock.now = 61
+    r.route(QUERY)
+    h = r.health["a"]
+    assert h.state == "open"
+    assert h.cooldown == 120
+    assert h.probe_until == 0.0
+
+
+def test_probe_claim_times_out(clock):
+    r = router(FakeGemini(),clock,quota_cooldown=60,probe_timeout=10)
+    r.record_failure("a","QUOTA_EXCEEDED")
+    clock.now = 61
+    r.candidates()
+    assert r._claim("a")
+    clock.now = 72
+    assert r._claim("a")
+
+
+def test_fastest_policy_prefers_the_lower_latency(clock):
+    r = router(FakeGemini(),clock,policy="fastest")
+    r.record_success("a",2.0)
+    r.record_success("b",0.5)
+    assert r.candidates() == ["b","a"]
+
+
+def test_hedge_wins_when_the_first_model_is_slow():
+    backend = FakeGemini(latency={"a":0.5,"b":0.0})
+    r = ModelRouter(backend,["a","b"],policy="preference",hedge_budget=1.0)
+    response = r.route_hedged(QUERY,hedge_after=0.05)
+    assert response.response is not None
+    assert r.costs["hedges"] == 1
+    assert r.costs["hedge_wins"] == 1
+
+
+def test_hedges_respect_the_budget():
+    backend = FakeGemini(latency={"a":0.1,"b":0.0})
+    r = ModelRouter(backend,["a","b"],policy="preference",hedge_budget=0.0)
+    r.route_hedged(QUERY,hedge_after=0.01)
+    assert r.costs["hedges"] == 0
+    assert r.costs["hedges_skipped"] == 1
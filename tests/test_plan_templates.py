@@ -0,0 +1,54 @@
+import pytest
+from planTemplate import PlanTemplates
+
+
+def step(sql:str,number:int=1)->dict:
+    return {'step_number':number,'description':'d','sql':sql,'depends_on':[]}
+
+
+@pytest.fixture
+def templates():
+    return PlanTemplates(max_entries=16)
+
+
+def test_literals_become_slots_in_text_order(templates):
+    plan = [step("SELECT f.title FROM film AS f JOIN category AS c ON c.category_id = f.category_id WHERE c.name = 'Action' LIMIT 3;")]
+    assert templates.learn("top 3 films in category 'Action'","fp",plan) is not None
+    matched = templates.match("top 5 films in category 'Comedy'","fp")
+    assert matched[0]['sql'].count("?") == 2
+    assert matched[0]['params'] == ['Comedy',5]
+    assert 'slots' not in matched[0]
+
+
+def test_other_shapes_and_fingerprints_miss(templates):
+    templates.learn("films in category 'Action'","fp",[step("SELECT title FROM film_list WHERE category = 'Action';")])
+    assert templates.match("films in category 'Action'","other") is None
+    assert templates.match("actors in category 'Action'","fp") is None
+
+
+def test_a_literal_matching_several_sql_literals_is_not_learned(templates):
+    plan = [step("SELECT * FROM customer WHERE store_id = 1 AND active = 1;")]
+    assert templates.learn("customers of store 1","fp",plan) is None
+    assert templates.match("customers of store 2","fp") is None
+
+
+def test_a_slot_value_inside_another_literal_is_not_learned(templates):
+    plan = [step("SELECT title FROM film WHERE title LIKE '%Academy%' OR title = 'Academy';")]
+    assert templates.learn("films called 'Academy'","fp",plan) is None
+
+
+def test_literals_not_in_the_sql_must_match_exactly(templates):
+    plan = [step("SELECT COUNT(*) FROM rental WHERE MONTH(rental_date) = 5 AND staff_id = 2;")]
+    assert templates.learn("rentals by staff 2 in month May","fp",plan) is not None
+    assert templates.match("rentals by staff 1 in month June","fp") is None
+    assert templates.match("rentals by staff 1 in month May","fp")[0]['params'] == [1]
+
+
+def test_plans_without_literals_are_not_learned(templates):
+    assert templates.learn("how many films are there","fp",[step("SELECT COUNT(*) FROM film;")]) is None
+
+
+def test_invalidate(templates):
+    templates.learn("films in category 'Action'","fp",[step("SELECT title FROM film_list WHERE category = 'Action';")])
+    templates.invalidate("fp")
+    assert templates.match("films in category 'Drama'","fp") is None
@@ -0,0 +1,61 @@
+import pytest
+from responseCache import ResponseCache
+
+PLAN = [{'step_number':1,'sql':'SELECT 1;','depends_on':[]}]
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(max_entries=16,ttl=60)
+
+
+def test_exact_hit_ignores_case_spacing_and_punctuation(cache):
+    cache.put("How many films are there?","fp",PLAN)
+    assert cache.get("  how many   FILMS are there","fp") == PLAN
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_near_duplicate_hit(cache):
+    cache.put("list the customers who have rented a film in category Action","fp",PLAN)
+    assert cache.get("show customers who have rented a film in category Action","fp") == PLAN
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_schema_fingerprint_is_part_of_the_key(cache):
+    cache.put("how many films are there","fp",PLAN)
+    assert cache.get("how many films are there","other") is None
+
+
+def test_different_literals_miss(cache):
+    cache.put("top 3 films by rental count","fp",PLAN)
+    assert cache.get("top 5 films by rental count","fp") is None
+
+
+@pytest.mark.parametrize("cached,asked",[
+    ("customers who have rented a film in category Action","customers who have not rented a film in category Action"),
+    ("customers who have rented a film in category Action","customers who haven't rented a film in category Action"),
+    ("films with rental rate above average","films with rental rate not above average"),
+    ("films with rental rate above average","films with rental rate below average"),
+    ("customers with the most rentals in store 1","customers with the least rentals in store 1"),
+    ("films rented by customers in store 1","films never rented by customers in store 1"),
+    ("actors in films of category Action","actors in films without category Action"),
+])
+def test_polarity_words_force_a_miss(cache,cached,asked):
+    cache.put(cached,"fp",PLAN)
+    assert cache.get(asked,"fp") is None
+    assert cache.get(cached,"fp") == PLAN
+
+
+def test_expired_entries_are_dropped():
+    cache = ResponseCache(ttl=0)
+    cache.put("how many films are there","fp",PLAN)
+    assert cache.get("how many films are there","fp") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2,ttl=60)
+    for i,table in enumerate(("film","actor","store")):
+        cache.put(f"how many rows are in {table}","fp",PLAN)
+    assert cache.get("how many rows are in film","fp") is None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,46 @@
+import pytest
+import sqlAst
+
+
+def test_driver_placeholders_analyse_like_prepared_ones():
+    assert sqlAst.analyze("SELECT * FROM film WHERE film_id = %s").error is None
+    assert sqlAst.analyze("SELECT * FROM film WHERE title = %(title)s").error is None
+    # Inside a string literal %s is text, not a placeholder
+    assert sqlAst.analyze("SELECT * FROM film WHERE title LIKE '%s'").sql.endswith("'%s'")
+
+
+@pytest.mark.parametrize("sql,kind",[
+    ("DELETE FROM film","read_only"),
+    ("SELECT 1; SELECT 2","multiple"),
+    ("SELECT title INTO @t FROM film","forbidden"),
+    ("SELECT * FROM film FOR UPDATE","forbidden"),
+])
+def test_writes_and_several_statements_are_errors(sql,kind):
+    assert sqlAst.analyze(sql).error.kind == kind
+
+
+def test_tables_skip_ctes():
+    sql = "WITH top AS (SELECT film_id FROM rental) SELECT * FROM top JOIN film USING (film_id)"
+    assert sorted(sqlAst.referenced_tables(sql)) == ["film","rental"]
+
+
+def test_bounded_appends_a_missing_limit():
+    assert sqlAst.bounded("SELECT * FROM film -- all;",101) == "SELECT * FROM film -- all\nLIMIT 101"
+
+
+def test_bounded_lowers_only_a_larger_literal_limit():
+    assert "LIMIT 101" in sqlAst.bounded("SELECT * FROM film LIMIT 5000",101)
+    assert sqlAst.bounded("SELECT * FROM film LIMIT 10",101) == "SELECT * FROM film LIMIT 10"
+    # Rewriting from the tree would lose the driver placeholder
+    sql = "SELECT * FROM film WHERE rating = %s LIMIT 5000"
+    assert sqlAst.bounded(sql,101) == sql
+
+
+@pytest.mark.parametrize("sql,expected",[
+    ("SELECT * FROM rental WHERE rental_date > NOW() - INTERVAL 1 DAY",True),
+    ("SELECT * FROM film ORDER BY RAND() LIMIT 1",True),
+    ("SELECT UUID()",True),
+    ("SELECT COUNT(*) FROM film WHERE rental_date > '2005-05-01'",False),
+])
+def test_volatile(sql,expected):
+    assert sqlAst.volatile(sql) is expected
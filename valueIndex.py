@@ -0,0 +1,301 @@
+import os
+import re
+import time
+import threading
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from SQL import Mysql,TruncatedResult
+from schema import DBSchema
+from schemaSelector import STOPWORDS
+from resultCache import DataVersionProbe,UNKNOWN
+from typing import Any,Dict,List,Optional,Set,Tuple
+load_dotenv()
+
+_WORD = re.compile(r"[a-z0-9]+")
+_TEXT_TYPES = {"char","varchar","enum","set"}
+_LENGTH = re.compile(r"\((\d+)\)")
+
+
+def _normalize(text:str)->str:
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def _trigrams(text:str)->Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class ColumnValues:
+    table : str
+    column : str
+    key_column : Optional[str]
+    # value -> primary key when the value names exactly one sampled row, else None
+    values : Dict[str,Any]
+
+
+@dataclass(frozen=True)
+class ValueMatch:
+    table : str
+    column : str
+    value : str
+    key_column : Optional[str]
+    key : Any
+    score : float
+
+    def hint(self)->str:
+        value = self.value.replace("'","''")
+        if self.key_column is not None and self.key is not None:
+            return f"- {self.table}.{self.column} = '{value}' ({self.table}.{self.key_column} = {self.key!r})"
+        return f"- {self.table}.{self.column} = '{value}'"
+
+
+class ValueIndex:
+    """
+    Sampled dictionary of the values of low-cardinality text columns
+    (CHAR/VARCHAR/ENUM/SET), so the planner is told that "action" is
+    category.name = 'Action' with category_id = 1 instead of spending a step
+    looking it up, or guessing the spelling.
+
+    - a column is kept when a sample of its rows has at most max_distinct
+      distinct values; the whole index holds at most max_values values
+    - lookup is fuzzy: question phrases of up to three words are matched
+      against values by trigram similarity
+    - refresh() re-samples only the tables whose data version (see
+      resultCache.DataVersionProbe) changed; lookups start it in the
+      background every refresh_interval seconds
+
+    CHATDB_VALUE_INDEX=1 builds one in InitUser.init.
+    """
+
+    def __init__(
+        self,
+        key:str,
+        db_name:str,
+        max_distinct:Optional[int]=None,
+        sample_rows:Optional[int]=None,
+        max_values:Optional[int]=None,
+        similarity:Optional[float]=None,
+        max_hints:Optional[int]=None,
+        refresh_interval:Optional[float]=None
+    ) -> None:
+        self.key = key
+        self.db_name = db_name
+        self.max_distinct = max_distinct or int(os.getenv("CHATDB_VALUE_INDEX_MAX_DISTINCT",200))
+        self.sample_rows = sample_rows or int(os.getenv("CHATDB_VALUE_INDEX_SAMPLE",50000))
+        self.max_values = max_values or int(os.getenv("CHATDB_VALUE_INDEX_MAX_VALUES",50000))
+        self.similarity = similarity if similarity is not None else float(os.getenv("CHATDB_VALUE_INDEX_SIMILARITY",0.6))
+        self.max_hints = max_hints or int(os.getenv("CHATDB_VALUE_INDEX_HINTS",8))
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(os.getenv("CHATDB_VALUE_INDEX_REFRESH",300))
+        self.probe = DataVersionProbe(mode="update_time",ttl=0)
+        self._columns:Dict[Tuple[str,str],ColumnValues] = {}
+        self._candidates:Dict[str,List[Tuple[str,Optional[str]]]] = {}
+        # table -> (data version, monotonic time) of its last sample, skipped columns included
+        self._sampled:Dict[str,Tuple[Any,float]] = {}
+        # Rebuilt from _columns after every change and swapped in whole
+        self._entries:List[Tuple[ColumnValues,str,str]] = []
+        self._exact:Dict[str,List[int]] = {}
+        self._grams:Dict[str,List[int]] = {}
+        self._sizes:List[int] = []
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._checked = time.monotonic()
+        self.counters = {"columns":0,"skipped_columns":0,"values":0,"lookups":0,"matches":0,"refreshes":0,"resampled_tables":0}
+
+    def build(self,columns:Optional[Dict[str,List[dict]]]=None)->"ValueIndex":
+        """
+        columns: per-table column rows as returned by DBSchema.get_ColumnsSchema
+        (InitUser passes the ones it already loaded); read when not given.
+        """
+        columns = columns if columns is not None else DBSchema.get_ColumnsSchema(user_key=self.key,db_name=self.db_name)
+        self._candidates = self._candidate_columns(columns)
+        versions = self._versions(list(self._candidates))
+        for table in self._candidates:
+            self._sample_table(table,versions.get(table,UNKNOWN))
+        self._reindex()
+        self._checked = time.monotonic()
+        return self
+
+    def _candidate_columns(self,columns:Dict[str,List[dict]])->Dict[str,List[Tuple[str,Optional[str]]]]:
+        candidates = {}
+        for table,schema in columns.items():
+            keys = [col['COLUMN_NAME'] for col in schema if col.get('COLUMN_KEY') == "PRI"]
+            key_column = keys[0] if len(keys) == 1 else None
+            picked = []
+            for col in schema:
+                if str(col.get('DATA_TYPE','')).lower() not in _TEXT_TYPES or col.get('COLUMN_KEY') == "PRI":
+                    continue
+                length = _LENGTH.search(str(col.get('COLUMN_TYPE','')))
+                # Long VARCHARs hold free text, not names
+                if length and int(length.group(1)) > 100:
+                    continue
+                picked.append((col['COLUMN_NAME'],key_column))
+            if picked:
+                candidates[table] = picked
+        return candidates
+
+    def _versions(self,tables:List[str])->Dict[str,Any]:
+        if not tables:
+            return {}
+        return dict(zip(tables,self.probe.versions(self.key,tables)))
+
+    def _sample_table(self,table:str,version:Any)->None:
+        total = sum(len(c.values) for k,c in self._columns.items() if k[0] != table)
+        candidates = self._candidates.get(table,[])
+        sampled = self._sample(table,candidates)
+        for (column,key_column),values in zip(candidates,sampled):
+            if values is None or total + len(values) > self.max_values:
+                self._columns.pop((table,column),None)
+                self.counters["skipped_columns"] += 1
+                continue
+            total += len(values)
+            self._columns[(table,column)] = ColumnValues(table,column,key_column,values)
+        self._sampled[table] = (version,time.monotonic())
+
+    def _sample(self,table:str,columns:List[Tuple[str,Optional[str]]])->List[Optional[Dict[str,Any]]]:
+        """
+        Distinct values of every candidate column of a table in one round trip,
+        each branch cut at max_distinct+1 values. None for a column with more
+        (not a lookup column) or when sampling failed.
+        """
+        if not columns:
+            return []
+        branches = []
+        for i,(column,key_column) in enumerate(columns):
+            key = f"`{key_column}`" if key_column else "NULL"
+            branches.append(
+                f"SELECT {i} AS c, v, k, n FROM (SELECT v, MIN(k) AS k, COUNT(*) AS n FROM "
+                f"(SELECT `{column}` AS v, {key} AS k FROM `{table}` WHERE `{column}` IS NOT NULL LIMIT {self.sample_rows}) AS s "
+                f"GROUP BY v LIMIT {self.max_distinct + 1}) AS b{i}"
+            )
+        try:
+            rows = Mysql.execute(self.key," UNION ALL ".join(branches),max_rows=len(columns) * (self.max_distinct + 1))
+        except Exception as e:
+            print(f"Could not sample {table} for the value index: {e}")
+            return [None] * len(columns)
+        if isinstance(rows,TruncatedResult) or not isinstance(rows,list):
+            return [None] * len(columns)
+        sampled:List[Optional[Dict[str,Any]]] = [{} for _ in columns]
+        for row in rows:
+            if str(row['v']).strip():
+                sampled[row['c']][str(row['v'])[:100]] = row['k'] if row['n'] == 1 else None
+        return [values if len(values) <= self.max_distinct else None for values in sampled]
+
+    def _reindex(self)->None:
+        entries,exact,grams,sizes = [],{},{},[]
+        for col in self._columns.values():
+            for value in col.values:
+                normalized = _normalize(value)
+                if not normalized:
+                    continue
+                i = len(entries)
+                entries.append((col,value,normalized))
+                exact.setdefault(normalized,[]).append(i)
+                # "scifi" and "sci fi" both name 'Sci-Fi'
+                if " " in normalized:
+                    exact.setdefault(normalized.replace(" ",""),[]).append(i)
+                trigrams = _trigrams(normalized)
+                sizes.append(len(trigrams))
+                for gram in trigrams:
+                    grams.setdefault(gram,[]).append(i)
+        with self._lock:
+            self._entries,self._exact,self._grams,self._sizes = entries,exact,grams,sizes
+            self.counters["columns"] = len(self._columns)
+            self.counters["values"] = len(entries)
+
+    def refresh(self)->List[str]:
+        """
+        Re-samples the tables whose data version changed (or is unknown and
+        older than refresh_interval). Returns the tables re-sampled.
+        """
+        versions = self._versions(list(self._candidates))
+        now = time.monotonic()
+        stale = []
+        for table in self._candidates:
+            sampled = self._sampled.get(table)
+            version = versions.get(table,UNKNOWN)
+            if sampled is None:
+                stale.append(table)
+            elif version is UNKNOWN or sampled[0] is UNKNOWN:
+                if now - sampled[1] > self.refresh_interval:
+                    stale.append(table)
+            elif sampled[0] != version:
+                stale.append(table)
+        for table in stale:
+            self._sample_table(table,versions.get(table,UNKNOWN))
+        if stale:
+            self._reindex()
+        with self._lock:
+            self.counters["refreshes"] += 1
+            self.counters["resampled_tables"] += len(stale)
+        return stale
+
+    def _maybe_refresh(self)->None:
+        with self._lock:
+            if self._refreshing or time.monotonic() - self._checked < self.refresh_interval:
+                return
+            self._refreshing = True
+            self._checked = time.monotonic()
+        def run()->None:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Value index refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+        threading.Thread(target=run,daemon=True,name="chatdb-value-index").start()
+
+    @staticmethod
+    def _phrases(question:str)->List[str]:
+        words = _WORD.findall(question.lower())
+        phrases = []
+        for size in (3,2,1):
+            for i in range(len(words) - size + 1):
+                gram = words[i:i+size]
+                if all(w in STOPWORDS for w in gram) or (size == 1 and len(gram[0]) < 3):
+                    continue
+                phrases.append(" ".join(gram))
+        return phrases
+
+    def lookup(self,question:str)->List[ValueMatch]:
+        self._maybe_refresh()
+        with self._lock:
+            entries,exact,grams,sizes = self._entries,self._exact,self._grams,self._sizes
+            self.counters["lookups"] += 1
+        best:Dict[int,float] = {}
+        for phrase in self._phrases(question):
+            for i in exact.get(phrase,()) or exact.get(phrase.replace(" ",""),()):
+                best[i] = 1.0
+            trigrams = _trigrams(phrase)
+            shared:Dict[int,int] = {}
+            for gram in trigrams:
+                for i in grams.get(gram,()):
+                    shared[i] = shared.get(i,0) + 1
+            for i,n in shared.items():
+                score = n / (len(trigrams) + sizes[i] - n)
+                if score >= self.similarity and score > best.get(i,0.0):
+                    best[i] = score
+        ranked = sorted(best.items(),key=lambda item:(-item[1],entries[item[0]][1]))[:self.max_hints]
+        matches = []
+        for i,score in ranked:
+            col,value,_ = entries[i]
+            matches.append(ValueMatch(col.table,col.column,value,col.key_column,col.values[value],round(score,3)))
+        if matches:
+            with self._lock:
+                self.counters["matches"] += 1
+        return matches
+
+    def hints(self,question:str)->str:
+        """
+        Prompt text listing the stored values the question seems to mention.
+        """
+        matches = self.lookup(question)
+        if not matches:
+            return ""
+        lines = "\n".join(match.hint() for match in matches)
+        return f"Known values that may be referred to (use these exact spellings and keys directly instead of a lookup step):\n{lines}"
+
+    def stats(self)->Dict[str,Any]:
+        with self._lock:
+            return dict(self.counters)